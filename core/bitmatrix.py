@@ -0,0 +1,205 @@
+# bitmatrix.py
+from scipy import sparse
+import numpy as np
+import refinement
+
+
+def _popcount(words):
+    """
+    Counts the set bits of every uint64 word.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # older numpy: look up the bytes in a table
+    table = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+    counts = table[words.view(np.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_rows(mask):
+    """
+    Packs the rows of a boolean matrix into uint64 words, bit j % 64 of word
+    j // 64 holding column j.
+
+    Parameters:
+        mask (ndarray (r, n), bool): the matrix
+
+    Returns:
+        (ndarray (r, ceil(n/64)), uint64): the packed rows
+    """
+    r, n = mask.shape
+    words = -(-n // 64)
+    packed = np.zeros((r, words*8), dtype=np.uint8)
+    packed[:, :-(-n // 8)] = np.packbits(mask, axis=1, bitorder='little')
+    return packed.view('<u8').astype(np.uint64)
+
+
+class BitMatrix:
+
+    """
+    A 0/1 adjacency matrix stored as bitsets, each row packed into
+    ceil(n/64) uint64 words. Dense graphs take n^2/8 bytes, which is 64 times
+    less than a dense int64 array and about 100 times less than CSR once half
+    of the entries are edges.
+
+    The refinement engine for this storage (bit_refinement) counts the inputs
+    of node i from a cell as the popcount of the AND of row i with the bitset
+    of the cell, 64 nodes at a time.
+
+    sparse.csr_matrix(B) and np.asarray(B) convert back, for the code that
+    needs a CSR matrix.
+
+    Attributes:
+        words (ndarray (n, ceil(n/64)), uint64): the packed rows
+        shape (tuple(int, int)): shape of the matrix
+        dtype (np.dtype): int, the type of the entries when converted
+
+    Methods:
+        from_words()
+        tocsr()
+        in_degrees()
+    """
+
+    def __init__(self, A):
+        """
+        Parameters:
+            A ((n,n) ndarray or sparse matrix): 0/1 adjacency matrix, where
+                A[i, j] is node i receiving from node j
+        """
+        n, m = A.shape
+        if n != m:
+            raise ValueError('Matrix not square')
+        if sparse.issparse(A):
+            A = sparse.coo_matrix(A)
+            A.sum_duplicates()
+            A.eliminate_zeros()
+            if np.any(A.data != 1):
+                raise ValueError('bit storage needs a 0/1 matrix')
+            words = np.zeros((n, -(-n // 64)), dtype=np.uint64)
+            np.bitwise_or.at(words, (A.row, A.col // 64),
+                             np.uint64(1) << (A.col % 64).astype(np.uint64))
+        else:
+            A = np.asarray(A)
+            if np.any((A != 0) & (A != 1)):
+                raise ValueError('bit storage needs a 0/1 matrix')
+            words = pack_rows(A != 0)
+        self.words = words
+        self.shape = (n, n)
+        self.dtype = np.dtype(int)
+
+    @classmethod
+    def from_words(cls, words, n):
+        """
+        Wraps already packed rows, see pack_rows.
+
+        Parameters:
+            words (ndarray (n, ceil(n/64)), uint64): the packed rows
+            n (int): number of nodes
+        """
+        B = cls.__new__(cls)
+        B.words = words
+        B.shape = (n, n)
+        B.dtype = np.dtype(int)
+        return B
+
+    def tocsr(self):
+        """
+        Returns:
+            (sparse.csr_matrix): the same matrix in CSR format
+        """
+        n = self.shape[0]
+        bits = np.unpackbits(self.words.astype('<u8').view(np.uint8),
+                             axis=1, bitorder='little')[:, :n]
+        rows, cols = np.nonzero(bits)
+        return sparse.csr_matrix((np.ones(rows.size, dtype=int), (rows, cols)),
+                                 shape=self.shape)
+
+    def in_degrees(self):
+        """
+        Returns:
+            (ndarray (n,)): number of inputs of every node
+        """
+        return _popcount(self.words).sum(axis=1, dtype=np.int64)
+
+    @property
+    def nnz(self):
+        return int(self.in_degrees().sum())
+
+    def __array__(self, dtype=None, copy=None):
+        n = self.shape[0]
+        bits = np.unpackbits(self.words.astype('<u8').view(np.uint8),
+                             axis=1, bitorder='little')[:, :n]
+        return bits.astype(self.dtype if dtype is None else dtype)
+
+    def __repr__(self):
+        return f'BitMatrix(n={self.shape[0]}, nnz={self.nnz})'
+
+
+def _cell_masks(colors, k, words):
+    """
+    Returns:
+        (ndarray (k, words), uint64): the bitset of the nodes of every color
+    """
+    nodes = np.arange(colors.size)
+    masks = np.zeros((k, words), dtype=np.uint64)
+    np.bitwise_or.at(masks, (colors, nodes // 64),
+                     np.uint64(1) << (nodes % 64).astype(np.uint64))
+    return masks
+
+
+def bit_refinement(B, initial=None):
+    """
+    Finds the coarsest equitable partition of a graph stored as a BitMatrix,
+    refining an initial partition with whole graph passes like
+    refinement.signature_refinement. The input counts of a node from every
+    color are popcounts of its row AND-ed with the bitsets of the colors.
+    Nodes that are alone in their cell cannot split, so a pass only counts
+    the inputs of the nodes in larger cells, and refinement stops as soon as
+    every node is alone, which dense random graphs reach after a few passes.
+
+    Parameters:
+        B (BitMatrix): adjacency matrix, where B[i, j] is node i receiving
+            from node j
+        initial (ndarray (n,)): initial color of each node. Defaults to every
+            node having the same color
+
+    Returns:
+        colors (ndarray (n,)): canonical color of each node (see
+            refinement.canonical_colors)
+    """
+    n = B.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    if initial is None:
+        initial = np.zeros(n, dtype=int)
+    colors = refinement.canonical_colors(np.asarray(initial))
+    words = B.words.shape[1]
+
+    while True:
+        k = colors.max() + 1
+        if k == n:
+            break
+        sizes = np.bincount(colors, minlength=k)
+        active = np.flatnonzero(sizes[colors] > 1)
+        masks = _cell_masks(colors, k, words)
+
+        # input counts of the active nodes from every color, a block of rows
+        # at a time to bound the memory of the AND-ed words
+        counts = np.empty((active.size, k), dtype=np.int64)
+        block = max(1, 2**22 // (k*words))
+        for a in range(0, active.size, block):
+            rows = B.words[active[a:a + block]]
+            counts[a:a + block] = _popcount(
+                rows[:, None, :] & masks[None, :, :]).sum(axis=2)
+
+        M = sparse.csr_matrix(counts)
+        hash1 = np.zeros(n, dtype=np.uint64)
+        hash2 = np.zeros(n, dtype=np.uint64)
+        hash1[active] = refinement._row_hashes(M, 1)
+        hash2[active] = refinement._row_hashes(M, 2)
+        refined, num_colors = refinement._rank_signatures(colors, hash1, hash2)
+        if num_colors == k:
+            break
+        colors = refined
+
+    return refinement.canonical_colors(colors)
@@ -0,0 +1,152 @@
+# coloring_cache.py
+from scipy import sparse
+import numpy as np
+import hashlib
+import tempfile
+import os
+import refinement
+
+
+class ColoringCache:
+
+    """
+    An on-disk cache of colorings, addressed by the content of the graph. The
+    key of a graph is a hash of its CSR arrays and of the refinement version,
+    so an identical graph hits the cache no matter where it was loaded from,
+    and changes to the coloring code invalidate old entries. Each entry is a
+    .npy file holding the int32 color of every node. Once the cache grows past
+    max_bytes, the least recently used entries are deleted.
+
+    Writes go through a temporary file and an atomic rename, so several
+    processes (e.g. MPI ranks) can share one cache directory.
+
+    Attributes:
+        directory (str): where the entries are stored
+        max_bytes (int): size limit of the cache
+
+    Methods:
+        key()
+        get()
+        put()
+        clear()
+    """
+
+    def __init__(self, directory, max_bytes=2**30):
+        """
+        Parameters:
+            directory (str): directory for the cache entries, created if it
+                does not exist
+            max_bytes (int): least recently used entries are evicted when the
+                entries take up more than this many bytes. Defaults to 1 GiB
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, A, *extra):
+        """
+        Parameters:
+            A (sparse matrix (n, n)): adjacency matrix of the graph
+            extra (str or ndarray): anything else the coloring depends on,
+                e.g. the initial colors
+
+        Returns:
+            (str): hex digest identifying the coloring of A
+        """
+        # bring A to a canonical CSR form so equal matrices hash equally
+        # (a BitMatrix converts itself without a dense copy)
+        A = sparse.csr_matrix(A.tocsr() if hasattr(A, 'tocsr') else A,
+                              copy=True)
+        A.sum_duplicates()
+        A.eliminate_zeros()
+        A.sort_indices()
+
+        digest = hashlib.sha256()
+        digest.update(f'refinement-{refinement.VERSION}'.encode())
+        digest.update(repr((A.shape, A.data.dtype.str)).encode())
+        for item in extra:
+            # arrays are hashed by content, repr would abbreviate them
+            if isinstance(item, np.ndarray):
+                digest.update(f'{item.dtype.str}{item.shape}'.encode())
+                digest.update(np.ascontiguousarray(item).tobytes())
+            else:
+                digest.update(repr(item).encode())
+        for array in (A.indptr.astype(np.int64), A.indices.astype(np.int64),
+                      A.data):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, A, *extra):
+        """
+        Looks up the coloring of a graph.
+
+        Parameters:
+            A (sparse matrix (n, n)): adjacency matrix of the graph
+            extra (str or ndarray): anything else the coloring depends on
+
+        Returns:
+            (ndarray (n,)): color of each node, or None if it is not cached
+        """
+        path = self._path(self.key(A, *extra))
+        try:
+            colors = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        # mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return colors.astype(int)
+
+    def put(self, A, colors, *extra):
+        """
+        Stores the coloring of a graph, then evicts old entries if needed.
+
+        Parameters:
+            A (sparse matrix (n, n)): adjacency matrix of the graph
+            colors (ndarray (n,)): color of each node
+            extra (str or ndarray): anything else the coloring depends on
+        """
+        path = self._path(self.key(A, *extra))
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(colors, dtype=np.int32))
+        os.replace(temp, path)
+        self._evict()
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in
+        max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Deletes every entry of the cache.
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                os.remove(os.path.join(self.directory, name))
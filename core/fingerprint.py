@@ -0,0 +1,138 @@
+# fingerprint.py
+from scipy import sparse
+import numpy as np
+import hashlib
+import pickle
+import tempfile
+import os
+import refinement
+from partition import Partition
+
+
+def fingerprint(A, colors=None):
+    """
+    Computes an isomorphism invariant fingerprint of a graph from its coarsest
+    equitable partition: the sizes of the cells and the quotient matrix, with
+    the cells put in an order that only depends on the structure of the graph.
+    Isomorphic (in particular identical) graphs always get the same
+    fingerprint, so graphs with different fingerprints are never isomorphic
+    and a lookup by fingerprint pre-filters isomorphism checks. Equal
+    fingerprints do not prove isomorphism; graphs with the same quotient,
+    like all k-regular graphs on n nodes, share a fingerprint.
+
+    The cells are ordered by refining the k x k quotient matrix, starting from
+    the cell sizes, with refinement.signature_refinement, whose colors are
+    ranks of structural hashes. The partition is the coarsest one, so no two
+    of its cells can be told apart by refinement only if they are merged, and
+    the quotient refines to k distinct colors.
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix, where A[i, j] is node i
+            receiving from node j
+        colors (ndarray (n,)): the coarsest equitable partition of A with any
+            labels, e.g. DirectedGraph.colors.color; computed if not given
+
+    Returns:
+        (str): hex digest identifying the graph up to isomorphism
+    """
+    A = refinement.integer_weights(A)
+    n = A.shape[0]
+    if colors is None:
+        colors = refinement.equitable_coloring(A)
+    partition = Partition(colors)
+    sizes = partition.sizes()
+
+    # every node of cell c receives Q[c, d] from cell d
+    P = partition.indicator().astype(np.int64)
+    Q = sparse.csr_matrix(P.T @ A @ P)
+    Q.data //= np.repeat(sizes, np.diff(Q.indptr))
+    Q.eliminate_zeros()
+
+    # an invariant order of the cells
+    order = refinement.signature_refinement(Q.indptr, Q.indices, Q.data,
+                                            len(partition), initial=sizes)
+    if len(partition) and order.max() + 1 != len(partition):
+        raise ValueError('colors is not the coarsest equitable partition')
+    Q = sparse.csr_matrix((Q.data, order[Q.indices], Q.indptr), shape=Q.shape)
+    Q = Q[np.argsort(order)]
+    Q.sort_indices()
+
+    digest = hashlib.sha256()
+    digest.update(f'fingerprint-{refinement.VERSION}'.encode())
+    digest.update(repr((n, A.nnz)).encode())
+    for array in (sizes[np.argsort(order)], Q.indptr, Q.indices, Q.data):
+        digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+class FingerprintIndex:
+
+    """
+    A persistent map from graph fingerprints to stored results, so batch jobs
+    can skip graphs isomorphic to ones they have already processed. Each entry
+    is a pickle file named by its fingerprint, written through a temporary
+    file and an atomic rename, so several processes (e.g. MPI ranks) can share
+    one index directory.
+
+    Attributes:
+        directory (str): where the entries are stored
+
+    Methods:
+        get()
+        put()
+        keys()
+    """
+
+    def __init__(self, directory):
+        """
+        Parameters:
+            directory (str): directory of the index, created if it does not
+                exist
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key, default=None):
+        """
+        Parameters:
+            key (str): a fingerprint
+            default: returned if the fingerprint is not in the index
+
+        Returns:
+            the result stored for the fingerprint
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return default
+
+    def put(self, key, value):
+        """
+        Stores a result for a fingerprint, replacing any earlier one.
+
+        Parameters:
+            key (str): a fingerprint
+            value: any picklable result
+        """
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(temp, self._path(key))
+
+    def keys(self):
+        """
+        Returns:
+            (list(str)): the fingerprints in the index
+        """
+        return [name[:-4] for name in os.listdir(self.directory)
+                if name.endswith('.pkl')]
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self.keys())
@@ -0,0 +1,465 @@
+# incremental.py
+import math
+import numpy as np
+from scipy import sparse
+import refinement
+from partition import Partition
+
+
+class IncrementalColoring:
+
+    """
+    A graph and an equitable coloring of it that are updated together as
+    edges are added and removed, touching only the nodes and cells near the
+    change instead of the whole graph.
+
+    The adjacency matrix is kept as the integer CSR (in-edges) and CSC
+    (out-edges) arrays of the graph at the last rebuild, plus dictionaries of
+    the entries changed since, so the edges of a node are a slice of the
+    arrays patched with its changes. Once the changes grow to a quarter of
+    the edges the arrays are rebuilt, which is O(1) per change on average.
+    The coloring is a color array with the size of every color; a cell is
+    listed from the slice of the initial partition it started as and the
+    nodes that joined it later.
+
+    An update first splits the cells of the receivers by how much their
+    inputs from each sending cell changed, then runs worklist refinement from
+    the nodes that moved to new cells only (see
+    refinement.worklist_refinement), so the cost is the degree of the cells
+    that split. Cells near the change whose nodes now receive the same inputs
+    from every cell are then merged again, which keeps the coloring
+    equitable; cells that can only merge together with others, like the
+    three cells of a directed triangle, are left apart until coarsen(). With
+    a seed, cells of different seed colors are never merged.
+
+    Attributes:
+        n (int): number of nodes
+        color (ndarray (n,)): color of every node (not canonical), or None
+            if only the matrix is kept
+        seed (ndarray (n,)): seed color of every node, or None
+        tol (float): quantization step of the weights, see
+            refinement.integer_weights
+
+    Methods:
+        weights()
+        update()
+        coarsen()
+        matrix()
+        partition()
+    """
+
+    def __init__(self, A, colors=None, seed=None, tol=None):
+        """
+        Parameters:
+            A (sparse matrix (n, n)): adjacency matrix, where A[i, j] is node
+                i receiving from node j
+            colors (ndarray (n,)): an equitable coloring of A, numbered
+                0, ..., k-1, e.g. DirectedGraph.colors.color; if None only
+                the matrix is updated
+            seed (ndarray (n,)): the seed colors the coloring refines
+            tol (float): quantization step the coloring was made with
+        """
+        self.n = A.shape[0]
+        self.tol = tol
+        self.seed = None if seed is None else np.asarray(seed)
+        self._shift = 0
+        self._rebuild(A)
+
+        self.color = None
+        self._partition = None
+        if colors is not None:
+            self.color = np.array(colors, dtype=np.int64)
+            k = int(self.color.max(initial=-1)) + 1
+            self._size = np.bincount(self.color, minlength=k).tolist()
+            # cell c starts as order[starts[c]:ends[c]]
+            self._order = np.argsort(self.color, kind='stable')
+            self._ends = np.cumsum(self._size, dtype=np.int64)
+            self._starts = self._ends - self._size
+            self._joined = {}
+
+    def _rebuild(self, A, shift=None):
+        """
+        Stores A as the base arrays and clears the changes.
+        """
+        A = sparse.csr_matrix(A, copy=True)
+        A.sum_duplicates()
+        A.eliminate_zeros()
+        A.sort_indices()
+        A.prune()
+        self._base = A
+        self._matrix = A
+        if self.tol is None:
+            self._shift = max(self._shift if shift is None else shift,
+                              refinement.weight_shift(A.data))
+        B = refinement.integer_weights(A, self.tol, self._shift or None)
+        C = sparse.csc_matrix(B)
+        self._in = (B.indptr, B.indices, B.data)
+        self._out = (C.indptr, C.indices, C.data)
+        # the values of the changed entries, and their integers by row and
+        # by column
+        self._changes = {}
+        self._in_changes = {}
+        self._out_changes = {}
+
+    def _scaled(self, value):
+        """
+        Returns:
+            (int): the integer a weight is compared as, or None if it needs
+                a finer scale than the current one
+        """
+        if self.tol is not None:
+            return int(np.rint(value / self.tol))
+        x = math.ldexp(value, self._shift)
+        return int(x) if x == math.floor(x) else None
+
+    def _value(self, i, j):
+        """
+        Returns:
+            the current value of A[i, j]
+        """
+        value = self._changes.get((i, j))
+        if value is not None:
+            return value
+        A = self._base
+        lo, hi = A.indptr[i], A.indptr[i + 1]
+        k = lo + np.searchsorted(A.indices[lo:hi], j)
+        return A.data[k] if k < hi and A.indices[k] == j else 0
+
+    def _integer(self, i, j):
+        """
+        Returns:
+            (int): the current integer of A[i, j]
+        """
+        row = self._in_changes.get(i)
+        if row is not None and j in row:
+            return row[j]
+        indptr, indices, data = self._in
+        lo, hi = indptr[i], indptr[i + 1]
+        k = lo + np.searchsorted(indices[lo:hi], j)
+        return int(data[k]) if k < hi and indices[k] == j else 0
+
+    def weights(self, rows, cols):
+        """
+        Returns:
+            (ndarray): the current values of A[rows, cols]
+        """
+        values = [self._value(i, j) for i, j in zip(rows.tolist(),
+                                                      cols.tolist())]
+        return np.array(values, dtype=self._base.dtype) if values else \
+            np.zeros(0, dtype=self._base.dtype)
+
+    def _edges(self, arrays, changes, nodes):
+        """
+        Collects the edges of some nodes from the base arrays, patched with
+        the changes.
+
+        Parameters:
+            arrays (tuple(ndarray)): self._in or self._out
+            changes (dict): self._in_changes or self._out_changes
+            nodes (ndarray): the rows (of self._in) or columns (of self._out)
+
+        Returns:
+            owners (ndarray): the position in nodes of every edge's node
+            others (ndarray): the node at the other end of every edge
+            weights (ndarray): the integer weight of every edge
+        """
+        indptr, indices, data = arrays
+        nodes = np.asarray(nodes, dtype=np.int64)
+        patched = np.array([node in changes for node in nodes.tolist()],
+                           dtype=bool)
+        plain = np.flatnonzero(~patched)
+        owners = [np.repeat(plain, indptr[nodes[plain] + 1] -
+                            indptr[nodes[plain]])]
+        others, weights = refinement._gather_columns(indptr, indices, data,
+                                                     nodes[plain])
+        others, weights = [others], [weights.astype(np.int64)]
+        for position in np.flatnonzero(patched).tolist():
+            node = nodes[position]
+            patch = changes[node]
+            base = indices[indptr[node]:indptr[node + 1]]
+            keep = ~np.isin(base, list(patch))
+            patch = {k: v for k, v in patch.items() if v != 0}
+            other = np.concatenate((base[keep], list(patch))).astype(np.int64)
+            owners.append(np.full(other.size, position))
+            others.append(other)
+            weights.append(np.concatenate((
+                data[indptr[node]:indptr[node + 1]][keep],
+                list(patch.values()))).astype(np.int64))
+        return (np.concatenate(owners), np.concatenate(others),
+                np.concatenate(weights))
+
+    def update(self, rows, cols, delta, exact=True):
+        """
+        Adds delta to the entries (rows, cols) of A and updates the coloring.
+
+        Parameters:
+            rows, cols (ndarray): receiving and sending node of each entry
+            delta (ndarray): the change of each entry
+            exact (bool): if True (default), the cells are finally merged
+                into the coarsest equitable partition refining the seed (see
+                coarsen). If False, the cells near the change are merged
+                locally, which may leave a finer equitable partition
+        """
+        totals = {}
+        for i, j, d in zip(rows.tolist(), cols.tolist(), delta.tolist()):
+            totals[i, j] = totals.get((i, j), 0) + d
+        values = {pair: self._value(*pair) + d for pair, d in totals.items()}
+        if self.tol is None and any(self._scaled(v) is None
+                                    for v in values.values()):
+            # weights with more binary digits than any before; scaling
+            # them all alike needs the arrays again
+            self._rebuild(self.matrix(), refinement.weight_shift(
+                list(values.values())))
+
+        changes = []
+        for (i, j), value in values.items():
+            before, after = self._integer(i, j), self._scaled(value)
+            self._changes[i, j] = value
+            self._in_changes.setdefault(i, {})[j] = after
+            self._out_changes.setdefault(j, {})[i] = after
+            if after != before:
+                changes.append((i, j, after - before))
+        self._matrix = None
+        if len(self._changes) > max(1024, self._base.nnz // 4):
+            self._rebuild(self.matrix())
+
+        if self.color is None:
+            return
+        self._partition = None
+        if changes:
+            rows, cols, delta = (np.array(x, dtype=np.int64)
+                                 for x in zip(*changes))
+            nodes = self._refine(rows, cols, delta)
+            if not exact:
+                self._merge(np.concatenate((rows, nodes)))
+        if exact:
+            self.coarsen()
+
+    def _members(self, color):
+        """
+        Returns:
+            (ndarray): the nodes of a color
+        """
+        nodes = np.zeros(0, dtype=np.int64)
+        if color < self._starts.size:
+            lo, hi = self._starts[color], self._ends[color]
+            nodes = self._order[lo:hi]
+            nodes = nodes[self.color[nodes] == color]
+            if nodes.size < (hi - lo) // 2:
+                # most nodes have left, so the rest are listed as joined
+                self._ends[color] = lo
+                self._joined.setdefault(color, set()).update(nodes.tolist())
+                nodes = nodes[:0]
+        joined = self._joined.get(color)
+        if joined:
+            joined = {u for u in joined if self.color[u] == color}
+            self._joined[color] = joined
+            nodes = np.concatenate((nodes, list(joined))).astype(np.int64)
+        return nodes
+
+    def _move(self, nodes, color=None):
+        """
+        Gives nodes a color, a new one by default.
+
+        Returns:
+            (int): the color
+        """
+        if color is None:
+            color = len(self._size)
+            self._size.append(0)
+        old, counts = np.unique(self.color[nodes], return_counts=True)
+        for c, count in zip(old.tolist(), counts.tolist()):
+            self._size[c] -= count
+        self._size[color] += nodes.size
+        self.color[nodes] = color
+        self._joined.setdefault(color, set()).update(nodes.tolist())
+        return color
+
+    def _split(self, nodes, counts):
+        """
+        Splits every cell of the given nodes by their counts, the nodes of
+        the cell not given having count 0. The largest part keeps the color
+        of the cell.
+
+        Returns:
+            moved (list(ndarray)): the nodes of every part that got a new
+                color
+        """
+        keep = counts != 0
+        nodes, counts = nodes[keep], counts[keep]
+        cells = self.color[nodes]
+        order = np.lexsort((counts, cells))
+        nodes, counts, cells = nodes[order], counts[order], cells[order]
+        bounds = np.flatnonzero(np.diff(cells)) + 1
+        bounds = np.concatenate(([0], bounds, [nodes.size]))
+
+        moved = []
+        for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            cell = int(cells[a])
+            T, T_counts = nodes[a:b], counts[a:b]
+            rest = self._size[cell] - T.size
+            if rest == 0 and T_counts[0] == T_counts[-1]:
+                continue
+            groups = np.flatnonzero(np.diff(T_counts)) + 1
+            parts = np.split(T, groups)
+            largest = max(range(len(parts)), key=lambda p: parts[p].size)
+            if rest < parts[largest].size:
+                # the untouched nodes move instead of the largest group
+                if rest:
+                    members = self._members(cell)
+                    parts[largest] = members[~np.isin(members, T)]
+                else:
+                    del parts[largest]
+            for part in parts:
+                if part.size:
+                    self._move(part)
+                    moved.append(part)
+        return moved
+
+    def _refine(self, rows, cols, delta):
+        """
+        Refines the coloring after the integer entries (rows, cols) of A
+        changed by delta. Every cell was equitable before, so splitting the
+        receivers by the change of their inputs from each sending cell makes
+        the coloring stable for the old cells; the parts that moved out of
+        them are then the only splitters left.
+
+        Returns:
+            (ndarray): the nodes that moved to new cells
+        """
+        moved, worklist = [], []
+        sources = self.color[cols]
+        for source in np.unique(sources):
+            same = sources == source
+            nodes, inverse = np.unique(rows[same], return_inverse=True)
+            counts = np.zeros(nodes.size, dtype=np.int64)
+            np.add.at(counts, inverse.ravel(), delta[same])
+            worklist += self._split(nodes, counts)
+
+        while worklist:
+            splitter = worklist.pop()
+            moved.append(splitter)
+            _, receivers, weights = self._edges(self._out, self._out_changes,
+                                                splitter)
+            if receivers.size == 0:
+                continue
+            nodes, inverse = np.unique(receivers, return_inverse=True)
+            counts = np.zeros(nodes.size, dtype=np.int64)
+            np.add.at(counts, inverse.ravel(), weights)
+            worklist += self._split(nodes, counts)
+        if not moved:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(moved)
+
+    def _signature(self, node):
+        """
+        Returns:
+            (tuple): the seed color of a node and its nonzero inputs from
+                every color, equal for nodes that may share a cell
+        """
+        _, senders, weights = self._edges(self._in, self._in_changes, [node])
+        colors, inverse = np.unique(self.color[senders], return_inverse=True)
+        sums = np.zeros(colors.size, dtype=np.int64)
+        np.add.at(sums, inverse.ravel(), weights)
+        nonzero = sums != 0
+        seed = None if self.seed is None else self.seed[node]
+        return seed, tuple(zip(colors[nonzero].tolist(),
+                               sums[nonzero].tolist()))
+
+    def _merge(self, nodes):
+        """
+        Merges the cells of the given nodes whose nodes receive the same
+        inputs from every cell, then compares the cells receiving from the
+        merged ones, so the work stays near the nodes.
+        """
+        while nodes.size:
+            cells, first = np.unique(self.color[nodes], return_index=True)
+            if cells.size < 2:
+                return
+            groups = {}
+            for cell, node in zip(cells.tolist(), nodes[first].tolist()):
+                groups.setdefault(self._signature(node), []).append(cell)
+            moved = []
+            for group in groups.values():
+                if len(group) > 1:
+                    moved += self._merge_cells(group)
+            if not moved:
+                return
+            # the cells receiving from the moved nodes see new inputs
+            _, nodes, _ = self._edges(self._out, self._out_changes,
+                                      np.concatenate(moved))
+
+    def _merge_cells(self, cells):
+        """
+        Moves the nodes of cells into the largest of them.
+
+        Returns:
+            (list(ndarray)): the nodes that moved
+        """
+        target = max(cells, key=lambda c: self._size[c])
+        moved = []
+        for cell in cells:
+            if cell != target:
+                members = self._members(cell)
+                self._move(members, target)
+                moved.append(members)
+        return moved
+
+    def coarsen(self):
+        """
+        Merges the cells into the coarsest equitable partition refining the
+        seed, by refining the quotient matrix from the seed colors (see
+        refinement.coarsest_from_seed). This costs refinement passes over the
+        whole quotient, built from one node of every cell.
+        """
+        cells, reps = np.unique(self.color, return_index=True)
+        k = cells.size
+        index = np.zeros(len(self._size), dtype=np.int64)
+        index[cells] = np.arange(k)
+        owners, senders, weights = self._edges(self._in, self._in_changes,
+                                               reps)
+        Q = sparse.csr_matrix((weights, (owners, index[self.color[senders]])),
+                              shape=(k, k))
+        Q.sum_duplicates()
+        Q.eliminate_zeros()
+        initial = None if self.seed is None else self.seed[reps]
+        quotient = refinement.signature_refinement(Q.indptr, Q.indices,
+                                                   Q.data, k, initial)
+        order = np.argsort(quotient, kind='stable')
+        bounds = np.flatnonzero(np.diff(quotient[order])) + 1
+        for group in np.split(cells[order], bounds):
+            if group.size > 1:
+                self._merge_cells(group.tolist())
+
+    def matrix(self):
+        """
+        Returns:
+            (sparse.csr_matrix): the current adjacency matrix, built once
+                per change
+        """
+        if self._matrix is None and not self._changes:
+            self._matrix = self._base
+        if self._matrix is None:
+            A = self._base.tocoo()
+            pairs = np.array(list(self._changes), dtype=np.int64).reshape(-1, 2)
+            values = np.array(list(self._changes.values()))
+            changed = np.isin(A.row.astype(np.int64)*self.n + A.col,
+                              pairs[:, 0]*self.n + pairs[:, 1])
+            dtype = np.result_type(A.dtype, values)
+            self._matrix = sparse.csr_matrix(
+                (np.concatenate((A.data[~changed], values)).astype(dtype),
+                 (np.concatenate((A.row[~changed], pairs[:, 0])),
+                  np.concatenate((A.col[~changed], pairs[:, 1])))),
+                shape=A.shape)
+            self._matrix.eliminate_zeros()
+        return self._matrix
+
+    def partition(self):
+        """
+        Returns:
+            (Partition): the coloring, built once per change
+        """
+        if self._partition is None:
+            self._partition = Partition(
+                refinement.canonical_colors(self.color))
+        return self._partition
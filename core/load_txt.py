@@ -77,7 +77,7 @@ def loadtxt(filename, infer_format=True, directed=None, weighted=False, sep=' ',
 
         # split into list of lists; inner lists contain connection data
         data = [entry.strip().split(sep) for entry in data]
-        data = np.array(data, dtype=np.int) # numpyify and cast the strings to ints
+        data = np.array(data, dtype=int) # numpyify and cast the strings to ints
 
     if infer_format:
         try:
@@ -1,16 +1,12 @@
 # mpi_makegraphs.py
-from mpi4py import MPI
 from load_txt import loadtxt
 from sparse_specializer import DirectedGraph
-from statistics import community_dist_bar
+from coloring_cache import ColoringCache
+from fingerprint import FingerprintIndex, fingerprint
 import pickle
 import re
 import os
 
-COMM = MPI.COMM_WORLD
-RANK = COMM.Get_rank()
-SIZE = COMM.Get_size()
-
 regex = re.compile(r'out\..*')
 
 base = '../'
@@ -74,44 +70,93 @@ directories = ['data/scraping/adjnoun_adjacency',
 'data/scraping/cit-HepPh',
 'data/scraping/topology']
 
-directories = directories[RANK::SIZE]
-#
-# if RANK == 0:
-#     directories = directories[0::8]
-# elif RANK == 1:
-#     directories = directories[1::8]
-# elif RANK == 2:
-#     directories = directories[2::8]
-# elif RANK == 3:
-#     directories = directories[3::8]
-# elif RANK == 4:
-#     directories = directories[4::8]
-# elif RANK == 5:
-#     directories = directories[5::8]
-# elif RANK == 6:
-#     directories = directories[6::8]
-# elif RANK == 7:
-#     directories = directories[7::8]
-
-for graph in directories:
-    try:
-        for f in os.listdir(base+graph):
-            if regex.match(f):
-                fname = regex.match(f).string
-
-        G = loadtxt(base+graph+'/'+fname)
-        G = DirectedGraph(G)
-        G.coloring()
-        eq_part = G.colors
-        # SAVE THE COLORING
-        with open(f'../data/colorings/{fname}-coloring', 'wb') as f:
-            pickle.dump(eq_part, f)
-
-        community_dist_bar(eq_part, show=False, save=f'../data/graphs/{fname}.png')
-
-    except KeyboardInterrupt as e:
-        raise KeyboardInterrupt('keyboard interrupt')
-
-    except Exception as e:
-        print(e)
-        continue
+
+def color_graph(filename, cache, index, colorings='../data/colorings',
+                plot=None):
+    """
+    Colors one graph of the corpus and saves its coloring, reusing the work
+    of earlier runs. The coloring goes through the cache, so a graph colored
+    by an earlier run costs no refinement, and the fingerprint is built from
+    it. The index maps each fingerprint to the first file processed with it:
+    a file whose coloring an earlier run saved is skipped, and a graph
+    isomorphic to another file's (mirrors, repeated scrapes) only gets a
+    <name>-same-as file pointing to that file's coloring.
+
+    Parameters:
+        filename (str): path to the edge list, read with loadtxt
+        cache (ColoringCache): cache of the colorings of the corpus
+        index (FingerprintIndex): the first file name of every fingerprint
+        colorings (str): directory of the saved colorings
+        plot (callable): called as plot(partition, name) after saving the
+            coloring of a new graph, or None
+
+    Returns:
+        (str): 'colored', 'saved' if an earlier run saved the coloring of the
+            file, or 'duplicate' if another file has the same fingerprint
+    """
+    fname = os.path.basename(filename)
+    G = DirectedGraph(loadtxt(filename))
+    G.coloring(cache=cache)
+    key = fingerprint(G.A.tocsr(), G.colors.color)
+    seen = index.get(key)
+    saved = os.path.join(colorings, f'{fname}-coloring')
+    if seen == fname and os.path.exists(saved):
+        return 'saved'
+    if seen is not None and seen != fname:
+        with open(os.path.join(colorings, f'{fname}-same-as'), 'w') as f:
+            f.write(f'{seen}-coloring\n')
+        return 'duplicate'
+    # cheap guard against saving a broken coloring
+    violations = G.equitability_violations()
+    if violations:
+        raise ValueError(f'{fname}: coloring is not equitable, e.g. '
+                         f'{violations[0]}')
+    eq_part = G.colors
+    # SAVE THE COLORING
+    with open(saved, 'wb') as f:
+        pickle.dump(eq_part, f)
+
+    if plot is not None:
+        plot(eq_part, fname)
+    index.put(key, fname)
+    return 'colored'
+
+
+if __name__ == '__main__':
+    from mpi4py import MPI
+    from statistics import community_dist_bar
+
+    COMM = MPI.COMM_WORLD
+    RANK = COMM.Get_rank()
+    SIZE = COMM.Get_size()
+
+    directories = directories[RANK::SIZE]
+
+    # colorings are reused across runs as long as the graph and the
+    # refinement code are unchanged; all ranks share the cache directory
+    cache = ColoringCache('../data/coloring_cache', max_bytes=8*2**30)
+    index = FingerprintIndex('../data/fingerprints')
+
+    def plot(eq_part, fname):
+        community_dist_bar(eq_part, show=False,
+                           save=f'../data/graphs/{fname}.png')
+
+    for graph in directories:
+        try:
+            for f in os.listdir(base+graph):
+                if regex.match(f):
+                    fname = regex.match(f).string
+
+            status = color_graph(base+graph+'/'+fname, cache, index,
+                                 plot=plot)
+            if status == 'saved':
+                print(f'{fname}: saved by an earlier run, skipped')
+            elif status == 'duplicate':
+                print(f'{fname}: same fingerprint as another graph, skipped')
+
+        except KeyboardInterrupt as e:
+            raise KeyboardInterrupt('keyboard interrupt')
+
+        except Exception as e:
+            print(e)
+            continue
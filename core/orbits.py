@@ -0,0 +1,893 @@
+# orbits.py
+import numpy as np
+from scipy import sparse
+import refinement
+
+
+def _weighted_sums(M, values):
+    """
+    Computes M @ values in wrapping uint64 arithmetic.
+    """
+    products = M.data.astype(np.int64).view(np.uint64) * values[M.indices]
+    sums = np.zeros(M.shape[0], dtype=np.uint64)
+    nonempty = np.diff(M.indptr) > 0
+    if products.size:
+        sums[nonempty] = np.add.reduceat(products, M.indptr[:-1][nonempty])
+    return sums
+
+
+def _color_hashes(colors):
+    """
+    Returns:
+        (ndarray (n, 4), uint64): four independent hashes of every color, for
+            the two in and the two out signatures
+    """
+    colors = np.asarray(colors).astype(np.uint64)[:, None] * np.uint64(4)
+    return refinement._mix(colors + np.arange(4, dtype=np.uint64))
+
+
+def _signatures(A, AT, colors):
+    """
+    Hashes the input and output counts of every node by color. The hashes are
+    linear in the counts, so a change of color of one node only changes the
+    signatures of its neighbors, by a known amount.
+
+    Returns:
+        (ndarray (n, 4), uint64): two hashes of the input counts of every
+            node, then two of its output counts
+    """
+    hashes = _color_hashes(colors)
+    return np.column_stack([_weighted_sums(A, hashes[:, 0]),
+                            _weighted_sums(A, hashes[:, 1]),
+                            _weighted_sums(AT, hashes[:, 2]),
+                            _weighted_sums(AT, hashes[:, 3])])
+
+
+def _neighbor_entries(M, nodes):
+    """
+    Returns:
+        rows (ndarray): index of every entry in rows nodes of M
+        weights (ndarray): the value of every entry, as uint64
+        owner (ndarray): position in nodes of the row of every entry
+    """
+    rows, weights = refinement._gather_columns(M.indptr, M.indices, M.data,
+                                                nodes)
+    owner = np.repeat(np.arange(nodes.size),
+                      M.indptr[nodes + 1] - M.indptr[nodes])
+    return rows, weights.astype(np.int64).view(np.uint64), owner
+
+
+def _size_hashes(labels, sizes):
+    """
+    Returns:
+        (ndarray, uint64): a hash of every (color, size) pair, given the
+            _mix of the colors as labels; their sum compares the cell sizes
+            of two colorings
+    """
+    return refinement._mix(np.asarray(sizes).astype(np.uint64) ^ labels)
+
+
+class _Coloring:
+
+    """
+    A coloring that the search refines in place, with its cells and a log to
+    undo the changes. The nodes are kept sorted by color, so cell c is
+    order[start[c]:start[c] + size[c]], and a cell splits by moving some of
+    its nodes to its end, where they form the new cells. Refining after a
+    change only looks at the nodes whose signatures changed, and undoing a
+    change costs as much as making it, so going up and down the search tree
+    never costs a pass over all the nodes.
+
+    Every choice only depends on colors and signatures, never on how the
+    nodes are numbered, which is what lets two branches of the search be
+    compared color by color.
+
+    Attributes:
+        colors (ndarray (n,)): color of each node, numbered 0, ..., k-1
+        signatures (ndarray (n, 4)): their signatures, see _signatures
+        num_colors (int): k
+        members (ndarray (n,), uint64): a hash of the nodes of every color
+    """
+
+    def __init__(self, A, AT, colors):
+        self.A, self.AT = A, AT
+        n = colors.size
+        self.colors = colors.astype(np.int64)
+        self.num_colors = int(self.colors.max()) + 1
+        self.signatures = _signatures(A, AT, self.colors)
+        # there are never more than n colors
+        self._hashes = _color_hashes(np.arange(n))
+        self._labels = refinement._mix(np.arange(n, dtype=np.uint64))
+        # a hash of the nodes of every color, to compare cells of two
+        # colorings
+        self.members = np.zeros(n, dtype=np.uint64)
+        np.add.at(self.members, self.colors, self._labels)
+        self.order = np.argsort(self.colors, kind='stable')
+        self.position = np.empty(n, dtype=np.int64)
+        self.position[self.order] = np.arange(n)
+        self.size = np.zeros(n, dtype=np.int64)
+        self.size[:self.num_colors] = np.bincount(self.colors)
+        self.start = np.zeros(n, dtype=np.int64)
+        self.start[1:self.num_colors] = np.cumsum(
+            self.size[:self.num_colors - 1])
+        self._hash = int(_size_hashes(self._labels[:self.num_colors],
+                                      self.size[:self.num_colors]).sum())
+        # every entry holds the nodes moved by one split, their old colors,
+        # the first new color, the cell of every new color and the old hash
+        self._log = []
+        self._marked = np.zeros(n, dtype=bool)
+        self._refine(np.arange(n), None)
+        # the first refinement is never undone
+        self._log = []
+
+    def key(self):
+        """
+        Returns:
+            (tuple): the number of colors and a hash of the size of every
+                color, for comparing nodes of the search tree
+        """
+        return self.num_colors, self._hash
+
+    def mark(self):
+        """
+        Returns:
+            (int): a point of the log to undo back to
+        """
+        return len(self._log)
+
+    def cell(self, color):
+        """
+        Returns:
+            (ndarray): the nodes of a color, in no particular order
+        """
+        start = self.start[color]
+        return self.order[start:start + self.size[color]].copy()
+
+    def target_cell(self):
+        """
+        Picks the cell to branch on: the smallest cell with more than one node,
+        breaking ties by color. The choice only depends on the colors, so it is
+        the same in every branch.
+
+        Returns:
+            (int): its color, or None if the coloring is discrete
+        """
+        sizes = self.size[:self.num_colors]
+        candidates = np.flatnonzero(sizes > 1)
+        if candidates.size == 0:
+            return None
+        return candidates[np.argmin(sizes[candidates])]
+
+    def individualize(self, node, trace=None):
+        """
+        Gives node, which must share its cell, a color of its own and refines
+        the result.
+
+        Parameters:
+            trace (list): the trace of another individualization to compare
+                with; refining stops as soon as the two differ, as then no
+                automorphism maps one to the other
+
+        Returns:
+            (list): the trace, the key after the split and every round of
+                refinement, or None if it differs from trace
+        """
+        touched, before = self._split(np.array([node]),
+                                      np.array([self.num_colors]),
+                                      self.colors[[node]])
+        return self._refine(touched, before, trace)
+
+    def undo(self, mark):
+        """
+        Undoes every split made since mark.
+        """
+        while len(self._log) > mark:
+            nodes, old, first, parents, hash_ = self._log.pop()
+            self._recolor(nodes, old)
+            # the new cells lie at the end of their parents
+            np.add.at(self.size, parents, self.size[first:self.num_colors])
+            self.num_colors, self._hash = first, hash_
+
+    def changes(self, mark):
+        """
+        Returns:
+            (ndarray): the nodes whose colors changed since mark, sorted
+        """
+        logged = [entry[0] for entry in self._log[mark:]]
+        if not logged:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(logged))
+
+    def _recolor(self, nodes, new):
+        """
+        Gives nodes new colors, updating the signatures of their neighbors in
+        place.
+
+        Returns:
+            touched (ndarray): the nodes whose signatures changed
+            before (ndarray): their signatures before the change
+        """
+        delta = self._hashes[new] - self._hashes[self.colors[nodes]]
+        np.subtract.at(self.members, self.colors[nodes], self._labels[nodes])
+        np.add.at(self.members, new, self._labels[nodes])
+        self.colors[nodes] = new
+        receivers, weights, owner = _neighbor_entries(self.AT, nodes)
+        senders, out_weights, out_owner = _neighbor_entries(self.A, nodes)
+        touched = np.unique(np.concatenate((receivers, senders)))
+        before = self.signatures[touched]
+        np.add.at(self.signatures[:, :2], receivers,
+                  weights[:, None] * delta[owner, :2])
+        np.add.at(self.signatures[:, 2:], senders,
+                  out_weights[:, None] * delta[out_owner, 2:])
+        return touched, before
+
+    def _split(self, nodes, new, parents):
+        """
+        Moves nodes to new cells at the end of their old ones and logs the
+        change. The new colors are num_colors, num_colors + 1, ..., and nodes
+        must be sorted by them.
+
+        Parameters:
+            nodes (ndarray): the nodes to move
+            new (ndarray): their new colors
+            parents (ndarray): the cell every new color splits from
+
+        Returns:
+            touched, before: see _recolor
+        """
+        first = self.num_colors
+        count = np.bincount(new - first, minlength=parents.size)
+        cells, index = np.unique(parents, return_index=True)
+        moving = np.add.reduceat(count, index)
+        # the moved nodes of a cell take its last positions
+        boundary = self.start[cells] + self.size[cells] - moving
+        tail = np.arange(nodes.size) + np.repeat(
+            boundary - np.cumsum(moving) + moving, moving)
+        self._marked[nodes] = True
+        staying = self.order[tail]
+        staying = staying[~self._marked[staying]]
+        self._marked[nodes] = False
+        # staying nodes trade places with the moved nodes ahead of the
+        # boundary, both in order of cell
+        ahead = self.position[nodes] < np.repeat(boundary, moving)
+        free = self.position[nodes[ahead]]
+        self.order[free] = staying
+        self.position[staying] = free
+        self.order[tail] = nodes
+        self.position[nodes] = tail
+
+        hash_ = self._hash
+        new_cells = np.arange(first, first + parents.size)
+        removed = int(_size_hashes(self._labels[cells],
+                                   self.size[cells]).sum())
+        self.size[cells] -= moving
+        self.start[new_cells] = tail[np.cumsum(count) - count]
+        self.size[new_cells] = count
+        changed = np.concatenate((cells, new_cells))
+        added = int(_size_hashes(self._labels[changed],
+                                 self.size[changed]).sum())
+        self._hash = (self._hash + added - removed) % 2**64
+        self.num_colors += parents.size
+        self._log.append((nodes, self.colors[nodes], first, parents, hash_))
+        return self._recolor(nodes, new)
+
+    def _refine(self, touched, before, trace=None):
+        """
+        Refines the coloring until the in and out counts of every node are
+        equitable. Each round splits the cells of nodes whose signatures
+        changed by signature. Nodes of those cells that were not touched keep
+        the signature the cell had, so they are one part of it that need not
+        be looked at. The largest part of a cell keeps its color and the
+        others get new colors after the existing ones, in order of (old color,
+        signature); then the signatures of the neighbors of recolored nodes
+        are updated.
+
+        Parameters:
+            touched (ndarray): nodes whose signatures changed since their
+                cells were last split
+            before (ndarray): their signatures before the change, or None if
+                touched holds every node
+            trace (list): see individualize
+
+        Returns:
+            (list): see individualize
+        """
+        steps = [self.key()]
+        while touched.size:
+            if trace is not None and (len(trace) < len(steps)
+                                      or trace[len(steps) - 1] != steps[-1]):
+                return None
+            keys = self.signatures[touched]
+            if before is not None:
+                changed = (keys != before).any(1)
+                touched, keys, before = (touched[changed], keys[changed],
+                                         before[changed])
+            cell = self.colors[touched]
+            order = np.lexsort((keys[:, 3], keys[:, 2], keys[:, 1],
+                                keys[:, 0], cell))
+            touched, keys, cell = touched[order], keys[order], cell[order]
+
+            # a new part starts wherever the color or the signature changes
+            starts = np.ones(touched.size, dtype=bool)
+            starts[1:] = ((cell[1:] != cell[:-1])
+                          | (keys[1:] != keys[:-1]).any(1))
+            part = np.cumsum(starts) - 1
+            starts = np.flatnonzero(starts)
+            part_size = np.diff(np.append(starts, touched.size))
+            part_cell, part_keys = cell[starts], keys[starts]
+
+            # the untouched nodes of every cell form one more part
+            num_touched = starts.size
+            cells, index = np.unique(part_cell, return_index=True)
+            rest = self.size[cells] - np.add.reduceat(part_size, index)
+            has_rest = rest > 0
+            if before is None:
+                rest_keys = np.zeros((cells.size, 4), dtype=np.uint64)
+            else:
+                rest_keys = before[order][starts[index]]
+            part_cell = np.concatenate((part_cell, cells[has_rest]))
+            part_keys = np.concatenate((part_keys, rest_keys[has_rest]))
+            part_size = np.concatenate((part_size, rest[has_rest]))
+            by_key = np.lexsort((part_keys[:, 3], part_keys[:, 2],
+                                 part_keys[:, 1], part_keys[:, 0], part_cell))
+            rank = np.empty(by_key.size, dtype=int)
+            rank[by_key] = np.arange(by_key.size)
+
+            # the largest part of each cell keeps its color, ties going to the
+            # first one
+            by_size = np.lexsort((rank, -part_size, part_cell))
+            first = np.ones(by_size.size, dtype=bool)
+            first[1:] = part_cell[by_size][1:] != part_cell[by_size][:-1]
+            keep = np.zeros(by_size.size, dtype=bool)
+            keep[by_size[first]] = True
+            if keep.all():
+                break
+            moving = by_key[~keep[by_key]]
+            new_color = np.full(by_key.size, -1)
+            new_color[moving] = self.num_colors + np.arange(moving.size)
+
+            nodes, new = [touched], [new_color[part]]
+            # a rest part only moves when a touched part is larger, so
+            # listing its cell costs at most twice the touched nodes
+            self._marked[touched] = True
+            for rest_part in num_touched + np.flatnonzero(
+                    new_color[num_touched:] >= 0):
+                members = self.cell(part_cell[rest_part])
+                members = members[~self._marked[members]]
+                nodes.append(members)
+                new.append(np.full(members.size, new_color[rest_part]))
+            self._marked[touched] = False
+            nodes, new = np.concatenate(nodes), np.concatenate(new)
+            nodes, new = nodes[new >= 0], new[new >= 0]
+            order = np.argsort(new, kind='stable')
+            touched, before = self._split(nodes[order], new[order],
+                                          part_cell[moving])
+            steps.append(self.key())
+        if trace is not None and steps != trace:
+            return None
+        return steps
+
+
+def _canonical_csr(A):
+    A = sparse.csr_matrix(A)
+    A.sum_duplicates()
+    A.eliminate_zeros()
+    A.sort_indices()
+    return A
+
+
+def _edges_at(A, AT, moved):
+    """
+    Returns:
+        (ndarray, ndarray, ndarray): the (receiver, sender, weight) triples of
+            every edge with an endpoint in moved, each edge listed once
+    """
+    n = A.shape[0]
+    is_moved = np.zeros(n, dtype=bool)
+    is_moved[moved] = True
+    # edges into moved nodes come from their rows of A
+    senders, weights, owner = _neighbor_entries(A, moved)
+    receivers = moved[owner]
+    # edges out of moved nodes come from their rows of AT, minus the edges
+    # between two moved nodes found above
+    out_receivers, out_weights, out_owner = _neighbor_entries(AT, moved)
+    outside = ~is_moved[out_receivers]
+    return (np.concatenate((receivers, out_receivers[outside])),
+            np.concatenate((senders, moved[out_owner][outside])),
+            np.concatenate((weights, out_weights[outside])))
+
+
+def _is_automorphism(A, AT, gamma, moved):
+    """
+    Parameters:
+        A (sparse.csr_matrix): adjacency matrix
+        AT (sparse.csr_matrix): its transpose
+        gamma (ndarray (n,)): a permutation of the nodes
+        moved (ndarray): the nodes gamma does not fix
+
+    Returns:
+        (bool): whether A[gamma[i], gamma[j]] == A[i, j] for all i, j
+    """
+    # gamma maps the edges at moved nodes to each other and fixes the rest,
+    # so only those have to be compared
+    n = np.int64(A.shape[0])
+    receivers, senders, weights = _edges_at(A, AT, moved)
+    keys = receivers * n + senders
+    mapped = gamma[receivers] * n + gamma[senders]
+    order, mapped_order = np.argsort(keys), np.argsort(mapped)
+    return (np.array_equal(keys[order], mapped[mapped_order])
+            and np.array_equal(weights[order], weights[mapped_order]))
+
+
+def _guess(left, right, candidates, gamma):
+    """
+    Guesses a permutation taking one coloring to another with the same cell
+    sizes. Nodes with the same color in both are fixed, the rest are matched
+    in order within each cell. It often already is an automorphism, which
+    saves searching below the colorings.
+
+    Parameters:
+        left, right (ndarray (n,)): the two colorings
+        candidates (ndarray): sorted nodes that include every node whose
+            colors differ
+        gamma (ndarray (n,)): the identity, set to the guess on the nodes it
+            moves; the caller restores it
+
+    Returns:
+        (ndarray): the nodes gamma does not fix, sorted
+    """
+    moved = candidates[left[candidates] != right[candidates]]
+    gamma[moved[np.argsort(left[moved], kind='stable')]] = \
+        moved[np.argsort(right[moved], kind='stable')]
+    return moved
+
+
+def _differing_cells(left, right):
+    """
+    Returns:
+        (ndarray): the colors whose nodes differ between two colorings with
+            the same cell sizes
+    """
+    k = left.num_colors
+    return np.flatnonzero(left.members[:k] != right.members[:k])
+
+
+def _check(left, right, moved, images, gamma):
+    """
+    Returns:
+        (tuple(ndarray)): moved and images if mapping moved to images and
+            fixing the other nodes is an automorphism, else None
+    """
+    gamma[moved] = images
+    found = _is_automorphism(left.A, left.AT, gamma, moved)
+    gamma[moved] = moved
+    return (moved, images) if found else None
+
+
+def _orbit(node, generators, fixed):
+    """
+    Returns:
+        (set): the orbit of node under the automorphisms found so far that fix
+            every node in fixed
+    """
+    fixed = np.array(fixed)
+    usable = [(moved, images) for moved, images in generators
+              if not np.isin(fixed, moved).any()]
+    orbit, frontier = {node}, [node]
+    while frontier:
+        i = frontier.pop()
+        for moved, images in usable:
+            k = np.searchsorted(moved, i)
+            if k < moved.size and moved[k] == i and images[k] not in orbit:
+                orbit.add(images[k])
+                frontier.append(images[k])
+    return orbit
+
+
+def _search(left, right, node, trace, base, gamma, generators):
+    """
+    Looks for an automorphism mapping the node left individualized last to
+    node and fixing the nodes individualized before, which right holds.
+    Right individualizes node; from there, while the two colorings differ,
+    left individualizes one node of the smallest cell whose nodes differ and
+    right tries each node of that cell in turn, depth first, so the search
+    only goes as deep as the part of the graph where the colorings differ.
+    Once the differing cells are single nodes, they fix the only candidate;
+    if it fails, the search goes on in any cell.
+
+    A branch of right is dropped as soon as its trace differs from left's
+    (see _Coloring.individualize), and so are the nodes that an automorphism
+    fixing the nodes right individualized maps to a node that failed.
+
+    Parameters:
+        left, right (_Coloring): two colorings, restored before returning;
+            left is right with one more node individualized
+        node (int): a node of the cell of that node in right
+        trace (list): trace of the last individualization of left
+        base (int): mark of both before it
+        gamma (ndarray (n,)): the identity, used as scratch space
+        generators (list(tuple)): the automorphisms found so far, as the
+            sorted nodes each one moves and their images
+
+    Returns:
+        (tuple(ndarray)): the nodes an automorphism moves and their images,
+            or None if there is none
+    """
+    top = left.mark()
+    if right.individualize(node, trace) is None:
+        right.undo(base)
+        return None
+    moved = _guess(left.colors, right.colors,
+                   np.union1d(left.changes(base), right.changes(base)),
+                   gamma)
+    found = _check(left, right, moved, gamma[moved], gamma)
+
+    # every frame holds the marks of a node of the tree after left chose,
+    # the trace of left's choice, the nodes right individualized, the
+    # children left to visit, the children known to fail and the last child
+    # visited
+    stack, sequence, visiting = [], [node], True
+    while found is None:
+        if visiting:
+            cells = _differing_cells(left, right)
+            sizes = left.size[cells]
+            if cells.size and sizes.max() > 1:
+                cells = cells[sizes > 1]
+                target = cells[np.argmin(left.size[cells])]
+            else:
+                moved = left.order[left.start[cells]]
+                order = np.argsort(moved)
+                found = _check(left, right, moved[order],
+                               right.order[right.start[cells]][order], gamma)
+                target = left.target_cell()
+            if found is None and target is not None:
+                x = left.cell(target).min()
+                left_trace = left.individualize(x)
+                children = sorted(right.cell(target).tolist(), reverse=True)
+                if x in children:
+                    # x itself is the likeliest image
+                    children.remove(x)
+                    children.append(x)
+                stack.append((left.mark(), right.mark(), left_trace,
+                              list(sequence), children, set(), [None]))
+        if found is not None or not stack:
+            break
+        left_mark, right_mark, left_trace, sequence, children, failed, last = \
+            stack[-1]
+        if last[0] is not None:
+            failed |= _orbit(last[0], generators, sequence)
+        while children and children[-1] in failed:
+            children.pop()
+        if not children:
+            stack.pop()
+            visiting = False
+            continue
+        left.undo(left_mark)
+        right.undo(right_mark)
+        last[0] = children.pop()
+        visiting = right.individualize(last[0], left_trace) is not None
+        sequence = sequence + [last[0]]
+    left.undo(top)
+    right.undo(base)
+    return found
+
+
+class _UnionFind:
+
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union_permutation(self, moved, images):
+        """
+        Merges every node moved by a permutation with its image.
+        """
+        for i, j in zip(moved.tolist(), images.tolist()):
+            a, b = self.find(i), self.find(j)
+            if a != b:
+                self.parent[max(a, b)] = min(a, b)
+
+    def labels(self):
+        return np.array([self.find(i) for i in range(self.parent.size)])
+
+
+def _twin_classes(A, AT, colors, closed):
+    """
+    Groups nodes with the same color that are twins: their rows and columns
+    of A (of A + I if closed) are equal. Swapping two twins is an
+    automorphism, so every twin class lies within an orbit. Rows are compared
+    through 128 bits of hashing, as in refinement.signature_refinement.
+
+    Returns:
+        (ndarray (n,)): twin class of each node, numbered 0, ..., t-1
+    """
+    if closed:
+        eye = sparse.identity(A.shape[0], dtype=A.dtype, format='csr')
+        A, AT = A + eye, AT + eye
+    A, AT = _canonical_csr(A), _canonical_csr(AT)
+    keys = np.column_stack((colors.astype(np.uint64),
+                            refinement._row_hashes(A, 1),
+                            refinement._row_hashes(A, 2),
+                            refinement._row_hashes(AT, 1),
+                            refinement._row_hashes(AT, 2)))
+    _, classes = np.unique(keys, axis=0, return_inverse=True)
+    return classes.ravel()
+
+
+def _merge_twins(A, colors, closed):
+    """
+    Replaces every class of open twins (equal rows and columns) or of closed
+    twins (equal rows and columns of A + I) by its first node. That node gets
+    a color recording its old color, the kind of twins and the size of the
+    class, so the automorphisms of the reduced colored graph are exactly
+    those of the original graph acting on twin classes.
+
+    Returns:
+        A (sparse.csr_matrix): the reduced adjacency matrix
+        colors (ndarray): colors of the reduced graph
+        keep (ndarray): the nodes that remain
+        gone (ndarray): the nodes removed
+        anchors (ndarray): the node each removed node was merged into
+        links (ndarray): zeros, as every twin shares the orbit of its anchor
+        or None if there are no twins
+    """
+    classes = _twin_classes(A, A.T.tocsr(), colors, closed)
+    if classes.max() + 1 == classes.size:
+        return None
+    size = np.bincount(classes)
+    # keep the first node of every class
+    keep = np.unique(classes, return_index=True)[1]
+    kinds = np.where(size > 1, 1 + closed, 0)
+    key = np.column_stack((colors[keep], kinds, size))
+    _, colors = np.unique(key, axis=0, return_inverse=True)
+    gone = np.setdiff1d(np.arange(classes.size), keep)
+    return (_canonical_csr(A[keep][:, keep]), colors.ravel(), keep, gone,
+            keep[classes[gone]], np.zeros(gone.size, dtype=int))
+
+
+def _peel_trees(A, colors, stage, types):
+    """
+    Removes the trees hanging from a graph, one layer of leaves at a time; a
+    leaf is a node joined to a single other node, in either direction. Every
+    leaf gets a type recording its color, its self edge and the types hanging
+    from it, and hangs from its neighbor with a link recording its type and
+    the weights of the edges both ways. Afterwards every node left is
+    colored by its color and the links hanging from it. Two leaves joined
+    only to each other are the middle of a tree and stay.
+
+    Removing whole layers at a time makes the reduction independent of how
+    the nodes are numbered, so the automorphisms of the reduced colored
+    graph are those of the original graph acting on the nodes left, and a
+    removed node is in the orbit of another exactly when their anchors share
+    an orbit and their links match, all the way up.
+
+    Parameters:
+        stage (int): number of the reduction, keeping the types of different
+            reductions apart
+        types (dict): numbers every type and link, shared by all reductions;
+            extended in place
+
+    Returns:
+        A, colors, keep, gone, anchors: see _merge_twins
+        links (ndarray): the number in types of the link of every removed
+            node
+        or None if there are no leaves
+    """
+    n = A.shape[0]
+    S = abs(A) + abs(A.T)
+    S = _canonical_csr(sparse.triu(S, 1) + sparse.tril(S, -1))
+    degree = np.diff(S.indptr)
+    diagonal = A.diagonal().tolist()
+    colors = colors.tolist()
+    alive = np.ones(n, dtype=bool)
+    hanging = {}
+    gone, anchors, links = [], [], []
+    leaves = np.flatnonzero(degree == 1)
+    while leaves.size:
+        # every leaf has one neighbor left
+        neighbors, _ = refinement._gather_columns(S.indptr, S.indices, S.data,
+                                                   leaves)
+        parents = neighbors[alive[neighbors]]
+        single = degree[parents] > 1
+        leaves, parents = leaves[single], parents[single]
+        if leaves.size == 0:
+            break
+        inputs = np.asarray(A[leaves, parents]).ravel().tolist()
+        outputs = np.asarray(A[parents, leaves]).ravel().tolist()
+        for leaf, parent, a, b in zip(leaves.tolist(), parents.tolist(),
+                                      inputs, outputs):
+            kind = types.setdefault(
+                (stage, colors[leaf], diagonal[leaf],
+                 tuple(sorted(hanging.pop(leaf, ())))), len(types) + 1)
+            link = types.setdefault((stage, kind, a, b), len(types) + 1)
+            hanging.setdefault(parent, []).append(link)
+            gone.append(leaf)
+            anchors.append(parent)
+            links.append(link)
+        alive[leaves] = False
+        np.subtract.at(degree, parents, 1)
+        leaves = np.unique(parents[degree[parents] == 1])
+    if not gone:
+        return None
+
+    keep = np.flatnonzero(alive)
+    key = [types.setdefault((stage, colors[i],
+                             tuple(sorted(hanging.get(i, ())))),
+                            len(types) + 1) for i in keep.tolist()]
+    _, colors = np.unique(key, return_inverse=True)
+    return (_canonical_csr(A[keep][:, keep]), colors.ravel(), keep,
+            np.array(gone), np.array(anchors), np.array(links))
+
+
+class _Reduction:
+
+    """
+    Records how _peel_trees and _merge_twins shrink a graph: every removed
+    node hangs from an anchor that was still in the graph at the time, with
+    a link that is 0 when it shares the anchor's orbit.
+
+    Attributes:
+        nodes (ndarray): the original node standing for each node left
+        types (dict): see _peel_trees
+    """
+
+    def __init__(self, n):
+        self.nodes = np.arange(n)
+        self.types = {}
+        self._anchor = np.full(n, -1)
+        self._link = np.zeros(n, dtype=int)
+        self._removed = []
+
+    def apply(self, A, colors, keep, gone, anchors, links):
+        """
+        Records one reduction.
+
+        Returns:
+            A, colors: the reduced graph
+        """
+        self._anchor[self.nodes[gone]] = self.nodes[anchors]
+        self._link[self.nodes[gone]] = links
+        self._removed.append(self.nodes[gone])
+        self.nodes = self.nodes[keep]
+        return A, colors
+
+    def orbits(self, labels):
+        """
+        Parameters:
+            labels (ndarray): orbit of every node of the reduced graph
+
+        Returns:
+            (ndarray (n,)): orbit of every original node, numbered 0, ...,
+                k-1 in the order of the smallest node of each orbit
+        """
+        n = self._anchor.size
+        orbit = np.zeros(n, dtype=int)
+        orbit[self.nodes] = labels
+        orbit, position = orbit.tolist(), [0]*n
+        anchor, link = self._anchor.tolist(), self._link.tolist()
+        # anchors are removed after the nodes hanging from them
+        positions = {}
+        for node in reversed(np.concatenate(
+                [np.zeros(0, dtype=int)] + self._removed).tolist()):
+            orbit[node] = orbit[anchor[node]]
+            position[node] = position[anchor[node]]
+            if link[node]:
+                position[node] = positions.setdefault(
+                    (position[node], link[node]), len(positions) + 1)
+        _, classes = np.unique(np.column_stack((orbit, position)), axis=0,
+                               return_inverse=True)
+        return refinement.canonical_colors(classes.ravel())
+
+
+def orbit_coloring(A, initial=None):
+    """
+    Finds the orbits of the automorphism group of a graph, i.e. the nodes
+    that can be mapped to each other by a relabeling that preserves every
+    edge (and the initial colors). Every orbit partition is equitable, but
+    nodes in one cell of the coarsest equitable partition need not be
+    symmetric, so the orbits tell true symmetry from mere balance.
+
+    This is an individualization-refinement search in the style of nauty.
+    Twin nodes and hanging trees, the most common symmetries in real
+    networks, are collapsed first, which leaves nothing to search for a
+    tree. Then, starting from the equitable coloring of the graph, the
+    search repeatedly gives one node of a non-singleton cell its own color
+    and refines again, down to a discrete coloring (the first path). For
+    every level of the first path, from the bottom up, it tries to map the
+    chosen node to each other node of its cell by an automorphism fixing the
+    nodes chosen above it, searching below that node only where its coloring
+    differs from the path's (see _search). Nodes already known to be in the
+    same orbit under the automorphisms found so far are skipped, at every
+    level of the search. The orbits are the classes of the group generated
+    by all the automorphisms found.
+
+    Each individualization is refined from the cell it splits and undone
+    afterwards (see _Coloring), so its cost follows the cells it changes
+    rather than the size of the graph.
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix with integer entries, where
+            A[i, j] is node i receiving from node j
+        initial (ndarray (n,)): initial color of each node; automorphisms
+            must preserve it. Defaults to every node having the same color
+
+    Returns:
+        (ndarray (n,)): orbit of each node, numbered 0, ..., k-1 in the order
+            of the smallest node of each orbit
+    """
+    A = _canonical_csr(sparse.csr_matrix(A).astype(np.int64))
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    if initial is None:
+        initial = np.zeros(n, dtype=int)
+    _, colors = np.unique(np.asarray(initial), return_inverse=True)
+    colors = colors.ravel()
+
+    # peel trees and merge twins until neither changes the graph, as each
+    # can make room for the other
+    reduction = _Reduction(n)
+    stage, reduced = 0, True
+    while reduced:
+        reduced = False
+        for closed in (None, False, True):
+            stage += 1
+            if closed is None:
+                result = _peel_trees(A, colors, stage, reduction.types)
+            else:
+                result = _merge_twins(A, colors, closed)
+            if result is not None:
+                A, colors = reduction.apply(*result)
+                reduced = True
+    AT = _canonical_csr(A.T)
+
+    # follow the first path down to a discrete coloring, on two copies of
+    # the coloring for _search
+    left, right = _Coloring(A, AT, colors), _Coloring(A, AT, colors)
+    nodes, targets, traces, marks = [], [], [], []
+    while True:
+        target = left.target_cell()
+        if target is None:
+            break
+        node = left.cell(target).min()
+        marks.append(left.mark())
+        traces.append(left.individualize(node))
+        right.individualize(node)
+        nodes.append(node)
+        targets.append(target)
+    marks.append(left.mark())
+
+    orbits = _UnionFind(A.shape[0])
+    gamma, generators = np.arange(A.shape[0]), []
+    # walk back up the path, undoing one individualization at a time; left
+    # stays one level below right
+    for depth in range(len(nodes) - 1, -1, -1):
+        left.undo(marks[depth + 1])
+        right.undo(marks[depth])
+        chosen = nodes[depth]
+        failed = []
+        # the orbits of the nodes that failed, updated after every union
+        failed_roots = set()
+        for node in np.sort(right.cell(targets[depth])).tolist():
+            root = orbits.find(node)
+            if root == orbits.find(chosen) or root in failed_roots:
+                continue
+            found = _search(left, right, node, traces[depth], marks[depth],
+                            gamma, generators)
+            if found is None:
+                failed.append(node)
+                failed_roots.add(root)
+            else:
+                generators.append(found)
+                orbits.union_permutation(*found)
+                failed_roots = {orbits.find(f) for f in failed}
+
+    return reduction.orbits(orbits.labels())
@@ -0,0 +1,210 @@
+# partition.py
+from collections.abc import Mapping
+from scipy import sparse
+import numpy as np
+
+
+class Partition(Mapping):
+
+    """
+    A partition of the nodes 0, ..., n-1 into cells (colors), stored as three
+    flat arrays instead of a dictionary of index arrays:
+
+        color[i] is the color of node i
+        order lists the nodes sorted by color, and by index within a color
+        the nodes of color c are order[offsets[c]:offsets[c+1]]
+
+    This takes about 8 bytes per node and 8 per cell, so the coloring of a
+    million node graph fits in a few megabytes, and the size and color of a
+    cell or node are O(1) lookups. Whole partition questions (cell sizes,
+    colors of a set of nodes) are plain numpy operations on the arrays.
+
+    A Partition is also a read-only mapping from each color to the sorted
+    indices of its nodes, so code written for the old dict(int: ndarray)
+    format of DirectedGraph.colors works unchanged. The cells it hands out are
+    views into order and should not be modified.
+
+    Attributes:
+        color (ndarray (n,)): int32 color of each node, numbered 0, ..., k-1
+        order (ndarray (n,)): int32 nodes sorted by color
+        offsets (ndarray (k+1,)): int64 start of each cell in order
+        n (int): number of nodes
+
+    Methods:
+        from_dict()
+        to_dict()
+        size()
+        sizes()
+        color_of()
+        indicator()
+        quotient()
+        condensation()
+    """
+
+    def __init__(self, colors):
+        """
+        Parameters:
+            colors (ndarray (n,)): color of each node; any labels will do, they
+                are renumbered 0, ..., k-1 in increasing order
+        """
+        colors = np.asarray(colors)
+        if colors.ndim != 1:
+            raise ValueError('colors must be a one dimensional array')
+        labels, color = np.unique(colors, return_inverse=True)
+        self.color = color.ravel().astype(np.int32)
+        self.n = self.color.size
+
+        # a counting sort of the nodes by color
+        self.order = np.argsort(self.color, kind='stable').astype(np.int32)
+        self.offsets = np.zeros(labels.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.color, minlength=labels.size),
+                  out=self.offsets[1:])
+
+    @classmethod
+    def from_dict(cls, colors, n):
+        """
+        Builds a Partition from the dictionary format of DirectedGraph.colors.
+
+        Parameters:
+            colors (dict(int: list(int))): maps each color to its nodes
+            n (int): number of nodes
+
+        Returns:
+            (Partition): the same partition, with the colors renumbered in
+                increasing order
+        """
+        array = np.full(n, -1, dtype=np.int64)
+        total = 0
+        for color, cluster in colors.items():
+            cluster = np.asarray(cluster, dtype=np.int64)
+            array[cluster] = color
+            total += cluster.size
+        # every node must be in exactly one cell
+        if total != n or (array < 0).any():
+            raise ValueError('the clusters do not partition the nodes')
+        return cls(array)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict(int: ndarray): a copy of the partition in the old format,
+                mapping each color to the sorted indices of its nodes
+        """
+        return {color: self[color].copy() for color in self}
+
+    def size(self, color):
+        """
+        Returns:
+            (int): number of nodes of the given color
+        """
+        return int(self.offsets[color + 1] - self.offsets[color])
+
+    def sizes(self):
+        """
+        Returns:
+            (ndarray (k,)): number of nodes of each color
+        """
+        return np.diff(self.offsets)
+
+    def color_of(self, nodes):
+        """
+        Parameters:
+            nodes (int or ndarray): node indices
+
+        Returns:
+            (int or ndarray): the color of each node
+        """
+        return self.color[nodes]
+
+    def indicator(self):
+        """
+        Returns:
+            (sparse.csr_matrix (n, k)): the characteristic matrix P of the
+                partition, where P[i, c] is 1 if node i has color c
+        """
+        return sparse.csr_matrix(
+            (np.ones(self.n), self.color, np.arange(self.n + 1)),
+            shape=(self.n, len(self)))
+
+    def quotient(self, A):
+        """
+        Computes the quotient (divisor) matrix B = D^-1 P^T A P of a matrix,
+        where P is the indicator matrix and D holds the cell sizes, so B[c, d]
+        is the average input a node of color c receives from color d.
+
+        If the partition is equitable for A, every node of color c receives
+        exactly B[c, d] from color d and A P = P B. Then every eigenvalue of B
+        is an eigenvalue of A, and an eigenvector y of B lifts to the
+        eigenvector y[color] of A. For a nonnegative A the spectral radius of
+        B is that of A.
+
+        Parameters:
+            A (sparse matrix (n, n)): matrix where A[i, j] is node i receiving
+                from node j
+
+        Returns:
+            (sparse.csr_matrix (k, k)): the quotient matrix
+        """
+        P = self.indicator()
+        return sparse.csr_matrix(
+            sparse.diags(1. / self.sizes()) @ (P.T @ sparse.csr_matrix(A) @ P))
+
+    def condensation(self, A):
+        """
+        Computes the 0/1 pattern of P^T |A| P in one sparse product, so entry
+        (c, d) is 1 if some node of color c receives from some node of color
+        d. With the strongly connected components as the cells, this is the
+        condensation of the graph, except for a 1 on the diagonal for every
+        component with an edge inside it.
+
+        Parameters:
+            A (sparse matrix or ndarray (n, n)): matrix where A[i, j] is node
+                i receiving from node j
+
+        Returns:
+            (sparse.csr_matrix (k, k)): the int condensation matrix
+        """
+        P = self.indicator()
+        C = sparse.csr_matrix(P.T @ abs(sparse.csr_matrix(A)) @ P)
+        C.eliminate_zeros()
+        C.data = np.ones(C.nnz, dtype=int)
+        return C
+
+    def __getitem__(self, color):
+        try:
+            color = int(color)
+        except (TypeError, ValueError):
+            raise KeyError(color)
+        if not 0 <= color < len(self):
+            raise KeyError(color)
+        return self.order[self.offsets[color]:self.offsets[color + 1]]
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    def __eq__(self, other):
+        if isinstance(other, Partition):
+            return np.array_equal(self.color, other.color)
+        if isinstance(other, Mapping):
+            # compare with the old format cell by cell
+            if set(self) != set(other):
+                return False
+            return all(np.array_equal(self[color], np.sort(other[color]))
+                       for color in self)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # the other arrays are rebuilt from the colors, which halves pickles
+        return (Partition, (self.color,))
+
+    def __repr__(self):
+        # small partitions print like the old dictionary
+        if self.n <= 100:
+            cells = {color: self[color].tolist() for color in self}
+            return f'Partition({cells})'
+        return f'Partition(n={self.n}, colors={len(self)})'
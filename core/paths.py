@@ -0,0 +1,236 @@
+# paths.py
+from scipy import sparse
+from scipy.sparse.linalg import spsolve_triangular
+import numpy as np
+from partition import Partition
+
+
+def _successors(smallA, base_size):
+    """
+    Returns:
+        (sparse.csr_matrix (N, N)): row u lists the nodes receiving from u in
+            the compressed graph, in increasing order
+    """
+    out = sparse.csr_matrix(sparse.csr_matrix(smallA).T)
+    out.eliminate_zeros()
+    out.sort_indices()
+    return out
+
+
+def _topological_order(inner):
+    """
+    Orders the nodes of a DAG so every node comes after the nodes it links
+    to. The strong components scipy finds are numbered in the order they are
+    completed, which is such an order when every component is a single node;
+    the order is checked, and otherwise found by repeatedly removing the
+    nodes without links left.
+
+    Parameters:
+        inner (sparse.csr_matrix (c, c)): row u holds the nodes receiving
+            from node u
+
+    Returns:
+        (ndarray (c,)): the nodes, those at the end of the paths first
+
+    Raises:
+        ValueError: if the graph has a cycle
+    """
+    c = inner.shape[0]
+    num, labels = sparse.csgraph.connected_components(inner,
+                                                      connection='strong')
+    if num < c:
+        raise ValueError('the components of the compressed graph have a cycle')
+    rows = np.repeat(np.arange(c), np.diff(inner.indptr))
+    if np.all(labels[inner.indices] < labels[rows]):
+        return np.argsort(labels)
+
+    into = sparse.csc_matrix(inner)
+    remaining = np.diff(inner.indptr)
+    order, level = [], np.flatnonzero(remaining == 0)
+    while level.size:
+        order.append(level)
+        # the nodes linking to this level have one link less left
+        sources = np.concatenate([into.indices[into.indptr[v]:into.indptr[v+1]]
+                                  for v in level])
+        np.subtract.at(remaining, sources, 1)
+        level = np.unique(sources[remaining[sources] == 0])
+    return np.concatenate(order)
+
+
+def _accumulate(inner, start):
+    """
+    Sums a quantity over the paths of a DAG: solves X[u] = start[u] + the sum
+    of inner[u, w] X[w] over the nodes w receiving from u. In a topological
+    order (see _topological_order), I - inner is triangular, and one
+    triangular solve fixes every node after all those it leads to.
+
+    Parameters:
+        inner (sparse.csr_matrix (c, c)): row u holds the nodes receiving
+            from node u, with the (positive) weights of the links
+        start (ndarray (c, m)): the (nonnegative) quantity at each node
+
+    Returns:
+        (ndarray (c, m)): X, with inf where it overflows
+    """
+    start = np.array(start, dtype=float)
+    c = inner.shape[0]
+    if c == 0:
+        return start
+    order = _topological_order(sparse.csr_matrix(inner))
+    M = sparse.csr_matrix(inner)[order][:, order]
+    X = np.empty_like(start)
+    with np.errstate(all='ignore'):
+        X[order] = spsolve_triangular(sparse.identity(c, format='csr') - M,
+                                      start[order], lower=True)
+    # all the terms are nonnegative, so the solver only gives nan where a
+    # sum overflowed
+    X[np.isnan(X)] = np.inf
+    return X
+
+
+def count_base_paths(smallA, base_size, out=None):
+    """
+    Counts the paths from every component of a compressed graph to every
+    base node that only pass through components. The components form a DAG,
+    and the paths from a component are its direct links to base nodes plus
+    the paths of the components receiving from it, see _accumulate.
+
+    Parameters:
+        smallA (sparse matrix or ndarray (N, N)): compressed adjacency matrix,
+            the base nodes first and then the strongly connected components
+        base_size (int): number of base nodes
+        out (sparse.csr_matrix (N, N)): the successors, if already computed
+
+    Returns:
+        (ndarray (N - base_size, base_size)): float number of paths from each
+            component to each base node, which is inf if it overflows
+    """
+    if out is None:
+        out = _successors(smallA, base_size)
+    out = out.copy()
+    out.data = np.ones(out.nnz)
+    return _accumulate(out[base_size:, base_size:].tocsr(),
+                       out[base_size:, :base_size].toarray())
+
+
+def specialization_size(A, base):
+    """
+    Finds the number of nodes and edges specializing a graph over a base set
+    gives, without building it. A path b1, c1, ..., cL, b2 through the
+    components of the compressed graph becomes one branch for every way of
+    picking an edge for each of its links, so it adds
+
+        m(b1, c1) m(c1, c2) ... m(cL, b2)
+
+    copies of the components c1, ..., cL, where m(u, v) is the number of
+    edges from u to v. The sums of these products, and of the same products
+    weighted by the nodes and edges of the copies, over all the paths are
+    found by dynamic programming over the DAG of the components, like
+    count_base_paths.
+
+    Parameters:
+        A (sparse matrix or ndarray (n, n)): adjacency matrix, where A[i, j]
+            is node i receiving from node j
+        base (list(int)): indices of the base nodes
+
+    Returns:
+        nodes (int): number of nodes of the specialized graph
+        edges (int): number of edges of the specialized graph
+        (both are floats, possibly inf, once they pass 2^53)
+    """
+    A = sparse.csr_matrix(A)
+    n = A.shape[0]
+    base = np.asarray(base, dtype=int)
+    base_size = base.size
+    pattern = sparse.csr_matrix((A != 0).astype(float))
+
+    # the base nodes first, then one cell for each strongly connected
+    # component of the other nodes
+    rest = np.setdiff1d(np.arange(n), base)
+    _, scc = sparse.csgraph.connected_components(pattern[rest][:, rest],
+                                                 connection='strong')
+    cells = np.empty(n, dtype=int)
+    cells[base] = np.arange(base_size)
+    cells[rest] = base_size + scc
+    P = Partition(cells).indicator()
+    # M[u, v] is the number of edges from cell u to cell v
+    M = sparse.csr_matrix(P.T @ pattern.T @ P)
+    sizes = np.bincount(cells)[base_size:]
+    within = M.diagonal()[base_size:]
+
+    # the links between different components
+    inner = M[base_size:, base_size:].tocoo()
+    keep = inner.row != inner.col
+    inner = sparse.csr_matrix(
+        (inner.data[keep], (inner.row[keep], inner.col[keep])),
+        shape=inner.shape)
+    first = M[:base_size, base_size:]
+    last = M[base_size:, :base_size].toarray()
+
+    # branches from each component to each base node, and their nodes and
+    # edges (the edges inside each copy and the link leaving it)
+    branches = _accumulate(inner, last)
+    copies, links = np.hsplit(_accumulate(inner, np.hstack((
+        sizes[:, None]*branches, (within + 1.)[:, None]*branches))), 2)
+
+    nodes = base_size + (first @ copies).sum()
+    # the base block, then each branch with the link entering it
+    edges = pattern[base][:, base].nnz + (first @ links).sum() + \
+        (first @ branches).sum()
+    if max(nodes, edges) < 2**53:
+        return int(nodes), int(edges)
+    return nodes, edges
+
+
+def base_paths(smallA, base_size):
+    """
+    Generates the paths between pairs of base nodes through the components of
+    a compressed graph, each pair (b1, b2) in turn; the paths from a base node
+    back to itself are the cycles through it. The paths are found by depth
+    first search, only stepping to components that have a path left to b2
+    (see count_base_paths), so every step leads to a path, and they are
+    yielded one at a time rather than held in a list, since there can be
+    exponentially many.
+
+    Parameters:
+        smallA (sparse matrix or ndarray (N, N)): compressed adjacency matrix,
+            the base nodes first and then the strongly connected components
+        base_size (int): number of base nodes
+
+    Yields:
+        (ndarray): a path b1, components..., b2 as indices of smallA
+    """
+    out = _successors(smallA, base_size)
+    counts = count_base_paths(smallA, base_size, out)
+
+    for b1 in range(base_size):
+        for b2 in range(base_size):
+            path, stack = [b1], [_steps(out, counts, base_size, b1, b1, b2)]
+            while stack:
+                v = next(stack[-1], None)
+                if v is None:
+                    stack.pop()
+                    path.pop()
+                elif v == b2:
+                    yield np.array(path + [b2])
+                else:
+                    path.append(v)
+                    stack.append(_steps(out, counts, base_size, v, b1, b2))
+
+
+def _steps(out, counts, base_size, u, b1, b2):
+    """
+    Returns:
+        (iterator): the components receiving from u that have a path to b2,
+            and b2 itself if it receives from the component u. b2 comes last
+            when looking for cycles (b1 == b2) and first otherwise, the order
+            networkx.all_simple_paths used to give
+    """
+    nodes = out.indices[out.indptr[u]:out.indptr[u + 1]]
+    inner = nodes[nodes >= base_size]
+    inner = inner[counts[inner - base_size, b2] > 0]
+    if u < base_size or b2 not in nodes:
+        return iter(inner)
+    if b1 == b2:
+        return iter(np.append(inner, b2))
+    return iter(np.insert(inner, 0, b2))
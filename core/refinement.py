@@ -0,0 +1,1139 @@
+# refinement.py
+import os
+from collections import namedtuple
+import numpy as np
+from scipy import sparse
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+# bump when a change to the refinement can change its results; cached
+# colorings (see coloring_cache.py) from other versions are ignored
+VERSION = 1
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is only needed for engine='numba'
+    njit = None
+
+
+def _gather_columns(indptr, indices, data, nodes):
+    """
+    Collects the entries of the columns listed in nodes from the CSC arrays of
+    a matrix.
+
+    Parameters:
+        indptr, indices, data (ndarray): CSC arrays of the adjacency matrix
+        nodes (ndarray): the columns to collect
+
+    Returns:
+        rows (ndarray): row index of every entry in the collected columns
+        weights (ndarray): value of every entry in the collected columns
+    """
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = lengths.sum()
+    if total == 0:
+        return indices[:0], data[:0]
+
+    # build the flat positions of every entry without a python loop; each
+    # column contributes the range starts[k], ..., starts[k] + lengths[k] - 1
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    positions = offsets + np.arange(total)
+    return indices[positions], data[positions]
+
+
+def _mix(x):
+    """
+    The splitmix64 finalizer, a fast bijective scrambling of uint64 values
+    (wraps around on overflow).
+    """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _row_hashes(M, seed):
+    """
+    Hashes every row of a sparse matrix, treating the row as the multiset of
+    its (column, value) pairs. Equal rows always get equal hashes, different
+    rows collide with probability about 2**-64.
+
+    Parameters:
+        M (sparse.csr_matrix): matrix with integer entries and no explicit
+            zeros
+        seed (int): selects one of many independent hash functions
+
+    Returns:
+        (ndarray (n,), uint64): the hash of every row
+    """
+    cols = M.indices.astype(np.uint64)
+    vals = M.data.astype(np.int64).view(np.uint64)
+    # hash each (column, value) pair, then add them up so that the order of
+    # the entries in a row does not matter
+    pairs = _mix(_mix(cols + np.uint64(seed)) ^ vals)
+    hashes = np.zeros(M.shape[0], dtype=np.uint64)
+    nonempty = np.diff(M.indptr) > 0
+    if pairs.size:
+        hashes[nonempty] = np.add.reduceat(pairs, M.indptr[:-1][nonempty])
+    return hashes
+
+
+def key_colors(keys):
+    """
+    Numbers arbitrary hashable keys (labels, dynamics functions, ...) by
+    order of first appearance, so equal keys get equal colors.
+
+    Parameters:
+        keys (iterable): one key per node or edge
+
+    Returns:
+        (ndarray): the number of each key
+    """
+    numbers = {}
+    return np.array([numbers.setdefault(key, len(numbers)) for key in keys],
+                    dtype=np.int64)
+
+
+def typed_adjacency(A, types):
+    """
+    Folds edge types into the entries of an adjacency matrix, so that the
+    refinement engines find the coarsest partition that is equitable for
+    every edge type at once (a multi-relational equitable partition). Each
+    entry is multiplied by a pseudo random 40 bit number chosen by its type;
+    two nodes then receive the same total from a color exactly when they
+    receive the same weight of every type from it, up to collisions of
+    probability about 2**-40. The 40 bits leave room for input sums of up to
+    2**23 before int64 overflows.
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix with integer entries
+        types (ndarray): integer type of every entry of sparse.coo_matrix(A),
+            in the same order
+
+    Returns:
+        (sparse.csr_matrix): the typed adjacency matrix, with int64 entries
+    """
+    A = sparse.coo_matrix(A)
+    if A.nnz and np.abs(A).sum(axis=1).max() >= 2**23:
+        raise OverflowError('input sums are too large for typed edges')
+    weights = _mix(np.asarray(types).astype(np.uint64)) >> np.uint64(24)
+    # zero would erase the edge
+    weights = (weights | np.uint64(1)).astype(np.int64)
+    return sparse.csr_matrix((A.data.astype(np.int64) * weights,
+                              (A.row, A.col)), shape=A.shape)
+
+
+def weight_shift(data):
+    """
+    Finds the smallest power of two that turns floats into integers without
+    rounding (see integer_weights).
+
+    Parameters:
+        data (ndarray): finite weights
+
+    Returns:
+        (int): the smallest shift >= 0 that makes 2^shift x an integer for
+            every x in data
+    """
+    data = np.asarray(data, dtype=float)
+    # x = M 2^(e-53) with an integer M, whose trailing zero bits we can
+    # drop, so 2^shift x is an integer for every shift >= 53 - e - zeros
+    mantissa, exponent = np.frexp(data[data != 0])
+    mantissa = np.abs(np.ldexp(mantissa, 53)).astype(np.int64)
+    zeros = np.log2(mantissa & -mantissa).astype(np.int64)
+    return max(0, int((53 - exponent - zeros).max(initial=0)))
+
+
+def integer_weights(A, tol=None, shift=None):
+    """
+    Converts a weighted (possibly signed) adjacency matrix to the integer
+    entries the refinement engines compare, so that two nodes receive equal
+    totals from a color exactly when the engines see equal integer sums.
+
+    With tol=None the weights are rationalized exactly: every float is a
+    binary fraction, so multiplying all of them by one power of two makes
+    them integers without any rounding. Input sums are then compared exactly
+    on the stored values (so 0.1 + 0.2 and 0.3 differ, as they do in A).
+    With a tolerance the weights are instead rounded to multiples of tol,
+    which merges weights that differ by noise below the tolerance; weights
+    on either side of a rounding boundary can still land in neighboring
+    multiples. Integer matrices are returned unchanged when tol is None.
+
+    Parameters:
+        A (sparse matrix (n, n)): weighted adjacency matrix
+        tol (float): quantization step of the weights, or None for exact
+            comparison
+        shift (int): with tol=None, scale the weights by 2**shift instead of
+            the smallest power of two that makes them integers (see
+            weight_shift), e.g. to scale weights added later alike
+
+    Returns:
+        (sparse.csr_matrix): int64 adjacency matrix with the same sparsity,
+            except for weights that round to zero
+
+    Raises:
+        OverflowError: if the scaled input sums do not fit in an int64; a
+            coarser tol makes them smaller
+    """
+    A = sparse.csr_matrix(A)
+    if tol is None and shift is None and np.issubdtype(A.dtype, np.integer):
+        return A.astype(np.int64)
+    data = A.data.astype(float)
+    if not np.isfinite(data).all():
+        raise ValueError('weights must be finite')
+
+    if tol is not None:
+        if tol <= 0:
+            raise ValueError('tol must be positive')
+        data = np.rint(data / tol)
+        shift = 0
+    elif shift is None:
+        shift = weight_shift(data)
+
+    # the engines add up whole rows, which must not overflow
+    sums = np.asarray(sparse.csr_matrix((np.abs(data), A.indices, A.indptr),
+                                        shape=A.shape).sum(axis=1))
+    largest = sums.max(initial=0)
+    if largest > 0 and np.log2(largest) + shift >= 62:
+        raise OverflowError('the scaled weights overflow int64, use a '
+                            'coarser tol')
+    data = np.ldexp(data, shift)
+    # eliminate_zeros works in place, on arrays that A must keep
+    B = sparse.csr_matrix((data.astype(np.int64), A.indices.copy(),
+                           A.indptr.copy()), shape=A.shape)
+    B.eliminate_zeros()
+    return B
+
+
+def canonical_colors(colors):
+    """
+    Relabels a coloring so that the colors are numbered 0, ..., k-1 in the
+    order of the smallest node index in each cell. Two colorings describing the
+    same partition have the same canonical form.
+
+    Parameters:
+        colors (ndarray (n,)): color of each node
+
+    Returns:
+        (ndarray (n,)): the relabeled colors
+    """
+    # the first occurrence of every color, sorted by node index
+    _, first, inverse = np.unique(colors, return_index=True,
+                                  return_inverse=True)
+    rank = np.empty(first.size, dtype=int)
+    rank[np.argsort(first)] = np.arange(first.size)
+    return rank[inverse.ravel()]
+
+
+# a pair of cells where the nodes of cell receive between low and high inputs
+# from source, instead of the same number
+Violation = namedtuple('Violation', ['cell', 'source', 'low', 'high'])
+
+# the colors after every pass of a whole graph refinement, as an int32 array
+# (rounds, n) starting from the initial colors, and for every round the color
+# in the previous round of each of its cells (-1 in round 0)
+Trace = namedtuple('Trace', ['colors', 'parents'])
+
+
+def _trace(history):
+    """
+    Builds the Trace of a refinement from its list of per-round colors. Every
+    cell of a round lies inside one cell of the round before, so its parent
+    is the previous color of any of its nodes.
+
+    Returns:
+        (Trace): the stacked colors and the parents of every round
+    """
+    colors = np.stack(history).astype(np.int32)
+    parents = [np.full(colors[0].max(initial=-1) + 1, -1, dtype=np.int32)]
+    for previous, current in zip(colors[:-1], colors[1:]):
+        parent = np.empty(current.max(initial=-1) + 1, dtype=np.int32)
+        parent[current] = previous
+        parents.append(parent)
+    return Trace(colors, parents)
+
+
+def _input_ranges(A, colors):
+    """
+    Finds the smallest and largest input every cell receives from every other
+    cell. The input counts A @ P are computed once; their nonzero entries are
+    then sorted by (cell of the receiving node, source cell) and
+    np.minimum.reduceat/np.maximum.reduceat give the smallest and largest
+    count of every such segment. A segment with fewer entries than nodes in
+    its cell also contains zeros.
+
+    Parameters:
+        A (sparse.csr_matrix (n, n)): adjacency matrix
+        colors (ndarray (n,)): color of each node, numbered 0, ..., k-1
+
+    Returns:
+        cells, sources, low, high (ndarray): for every pair of colors where
+            some node of cell receives from source, the smallest and largest
+            input, sorted by (cell, source)
+        M (sparse.coo_matrix (n, k)): the input counts A @ P
+    """
+    n = A.shape[0]
+    k = colors.max() + 1
+    P = sparse.csr_matrix((np.ones(n, dtype=A.dtype), (np.arange(n), colors)),
+                          shape=(n, k))
+    M = (A @ P).tocoo()
+    M.eliminate_zeros()
+    if M.nnz == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, M.data, M.data, M
+
+    cells, sources, data = colors[M.row], M.col, M.data
+    order = np.lexsort((sources, cells))
+    cells, sources, data = cells[order], sources[order], data[order]
+    starts = np.flatnonzero(np.diff(cells) | np.diff(sources)) + 1
+    starts = np.concatenate(([0], starts))
+
+    low = np.minimum.reduceat(data, starts)
+    high = np.maximum.reduceat(data, starts)
+    # segments that miss some nodes of the cell also have zero inputs
+    entries = np.diff(np.concatenate((starts, [data.size])))
+    partial = entries < np.bincount(colors, minlength=k)[cells[starts]]
+    low = np.where(partial, np.minimum(low, 0), low)
+    high = np.where(partial, np.maximum(high, 0), high)
+    return cells[starts], sources[starts], low, high, M
+
+
+def equitability_violations(A, colors, tol=0):
+    """
+    Lists every pair of cells that breaks equitability, in one pass over the
+    input counts A @ P (see _input_ranges).
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix, where A[i, j] is node i
+            receiving from node j
+        colors (ndarray (n,)): color of each node, numbered 0, ..., k-1
+        tol (float): inputs that differ by at most tol count as equal, for
+            matrices with rounding error in their entries
+
+    Returns:
+        violations (list(Violation)): one (cell, source, low, high) tuple for
+            each pair of colors where the nodes of cell receive unequal inputs
+            from source, sorted by (cell, source)
+    """
+    A = sparse.csr_matrix(A)
+    n = A.shape[0]
+    if n == 0:
+        return []
+    cells, sources, low, high, _ = _input_ranges(A, np.asarray(colors))
+    bad = np.flatnonzero(high - low > tol)
+    return [Violation(int(cells[b]), int(sources[b]), low[b].item(),
+                      high[b].item()) for b in bad]
+
+
+def quasi_equitable_coloring(A, eps):
+    """
+    Finds a coarse quasi-equitable partition: one where the nodes of a cell
+    receive inputs from every cell that differ by at most eps, instead of
+    exactly the same. Real networks rarely have exact symmetries, so their
+    coarsest equitable partition is mostly singletons, while a quasi-equitable
+    one can be far coarser and still gives useful quotients.
+
+    Refinement starts from a single cell. In each round, every cell whose
+    inputs from some cell spread by more than eps is split along the source
+    giving the largest spread, clustering its nodes by that input: sorted by
+    input, the nodes are cut wherever two consecutive inputs are more than eps
+    apart. A cell whose inputs have no such gap, only a spread, is cut into
+    bins of width eps instead. eps=0 gives the coarsest equitable partition.
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix, possibly weighted, where
+            A[i, j] is node i receiving from node j
+        eps (float): largest allowed spread of the inputs of one cell from
+            another, in units of the weights
+
+    Returns:
+        colors (ndarray (n,)): canonical color of each node
+        error (float): the largest spread of the inputs of a cell from
+            another cell, at most eps
+    """
+    if eps < 0:
+        raise ValueError('eps must be nonnegative')
+    A = sparse.csr_matrix(A)
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=int), 0.
+    colors = np.zeros(n, dtype=int)
+
+    while True:
+        cells, sources, low, high, M = _input_ranges(A, colors)
+        spread = high - low
+        bad = spread > eps
+        if not bad.any():
+            break
+
+        # the source with the largest spread for every cell that must split
+        cells, sources, low, spread = (cells[bad], sources[bad], low[bad],
+                                       spread[bad])
+        order = np.lexsort((-spread, cells))
+        first = np.concatenate(([True], np.diff(cells[order]) != 0))
+        k = colors.max() + 1
+        worst = np.full(k, -1)
+        worst[cells[order][first]] = sources[order][first]
+        floor = np.zeros(k)
+        floor[cells[order][first]] = low[order][first]
+
+        # every node's input from the worst source of its cell
+        nodes = np.flatnonzero(worst[colors] >= 0)
+        values = np.asarray(M.tocsr()[nodes, worst[colors[nodes]]]).ravel()
+        order = np.lexsort((values, colors[nodes]))
+        nodes, values = nodes[order], values[order]
+        # we cut each cell at the gaps between its sorted inputs
+        same = np.diff(colors[nodes]) == 0
+        gaps = np.concatenate(([False], same & (np.diff(values) > eps)))
+        bins = np.zeros(n)
+        bins[nodes] = np.cumsum(gaps)
+        # cells without a gap are cut into bins of width eps
+        no_gap = np.ones(k, dtype=bool)
+        no_gap[colors[nodes[gaps]]] = False
+        binned = no_gap[colors[nodes]]
+        bins[nodes[binned]] = -1 - np.floor(
+            (values[binned] - floor[colors[nodes[binned]]]) / eps)
+        _, colors = np.unique(np.column_stack((colors, bins)), axis=0,
+                              return_inverse=True)
+        colors = colors.ravel()
+
+    return canonical_colors(colors), float(spread.max(initial=0))
+
+
+def worklist_refinement(indptr, indices, data, n, initial=None):
+    """
+    Finds the coarsest equitable partition refining an initial partition with
+    worklist based partition refinement. Instead of comparing every pair of
+    colors on every pass, a cell is only used as a splitter when it is new,
+    and only the cells receiving input from the splitter are examined. When a
+    cell splits, all but its largest part are added to the worklist, so every
+    node is in a processed splitter O(log n) times and the whole refinement
+    costs O(m log n).
+
+    Parameters:
+        indptr, indices, data (ndarray): CSC arrays of the adjacency matrix A,
+            so indices[indptr[j]:indptr[j+1]] are the nodes receiving from
+            node j and data holds the (integer) edge weights
+        n (int): number of nodes
+        initial (ndarray (n,)): initial color of each node. Defaults to every
+            node having the same color
+
+    Returns:
+        colors (ndarray (n,)): canonical color of each node (see
+            canonical_colors)
+    """
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    if initial is None:
+        initial = np.zeros(n, dtype=int)
+
+    # elements stores the nodes grouped by cell; each cell c occupies the
+    # slice elements[start[c]:end[c]] and position is the inverse permutation
+    colors = canonical_colors(np.asarray(initial))
+    elements = np.argsort(colors, kind='stable')
+    position = np.empty(n, dtype=int)
+    position[elements] = np.arange(n)
+
+    num_cells = colors.max() + 1
+    sizes = np.bincount(colors, minlength=num_cells)
+    start = np.zeros(n, dtype=int)
+    end = np.zeros(n, dtype=int)
+    end[:num_cells] = np.cumsum(sizes)
+    start[:num_cells] = end[:num_cells] - sizes
+
+    # nothing is known to be stable yet, so every cell is a splitter
+    worklist = list(range(num_cells - 1, -1, -1))
+    in_worklist = np.zeros(n, dtype=bool)
+    in_worklist[:num_cells] = True
+    touched = np.zeros(n, dtype=bool)
+
+    while worklist:
+        splitter = worklist.pop()
+        in_worklist[splitter] = False
+
+        # inputs from the splitter; copied before the splitter itself splits
+        members = elements[start[splitter]:end[splitter]].copy()
+        rows, weights = _gather_columns(indptr, indices, data, members)
+        if rows.size == 0:
+            continue
+        nodes, inverse = np.unique(rows, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=weights,
+                             minlength=nodes.size)
+        # a node whose inputs cancel out behaves exactly like an untouched one
+        keep = counts != 0
+        if not keep.any():
+            continue
+        nodes, counts = nodes[keep], counts[keep]
+
+        # sort the touched nodes by cell, then by number of inputs
+        node_cells = colors[nodes]
+        order = np.lexsort((counts, node_cells))
+        nodes, counts, node_cells = nodes[order], counts[order], node_cells[order]
+        cell_bounds = np.flatnonzero(np.diff(node_cells)) + 1
+        cell_bounds = np.concatenate(([0], cell_bounds, [nodes.size]))
+
+        for a, b in zip(cell_bounds[:-1], cell_bounds[1:]):
+            cell = node_cells[a]
+            T, T_counts = nodes[a:b], counts[a:b]
+            t = b - a
+            cell_size = end[cell] - start[cell]
+            # inputs equal across the whole cell, so there is nothing to split
+            if t == cell_size and T_counts[0] == T_counts[-1]:
+                continue
+
+            # move the touched nodes to the back of the cell, keeping them
+            # sorted by their number of inputs
+            tail = end[cell] - t
+            touched[T] = True
+            back = elements[tail:end[cell]]
+            untouched_back = back[~touched[back]]
+            front_positions = position[T]
+            front_positions = front_positions[front_positions < tail]
+            elements[front_positions] = untouched_back
+            position[untouched_back] = front_positions
+            elements[tail:end[cell]] = T
+            position[T] = np.arange(tail, end[cell])
+            touched[T] = False
+
+            # every distinct input count becomes its own cell; if the whole
+            # cell was touched, the first group keeps the old color
+            group_bounds = np.flatnonzero(np.diff(T_counts)) + 1
+            group_bounds = np.concatenate(([0], group_bounds, [t]))
+            parts = []
+            if t < cell_size:
+                end[cell] = tail
+                parts.append(cell)
+            for g, (c, d) in enumerate(zip(group_bounds[:-1], group_bounds[1:])):
+                if t == cell_size and g == 0:
+                    end[cell] = tail + d
+                    parts.append(cell)
+                    continue
+                new = num_cells
+                num_cells += 1
+                start[new], end[new] = tail + c, tail + d
+                colors[T[c:d]] = new
+                parts.append(new)
+
+            # Hopcroft's trick: if the old cell was already waiting to be
+            # processed all parts must be, otherwise stability with respect to
+            # the largest part follows from the others
+            if in_worklist[cell]:
+                to_add = parts[1:]
+            else:
+                part_sizes = [end[p] - start[p] for p in parts]
+                largest = int(np.argmax(part_sizes))
+                to_add = parts[:largest] + parts[largest+1:]
+            for p in to_add:
+                if not in_worklist[p]:
+                    in_worklist[p] = True
+                    worklist.append(p)
+
+    return canonical_colors(colors)
+
+
+def signature_refinement(indptr, indices, data, n, initial=None,
+                         trace=False):
+    """
+    Finds the coarsest equitable partition refining an initial partition with
+    whole graph refinement passes. Each pass computes the n x k matrix of input
+    counts A @ P, where P is the sparse color indicator matrix, and gives two
+    nodes the same new color exactly when they have the same old color and the
+    same row of counts. Rows are compared through 128 bits of hashing, so a
+    pass is a handful of sparse kernels and a lexsort rather than a python loop
+    over pairs of colors.
+
+    The colors are ranks of (old color, hash) keys, so they only depend on the
+    structure of the graph and not on how its nodes are numbered. The colors
+    after r passes are the r round colors of the Weisfeiler-Leman (color
+    refinement) algorithm on the in-neighborhoods, which trace=True keeps.
+
+    Parameters:
+        indptr, indices, data (ndarray): CSR arrays of the adjacency matrix A,
+            where A[i, j] is node i receiving from node j
+        n (int): number of nodes
+        initial (ndarray (n,)): initial color of each node. Defaults to every
+            node having the same color
+        trace (bool): if True, the colors of every pass are returned too
+
+    Returns:
+        colors (ndarray (n,)): color of each node
+        trace (Trace): the colors after every pass that refined the partition,
+            only if trace is True
+    """
+    if n == 0:
+        colors = np.zeros(0, dtype=int)
+        return (colors, _trace([colors])) if trace else colors
+    if initial is None:
+        initial = np.zeros(n, dtype=int)
+
+    A = sparse.csr_matrix((data, indices, indptr), shape=(n, n))
+    _, colors = np.unique(np.asarray(initial), return_inverse=True)
+    colors = colors.ravel()
+    num_colors = colors.max() + 1
+    history = [colors.astype(np.int32)] if trace else None
+
+    while True:
+        colors, refined = _signature_pass(A, colors)
+        if refined == num_colors:
+            return (colors, _trace(history)) if trace else colors
+        num_colors = refined
+        if trace:
+            history.append(colors.astype(np.int32))
+
+
+def _signature_pass(A, colors):
+    """
+    One refinement pass of signature_refinement.
+
+    Parameters:
+        A (sparse.csr_matrix): the adjacency matrix
+        colors (ndarray (n,)): current colors, numbered 0, ..., k-1
+
+    Returns:
+        colors (ndarray (n,)): refined colors
+        num_colors (int): number of refined colors
+    """
+    n = A.shape[0]
+    P = sparse.csr_matrix((np.ones(n, dtype=A.dtype), (np.arange(n), colors)),
+                          shape=(n, colors.max() + 1))
+    M = (A @ P).tocsr()
+    M.eliminate_zeros()
+    return _rank_signatures(colors, _row_hashes(M, 1), _row_hashes(M, 2))
+
+
+def _rank_signatures(colors, hash1, hash2):
+    """
+    Gives every node the rank of its (old color, hash1, hash2) key.
+
+    Returns:
+        colors (ndarray (n,)): refined colors
+        num_colors (int): number of refined colors
+    """
+    n = colors.size
+    keys = (hash1, hash2, colors)
+    order = np.lexsort(keys)
+    # a new color starts wherever the sorted keys change
+    change = np.zeros(n, dtype=bool)
+    for key in keys:
+        change[1:] |= key[order][1:] != key[order][:-1]
+    refined = np.empty(n, dtype=int)
+    refined[order] = np.cumsum(change)
+    return refined, refined[order[-1]] + 1
+
+
+def coarsest_from_seed(A, seed):
+    """
+    Finds the coarsest equitable partition of a graph, using a guess of which
+    nodes share a cell to do most of the work on a smaller graph.
+
+    The seed is first refined to the coarsest equitable partition E below it.
+    Since E is equitable, every cell of the coarsest equitable partition is a
+    union of cells of E, and two nodes in the same cell of E receive the same
+    number of inputs from every cell that refinement starting from a single
+    color will ever produce. Refining the k x k quotient matrix of E from a
+    single color therefore gives the coarsest equitable partition of A, for
+    any seed. A seed close to the answer makes both steps cheap.
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix with integer entries, where
+            A[i, j] is node i receiving from node j
+        seed (ndarray (n,)): any initial coloring of the nodes
+
+    Returns:
+        colors (ndarray (n,)): canonical color of each node
+    """
+    A = sparse.csc_matrix(A)
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    E = worklist_refinement(A.indptr, A.indices, A.data, n, initial=seed)
+    return coarsen_equitable(A, E)
+
+
+def coarsen_equitable(A, E):
+    """
+    Merges the cells of an equitable partition into the coarsest equitable
+    partition, by refining its k x k quotient matrix from a single color (see
+    coarsest_from_seed).
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix with integer entries
+        E (ndarray (n,)): an equitable coloring of A, numbered 0, ..., k-1
+
+    Returns:
+        colors (ndarray (n,)): canonical color of each node
+    """
+    A = sparse.csc_matrix(A)
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=int)
+
+    # one representative row per cell of E is enough to build the quotient
+    k = E.max() + 1
+    _, reps = np.unique(E, return_index=True)
+    P = sparse.csr_matrix((np.ones(n, dtype=A.dtype), (np.arange(n), E)),
+                          shape=(n, k))
+    Q = sparse.csr_matrix(A.tocsr()[reps, :] @ P)
+
+    quotient_colors = signature_refinement(Q.indptr, Q.indices, Q.data, k)
+    return canonical_colors(quotient_colors[E])
+
+
+def _worklist_kernel(indptr, indices, data, colors):
+    """
+    The worklist refinement of worklist_refinement written with plain loops
+    over int32 arrays so that numba can compile it in nopython mode. colors is
+    refined in place.
+    """
+    n = colors.size
+    num_cells = 0
+    for i in range(n):
+        if colors[i] + 1 > num_cells:
+            num_cells = colors[i] + 1
+
+    # counting sort of the nodes by color; end is used as a fill pointer
+    sizes = np.zeros(n, np.int32)
+    for i in range(n):
+        sizes[colors[i]] += 1
+    start = np.zeros(n, np.int32)
+    end = np.zeros(n, np.int32)
+    total = 0
+    for c in range(num_cells):
+        start[c] = total
+        end[c] = total
+        total += sizes[c]
+    elements = np.empty(n, np.int32)
+    position = np.empty(n, np.int32)
+    for i in range(n):
+        c = colors[i]
+        elements[end[c]] = i
+        position[i] = end[c]
+        end[c] += 1
+
+    # every cell starts on the worklist
+    stack = np.empty(n, np.int32)
+    top = 0
+    in_worklist = np.zeros(n, np.bool_)
+    for c in range(num_cells - 1, -1, -1):
+        stack[top] = c
+        top += 1
+        in_worklist[c] = True
+
+    counts = np.zeros(n, np.int64)
+    marked = np.zeros(n, np.bool_)
+    touched = np.empty(n, np.int32)
+    members = np.empty(n, np.int32)
+    parts = np.empty(n + 1, np.int32)
+
+    while top > 0:
+        top -= 1
+        splitter = stack[top]
+        in_worklist[splitter] = False
+
+        # count the inputs from the splitter
+        splitter_size = end[splitter] - start[splitter]
+        for k in range(splitter_size):
+            members[k] = elements[start[splitter] + k]
+        num_touched = 0
+        for k in range(splitter_size):
+            j = members[k]
+            for p in range(indptr[j], indptr[j+1]):
+                i = indices[p]
+                if not marked[i]:
+                    marked[i] = True
+                    touched[num_touched] = i
+                    num_touched += 1
+                counts[i] += data[p]
+
+        # inputs that cancel out are the same as no inputs
+        m = 0
+        for k in range(num_touched):
+            i = touched[k]
+            marked[i] = False
+            if counts[i] != 0:
+                touched[m] = i
+                m += 1
+        if m == 0:
+            continue
+
+        # sort the touched nodes by cell, then by number of inputs
+        T = touched[:m].copy()
+        T_counts = np.empty(m, np.int64)
+        for k in range(m):
+            T_counts[k] = counts[T[k]]
+        order = np.argsort(T_counts, kind='mergesort')
+        T = T[order]
+        T_counts = T_counts[order]
+        T_cells = np.empty(m, np.int64)
+        for k in range(m):
+            T_cells[k] = colors[T[k]]
+        order = np.argsort(T_cells, kind='mergesort')
+        T = T[order]
+        T_counts = T_counts[order]
+        T_cells = T_cells[order]
+
+        a = 0
+        while a < m:
+            cell = T_cells[a]
+            b = a
+            while b < m and T_cells[b] == cell:
+                b += 1
+            t = b - a
+            cell_size = end[cell] - start[cell]
+            if t == cell_size and T_counts[a] == T_counts[b-1]:
+                a = b
+                continue
+
+            # move the touched nodes to the back of the cell
+            tail = end[cell] - t
+            for k in range(a, b):
+                marked[T[k]] = True
+            q = tail
+            for k in range(a, b):
+                pos = position[T[k]]
+                if pos < tail:
+                    while marked[elements[q]]:
+                        q += 1
+                    u = elements[q]
+                    elements[pos] = u
+                    position[u] = pos
+                    q += 1
+            for k in range(a, b):
+                elements[tail + k - a] = T[k]
+                position[T[k]] = tail + k - a
+                marked[T[k]] = False
+
+            # split off one cell per distinct number of inputs
+            num_parts = 0
+            if t < cell_size:
+                end[cell] = tail
+                parts[num_parts] = cell
+                num_parts += 1
+            k = a
+            while k < b:
+                g = k
+                while g < b and T_counts[g] == T_counts[k]:
+                    g += 1
+                if t == cell_size and k == a:
+                    end[cell] = tail + g - a
+                    parts[num_parts] = cell
+                else:
+                    new = num_cells
+                    num_cells += 1
+                    start[new] = tail + k - a
+                    end[new] = tail + g - a
+                    for r in range(k, g):
+                        colors[T[r]] = new
+                    parts[num_parts] = new
+                num_parts += 1
+                k = g
+
+            # Hopcroft's trick, as in worklist_refinement
+            skip = 0
+            if not in_worklist[cell]:
+                largest = 0
+                for r in range(num_parts):
+                    p = parts[r]
+                    if end[p] - start[p] > end[parts[largest]] - start[parts[largest]]:
+                        largest = r
+                skip = largest
+            for r in range(num_parts):
+                p = parts[r]
+                if r == skip or in_worklist[p]:
+                    continue
+                in_worklist[p] = True
+                stack[top] = p
+                top += 1
+            a = b
+
+        for k in range(m):
+            counts[T[k]] = 0
+
+    return colors
+
+
+if njit is not None:
+    # cache=True stores the compiled kernel next to this file, so new
+    # processes (e.g. MPI workers) load it instead of compiling again
+    _compiled_worklist_kernel = njit(cache=True)(_worklist_kernel)
+
+
+def numba_refinement(indptr, indices, data, n, initial=None):
+    """
+    Compiled version of worklist_refinement. The kernel works on int32 index
+    arrays and int64 weights, and is compiled by numba the first time it is
+    used; the compiled code is cached on disk, so later processes skip the
+    compilation.
+
+    Parameters:
+        indptr, indices, data (ndarray): CSC arrays of the adjacency matrix A,
+            so indices[indptr[j]:indptr[j+1]] are the nodes receiving from
+            node j. The weights in data must be integers.
+        n (int): number of nodes
+        initial (ndarray (n,)): initial color of each node. Defaults to every
+            node having the same color
+
+    Returns:
+        colors (ndarray (n,)): canonical color of each node
+    """
+    if njit is None:
+        raise ImportError('engine="numba" requires numba to be installed')
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    if initial is None:
+        initial = np.zeros(n, dtype=int)
+    if len(indices) > np.iinfo(np.int32).max:
+        raise ValueError('graph has too many edges for the int32 kernel')
+
+    colors = canonical_colors(np.asarray(initial)).astype(np.int32)
+    colors = _compiled_worklist_kernel(
+        np.asarray(indptr, dtype=np.int32), np.asarray(indices, dtype=np.int32),
+        np.asarray(data, dtype=np.int64), colors)
+    return canonical_colors(colors)
+
+
+# views of the shared memory buffers, set in each worker process by _attach
+_shared = {}
+
+
+def _share(arrays):
+    """
+    Copies arrays into new shared memory blocks.
+
+    Parameters:
+        arrays (dict(str: ndarray)): the arrays to share
+
+    Returns:
+        blocks (list(SharedMemory)): the blocks, to be closed and unlinked by
+            the caller
+        specs (dict(str: tuple)): (block name, shape, dtype) of every array,
+            enough for another process to attach to it
+    """
+    blocks, specs = [], {}
+    for key, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[key] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def _attach(specs):
+    """
+    Worker initializer that maps the shared CSR, color and hash buffers.
+    """
+    for key, (name, shape, dtype) in specs.items():
+        # the pool shares the parent's resource tracker, so the blocks stay
+        # registered once and are unlinked by the parent
+        block = shared_memory.SharedMemory(name=name)
+        _shared[key] = (block, np.ndarray(shape, dtype, buffer=block.buf))
+
+
+def _hash_block(first, last, num_colors):
+    """
+    Computes the signature hashes of the rows first, ..., last-1 from the
+    shared buffers and writes them into the shared hash arrays.
+    """
+    indptr, indices = _shared['indptr'][1], _shared['indices'][1]
+    data, colors = _shared['data'][1], _shared['colors'][1]
+    lo, hi = indptr[first], indptr[last]
+
+    # the block's rows of A @ P, built directly from the colors of the inputs
+    rows = np.repeat(np.arange(last - first), np.diff(indptr[first:last+1]))
+    M = sparse.csr_matrix((data[lo:hi], (rows, colors[indices[lo:hi]])),
+                          shape=(last - first, num_colors))
+    M.sum_duplicates()
+    M.eliminate_zeros()
+    _shared['hash1'][1][first:last] = _row_hashes(M, 1)
+    _shared['hash2'][1][first:last] = _row_hashes(M, 2)
+
+
+def parallel_refinement(indptr, indices, data, n, initial=None, workers=None,
+                        trace=False):
+    """
+    Runs signature_refinement on several cores. The CSR arrays, the current
+    colors and the output hashes live in shared memory; in each pass the rows
+    are split into blocks with about the same number of edges, a process pool
+    hashes the rows of A @ P for each block, and the parent ranks the hashes.
+    The ranking is the same lexsort as in signature_refinement, so the result
+    does not depend on the number of workers. This is the hashing formulation
+    of color refinement from ep_parallel.pdf.
+
+    Parameters:
+        indptr, indices, data (ndarray): CSR arrays of the adjacency matrix A,
+            where A[i, j] is node i receiving from node j
+        n (int): number of nodes
+        initial (ndarray (n,)): initial color of each node. Defaults to every
+            node having the same color
+        workers (int): number of processes. Defaults to os.cpu_count()
+        trace (bool): if True, the colors of every pass are returned too
+
+    Returns:
+        colors (ndarray (n,)): color of each node, identical to the output of
+            signature_refinement
+        trace (Trace): the colors after every pass, only if trace is True
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    if n == 0 or workers <= 1:
+        return signature_refinement(indptr, indices, data, n, initial, trace)
+    if initial is None:
+        initial = np.zeros(n, dtype=int)
+
+    _, colors = np.unique(np.asarray(initial), return_inverse=True)
+    colors = colors.ravel()
+    num_colors = colors.max() + 1
+
+    # split the rows into blocks of roughly equal numbers of edges
+    targets = np.linspace(0, indptr[-1], 4*workers + 1)
+    bounds = np.unique(np.concatenate((
+        [0], np.searchsorted(indptr, targets[1:-1]), [n])))
+
+    history = [colors.astype(np.int32)] if trace else None
+
+    blocks, specs = _share({
+        'indptr': np.asarray(indptr), 'indices': np.asarray(indices),
+        'data': np.asarray(data), 'colors': colors,
+        'hash1': np.zeros(n, dtype=np.uint64),
+        'hash2': np.zeros(n, dtype=np.uint64)})
+    shared = {key: np.ndarray(shape, dtype, buffer=block.buf)
+              for block, (key, (_, shape, dtype)) in zip(blocks, specs.items())}
+    try:
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(specs,)) as pool:
+            while True:
+                shared['colors'][:] = colors
+                jobs = [pool.submit(_hash_block, first, last, num_colors)
+                        for first, last in zip(bounds[:-1], bounds[1:])]
+                for job in jobs:
+                    job.result()
+                colors, refined = _rank_signatures(
+                    colors, shared['hash1'].copy(), shared['hash2'].copy())
+                if refined == num_colors:
+                    return (colors, _trace(history)) if trace else colors
+                num_colors = refined
+                if trace:
+                    history.append(colors.astype(np.int32))
+    finally:
+        del shared
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def equitable_coloring(A, engine='worklist', initial=None, workers=None,
+                       trace=False):
+    """
+    Computes the coarsest equitable partition of a graph refining an initial
+    coloring with one of the refinement engines in this module.
+
+    Parameters:
+        A (sparse matrix (n, n)): adjacency matrix with integer entries, where
+            A[i, j] is node i receiving from node j
+        engine (str): 'worklist', 'vectorized', 'numba' or 'parallel'
+        initial (ndarray (n,)): initial color of each node. Defaults to every
+            node having the same color
+        workers (int): number of processes for engine='parallel'
+        trace (bool): if True, also return the Trace of the colors after
+            every pass. Only the whole graph passes of 'vectorized' and
+            'parallel' have rounds to trace
+
+    Returns:
+        colors (ndarray (n,)): color of each node
+        trace (Trace): the colors of every round, only if trace is True
+    """
+    n = A.shape[0]
+    if trace and engine not in ('vectorized', 'parallel'):
+        raise ValueError(f'the "{engine}" engine has no rounds to trace, '
+                         'use "vectorized" or "parallel"')
+    if engine == 'worklist':
+        A = sparse.csc_matrix(A)
+        return worklist_refinement(A.indptr, A.indices, A.data, n, initial)
+    elif engine == 'numba':
+        A = sparse.csc_matrix(A)
+        return numba_refinement(A.indptr, A.indices, A.data, n, initial)
+    elif engine == 'vectorized':
+        A = sparse.csr_matrix(A)
+        return signature_refinement(A.indptr, A.indices, A.data, n, initial,
+                                    trace)
+    elif engine == 'parallel':
+        A = sparse.csr_matrix(A)
+        return parallel_refinement(A.indptr, A.indices, A.data, n, initial,
+                                   workers, trace)
+    raise ValueError(f'unknown coloring engine "{engine}"')
+
+
+def color_blocks(A, offsets, engine='vectorized', initial=None, workers=None):
+    """
+    Colors many graphs with a single refinement, given as the diagonal blocks
+    of one matrix. Every node starts with the number of its graph as part of
+    its color, so cells never mix nodes of different graphs even where the
+    graphs look alike, and the result is the coarsest equitable partition of
+    each graph side by side.
+
+    Parameters:
+        A (sparse matrix (N, N)): block diagonal adjacency matrix, where
+            nodes offsets[g], ..., offsets[g+1]-1 form graph g
+        offsets (ndarray (G+1,)): first node of every graph, then N
+        engine (str): refinement engine, see equitable_coloring. The whole
+            graph passes of 'vectorized' make the most of one large call
+        initial (ndarray (N,)): initial color of each node within its graph
+        workers (int): number of processes for engine='parallel'
+
+    Returns:
+        colors (ndarray (N,)): canonical colors; the colors of one graph are
+            consecutive and come after those of the graphs before it
+    """
+    offsets = np.asarray(offsets)
+    graph = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))
+    seed = graph
+    if initial is not None:
+        _, seed = np.unique(np.column_stack((graph, initial)), axis=0,
+                            return_inverse=True)
+    colors = equitable_coloring(A, engine, initial=seed.ravel(),
+                                workers=workers)
+    return canonical_colors(colors)
+
+
+def color_many(graphs, engine='vectorized', initial=None, workers=None):
+    """
+    Finds the coarsest equitable partition of each of a list of graphs by
+    stacking them into one block diagonal matrix (see color_blocks), so the
+    python overhead is paid once instead of per graph.
+
+    Parameters:
+        graphs (list(sparse matrix) or ndarray (count, n, n)): adjacency
+            matrices, where A[i, j] is node i receiving from node j. Graphs of
+            one size can come as a 3d array, which is stacked without a python
+            loop over the graphs
+        engine (str): refinement engine, see equitable_coloring
+        initial (list(ndarray)): initial colors of the nodes of each graph
+        workers (int): number of processes for engine='parallel'
+
+    Returns:
+        (list(ndarray)): canonical colors of the nodes of each graph
+    """
+    if isinstance(graphs, np.ndarray) and graphs.ndim == 3:
+        count, n, _ = graphs.shape
+        graph, rows, cols = np.nonzero(graphs)
+        A = sparse.csr_matrix((graphs[graph, rows, cols],
+                               (graph*n + rows, graph*n + cols)),
+                              shape=(count*n, count*n))
+        sizes = np.full(count, n)
+    else:
+        sizes = [G.shape[0] for G in graphs]
+        A = sparse.block_diag(graphs, format='csr') if sizes else None
+    offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+    if offsets[-1] == 0:
+        return [np.zeros(size, dtype=int) for size in sizes]
+    if initial is not None:
+        initial = np.concatenate([np.asarray(colors) for colors in initial])
+    colors = color_blocks(integer_weights(A), offsets, engine, initial,
+                          workers)
+
+    # the first color of each graph is the color of its first node
+    first = colors[np.minimum(offsets[:-1], colors.size - 1)]
+    return [block - base for block, base in
+            zip(np.split(colors, offsets[1:-1]), first)]
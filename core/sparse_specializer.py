@@ -3,9 +3,18 @@ from scipy import sparse
 import scipy.linalg as la
 import scipy.optimize as opt
 import networkx as nx
-import itertools
 import matplotlib.pyplot as plt
 import autograd as ag
+import refinement
+from coloring_cache import ColoringCache
+from partition import Partition
+from bitmatrix import BitMatrix
+import bitmatrix
+import orbits
+import paths
+from fingerprint import fingerprint
+from specialized_operator import SpecializedOperator
+from incremental import IncrementalColoring
 
 
 ################################ WORK TO BE DONE ##############################
@@ -36,10 +45,15 @@ class DirectedGraph:
         labels (list(str)): list of labels assigned to the nodes of the graph
         labeler (dict(int, str)): maps indices to labels
         indexer (dict(str, int)): maps labels to indices
-        colors (dict(int, list(int))): cluster dictionary
+        colors (Partition): the coarsest equitable partition, which also
+            acts as the old dict(int: ndarray) cluster dictionary
+        trace (refinement.Trace): colors after every round of refinement,
+            kept by coloring(trace=True)
 
     Methods:
         specialize()
+        specialization_size()
+        specialized_operator()
         iterate()
         structural_eigen_centrality()
         eigen_centrality()
@@ -47,9 +61,16 @@ class DirectedGraph:
         spectral_radius()
         network_vis()
         coloring()
+        quasi_coloring()
+        add_edges()
+        remove_edges()
+        quotient()
+        orbit_partition()
+        fingerprint()
     """
 
-    def __init__(self, A, dynamics=None, labels=None):
+    def __init__(self, A, dynamics=None, labels=None, weighted=False,
+                 storage='csr'):
         """
         Parameters:
             A ((n,n) ndarray (sparse)): Adjacency matrix to a directed graph
@@ -63,15 +84,42 @@ class DirectedGraph:
 
             Labels (list(str)): labels for the nodes of the graph, defaults to
                 0 indexing
+
+            weighted (bool): if True, the (possibly negative, non integer)
+                weights of A are kept, e.g. from loadtxt(weighted=True), and
+                coloring() partitions by weighted input sums. Otherwise A is
+                converted to integers
+
+            storage (str): 'csr' (default) stores A as a sparse.csr_matrix.
+                'bits' packs the rows of a 0/1 matrix A into a BitMatrix,
+                which suits dense graphs: it takes n^2/8 bytes and coloring()
+                counts inputs with popcounts (see bitmatrix.py). Methods
+                other than coloring() need sparse.csr_matrix(self.A)
         """
-        # convert A to sparse.csr_matrix
-        A = sparse.csr_matrix(A).astype(int)
+        if storage == 'bits':
+            if weighted:
+                raise ValueError('bit storage needs an unweighted graph')
+            if not isinstance(A, BitMatrix):
+                A = BitMatrix(A)
+        elif storage == 'csr':
+            # convert A to sparse.csr_matrix
+            A = sparse.csr_matrix(A)
+            if not weighted:
+                A = A.astype(int)
+        else:
+            raise ValueError(f'unknown storage "{storage}"')
 
         n, m = A.shape
         # matrix must be nxn and should not have self edges
         if n != m :
             raise ValueError('Matrix not square')
-        if np.any(A.diagonal() != 0):
+        if isinstance(A, BitMatrix):
+            nodes = np.arange(n)
+            diagonal = A.words[nodes, nodes // 64] >> (nodes % 64).astype(
+                np.uint64) & np.uint64(1)
+        else:
+            diagonal = A.diagonal()
+        if np.any(diagonal != 0):
             raise ValueError('Some nodes have self edges')
 
         # define node labels if not passed in
@@ -86,6 +134,9 @@ class DirectedGraph:
         ):
             raise ValueError('labels must be an n-length list of strings')
 
+        # the mutable form of A and the coloring kept by add_edges and
+        # remove_edges, made on their first use
+        self._incremental = None
         self.A = A
         self.n = n
         self.indices = np.arange(n)
@@ -100,10 +151,49 @@ class DirectedGraph:
         self.original_indexer = self.indexer.copy()
 
         # maps equitable partition colors to member indices
-        self.colors = dict()
+        self.colors = Partition([])
+        # the options the colors were made with, which edge updates keep
+        self._coloring_options = dict(seed=None, edge_key=None, tol=None,
+                                      eps=None)
+        # the rounds of the last coloring(trace=True)
+        self.trace = None
         self.trivial_clusters = set()
         self.nontrivial_nodes = set(self.indices)
 
+    @property
+    def A(self):
+        if self._incremental is not None:
+            return self._incremental.matrix()
+        return self._A
+
+    @A.setter
+    def A(self, A):
+        self._fold_incremental()
+        self._A = A
+
+    @property
+    def colors(self):
+        if self._incremental is not None and \
+                self._incremental.color is not None:
+            return self._incremental.partition()
+        return self._colors
+
+    @colors.setter
+    def colors(self, colors):
+        self._fold_incremental()
+        self._colors = colors
+
+    def _fold_incremental(self):
+        """
+        Keeps the matrix and the coloring of the IncrementalColoring of the
+        edge updates as plain attributes, before either is replaced.
+        """
+        if self._incremental is not None:
+            self._A = self._incremental.matrix()
+            if self._incremental.color is not None:
+                self._colors = self._incremental.partition()
+            self._incremental = None
+
     def origination(self, i):
         """
         Returns the index that the specialized index i was originally associated
@@ -253,7 +343,7 @@ class DirectedGraph:
                 plt.show()
         return t
 
-    def specialize(self, base, verbose=False):
+    def specialize(self, base, verbose=False, memory_budget=None):
         """
         Given a base set, specialize the adjacency matrix of a network
 
@@ -262,6 +352,9 @@ class DirectedGraph:
                 specialized set. The list elements may be integers corresponding
                 to the node indices, or strings corresponding to the node labels
             verbose (bool): print out key information as the code executes
+            memory_budget (int): if given, a MemoryError is raised before
+                anything is built when the specialized graph would take more
+                bytes than this (see specialization_size)
         """
         # if list elements are str, convert to corresponding node indices
         if type(base[0]) is str:
@@ -275,50 +368,83 @@ class DirectedGraph:
         # error checking for choosing more than all the nodes
         if len(base) > self.n:
             raise ValueError('Base list cannot be larger than the number of nodes')
+        if memory_budget is not None:
+            self.specialization_size(base, memory_budget)
 
         base_size = len(base)
         # permute the matrix so the base set comes first
         self._base_first(base)
 
-        # specialized matrix is constructed as a block diagonal
-        B = self.A[:base_size, :base_size].copy()
-        diag = [B]  # base set is first entry
-
+        A = sparse.csr_matrix(self.A)
         # construct compressed graph smallA; find strongly connected components
         smallA, comp = self._compress_graph(base_size)
 
         pressed_paths = self._find_paths_to_base(smallA, base_size, comp)
 
+        # the specialized matrix is block diagonal, the base set first and
+        # then a copy of every component on every branch, plus the links
+        # between the copies. We collect the (row, col, data) triples of all
+        # of it and build the CSR matrix once at the end
+        B = A[:base_size, :base_size].tocoo()
+        rows, cols, data = [B.row], [B.col], [B.data]
         n_nodes = base_size
-        links = []
+        # the COO triples and original indices of every component
+        blocks = {}
 
-        # we create this diag labeler which will associate an index of the
-        # list diag to a strongly connected component set
-        diag_labeler = dict()
-        i = 1
+        # we create this diag labeler which will associate a diagonal block
+        # to a strongly connected component set
+        diag_labeler = []
 
+        # the paths are generated as we go, so we keep them for printing
+        temp_paths = []
         for path in pressed_paths:
             components = [comp[k] for k in path]
-            paths = self._path_combinations(components)
-            comp_to_add = [self.A[[self.indexer[k] for k in c], :][:, [self.indexer[k] for k in c]] for c in components[1:-1]].copy()
-
-            for p in paths:
-                for compt in components[1:-1]:
-                    diag_labeler[i] = compt
-                    i += 1
-                diag += comp_to_add
-                links += self._link_adder(p, n_nodes, components)
-                for _comp in comp_to_add:
-                    n_nodes += _comp.shape[0]
-                # n_nodes += sum(map(len, comp_to_add))
+            if verbose:
+                temp_paths.append(components)
+            inner = []
+            for k in path[1:-1]:
+                if k not in blocks:
+                    members = np.array([self.indexer[j] for j in comp[k]])
+                    blocks[k] = (members, A[members][:, members].tocoo())
+                inner.append(blocks[k])
+
+            # offsets of the components within one branch
+            sizes = [members.size for members, _ in inner]
+            prefix = np.concatenate(([0], np.cumsum(sizes)))
+            # one branch for every combination of links along the path
+            link_rows, link_cols = self._path_links(A, path, inner, prefix)
+            # branch j takes option (j // strides[i]) % options[i] of step
+            # i, the order of itertools.product
+            options = [r.size for r in link_rows]
+            strides = [int(np.prod(options[i+1:], dtype=np.int64))
+                       for i in range(len(options))]
+            branches = np.arange(int(np.prod(options, dtype=np.int64)))
+            starts = n_nodes + prefix[-1]*branches
+
+            for (_, block), offset in zip(inner, prefix[:-1]):
+                rows.append(np.add.outer(starts + offset, block.row).ravel())
+                cols.append(np.add.outer(starts + offset, block.col).ravel())
+                data.append(np.tile(block.data, starts.size))
+            for i, (r, c) in enumerate(zip(link_rows, link_cols)):
+                # only the ends of the links on the branch are shifted
+                option = (branches // strides[i]) % options[i]
+                r, c = r[option], c[option]
+                rows.append(r + (starts if i < len(inner) else 0))
+                cols.append(c + (starts if i > 0 else 0))
+                data.append(np.ones(r.size, dtype=A.dtype))
+
+            diag_labeler += [components[1:-1]] * starts.size
+            n_nodes += prefix[-1]*starts.size
 
         # we update the labeler to correctly label the newly created nodes
         step = base_size
-        for i in range(1, len(diag)):
-            comp_len = diag[i].shape[0]
-            for k in range(comp_len):
-                self.labeler[step + k] = diag_labeler[i][k] + f'.{i}'
-            step += comp_len
+        i = 1
+        for branch in diag_labeler:
+            for labels in branch:
+                for k, label in enumerate(labels):
+                    self.labeler[step + k] = label + f'.{i}'
+                step += len(labels)
+                i += 1
 
         self._update_indexer()
 
@@ -326,22 +452,63 @@ class DirectedGraph:
             print(f'This is the original matrix:\n{self.A}\n')
 
         # create the new specialized matrix
-        S = sparse.block_diag(diag).tolil()
-        for l in links: S[l] = 1
-        self.A = S
+        self.A = sparse.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows),
+                                    np.concatenate(cols))),
+            shape=(n_nodes, n_nodes))
         self.indices = np.arange(n_nodes)
         self.n = self.A.shape[0]
 
         if verbose:
             print(f'Strongly connected components:\n {comp}\n')
-            temp_paths = []
-            for path in pressed_paths:
-                temp_paths.append([comp[k] for k in path])
             print(f'Paths from base node to base node:\n {temp_paths}\n')
             print(f'Number of nodes in the specialized matrix:\n {n_nodes}\n')
 
         return
 
+    def specialization_size(self, base, memory_budget=None):
+        """
+        Counts the nodes and edges specialize(base) would give, by dynamic
+        programming over the compressed graph (see paths.specialization_size),
+        without building any paths or blocks or changing the graph. This
+        takes about as long as one sparse product with A, so many candidate
+        base sets can be screened before picking one to specialize.
+
+        Parameters:
+            base (list): list of base nodes, as indices or labels
+            memory_budget (int): if given, a MemoryError is raised when the
+                specialized graph would take more bytes than this, counting
+                the 40 bytes per edge that building its CSR matrix from COO
+                triples peaks at and 200 bytes per node for the labels
+
+        Returns:
+            nodes (int): number of nodes of the specialized graph
+            edges (int): number of edges of the specialized graph
+        """
+        base = [self.indexer[k] if type(k) is str else k for k in base]
+        nodes, edges = paths.specialization_size(self.A, base)
+        size = 40.*edges + 200.*nodes
+        if memory_budget is not None and size > memory_budget:
+            raise MemoryError(f'specializing gives {nodes} nodes and {edges} '
+                              f'edges, which take about {size:.3g} bytes, '
+                              f'over the budget of {memory_budget}')
+        return nodes, edges
+
+    def specialized_operator(self, base):
+        """
+        The adjacency matrix specialize(base) would give, as a matrix-free
+        SpecializedOperator that stores each component block once. Products
+        with it, its iterate(), spectral_radius() and eigen_centrality() work
+        for specializations too large to build, and the graph is not changed.
+
+        Parameters:
+            base (list): list of base nodes, as indices or labels
+
+        Returns:
+            (SpecializedOperator): the specialized adjacency matrix
+        """
+        return SpecializedOperator(self, base)
+
     def _update_indexer(self):
         """
         This function assumes that self.labeler is correct in its labeling:
@@ -417,8 +584,10 @@ class DirectedGraph:
 
         # find the strongly connected components of spec
         num_comp, SCC = sparse.csgraph.connected_components(spec, connection='strong')
-        # extract indices of each connected component
-        SCComp = [np.where(SCC == i)[0] for i in range(num_comp - 1, -1, -1)]
+        # extract indices of each connected component, in reverse order of
+        # the labels from connected_components
+        components = Partition(num_comp - 1 - SCC)
+        SCComp = [components[i] for i in range(num_comp)]
 
         # # maps smallA indices to base node labels
         # comp_base = {ind: [self.labeler[ind]] for ind in range(base_size)}
@@ -439,152 +608,69 @@ class DirectedGraph:
 
 
 
-        # smallA will represent A with each SCC as a single node
-        N = base_size + num_comp
-        smallA = sparse.lil_matrix((N, N), dtype=int)
-        # update smallA with base node information
+        # smallA will represent A with each SCC as a single node, found as
+        # the condensation over the partition of the nodes into base nodes
+        # and components
+        cells = np.concatenate((np.arange(base_size),
+                                base_size + components.color))
+        smallA = Partition(cells).condensation(self.A).tolil()
+        # a component has no edge to itself, and the base nodes keep theirs
+        smallA.setdiag(0)
         smallA[:base_size, :base_size] = self.A[:base_size, :base_size]
 
-
-        # TODO: fix this
-        # update smallA with SCC information
-        for i in range(base_size, N):
-            # *original* indices of the ith strongly connected component
-            SCC_i = [self.indexer[ind] for ind in comp[i]]
-
-            # updates smallA with SCC_i --> base_node connections
-            smallA[:base_size, i] = (self.A[:base_size, SCC_i].sum(axis=1) != 0).astype(int)
-            # updates smallA with base_node --> SCC_i connections
-            smallA[i, :base_size] = (self.A[SCC_i, :base_size].sum(axis=0) != 0).astype(int)
-
-            # update the SCC_i --> SCC_j connections (and vice-versa)
-            for j in range(base_size, i):
-                # *original* indices of the jth strongly connected component
-                SCC_j = [self.indexer[ind] for ind in comp[j]]
-
-                # updates smallA with SCC_j --> SCC_i connections
-                smallA[i, j] = int((self.A[SCC_i, :][:, SCC_j] != 0).nnz != 0)
-                # updates smallA with SCC_i --> SCC_j connections
-                smallA[j, i] = int((self.A[SCC_j, :][:, SCC_i] != 0).nnz != 0)
-
         return smallA, comp
 
     def _find_paths_to_base(self, smallA, base_size, comp):
         """
         Finds all the paths between the base nodes that pass through the
-        specialization set in the compressed graph
+        specialization set in the compressed graph, see paths.base_paths
 
         Parameters:
             smallA (ndarray): a compressed adjecency matrix
-            base_size (int): number of nodes in the base set
+            base_size (int): number of base nodes in the base set
 
         Returns:
-            pressed_paths (list, list(str)): list of paths that pass through
-                the specialization set
-        """
-
-        _, N = smallA.shape
-        pressed_paths = []
-
-        # find the path between every pair of nodes
-        for b1 in range(base_size):
-            for b2 in range(base_size):
-                # remove all other base nodes from the graph so we only find
-                # paths through the specialization set
-                if b1 == b2:
-                    # in this case we look for cycles
-                    mask = [b1] + list(range(base_size, N))
-                    new_size = len(mask) + 1
-                    reducedA = sparse.lil_matrix((new_size, new_size))
-                    reducedA[:-1, :-1] = smallA[mask, :][:, mask]
-                    # remove ingoing edges from the base node and add to new
-                    # node
-                    reducedA[-1, :] = reducedA[0,:]
-                    reducedA[0, :] = sparse.lil_matrix((1, new_size))
-                    G = nx.DiGraph(reducedA.T)
-                    # find paths from the base node to the new node
-                    # which is the same as finding cycles in this case
-                    paths = list(nx.all_simple_paths(G, 0, new_size-1))
-
-                else:
-                    mask = [b1, b2] + list(range(base_size, N))
-                    reducedA = smallA[mask, :][:, mask]
-                    # remove base node interations
-                    reducedA[:2, :2] = sparse.lil_matrix((2, 2))
-                    G = nx.DiGraph(reducedA.T)
-                    paths = list(nx.all_simple_paths(G, 0, 1))
-
-                # process the paths
-                for p in paths:
-                    if p != []:
-                        if b1 == b2:
-                            p = np.array(p) + base_size - 1
-                        else:
-                            p = np.array(p) + base_size - 2
-                        p[[0, -1]] = [b1, b2]
-                        pressed_paths.append(p)
-
-        return pressed_paths
-
-    def _path_combinations(self, components):
-        """
-        Given a path through the connected components of A, find every unique
-        combination of edges between the components that can be followed to
-        complete the given path
-
-        Parameters:
-            components (list, ):
+            pressed_paths (generator(ndarray)): the paths that pass through
+                the specialization set, as indices of smallA, generated one
+                at a time
         """
+        return paths.base_paths(smallA, base_size)
 
-        link_opt = []
-        path_length = len(components)
-        # n_nodes will keep track of the number of nodes in each branch
-        n_nodes = 1
-
-        for i in range(path_length - 1):
-            _i = [self.indexer[k] for k in components[i+1]]
-            _j = [self.indexer[k] for k in components[i]]
-            rows, cols = self.A[_i, :][:, _j].nonzero()
-
-            if i == 0:
-                cols += [self.indexer[k] for k in components[0]]
-                rows += n_nodes
-            elif i == path_length - 2:
-                rows += [self.indexer[k] for k in components[-1]]
-                cols += n_nodes - len(components[i])
-            else:
-                rows += n_nodes
-                cols += n_nodes - len(components[i])
-            edges = zip(rows, cols)
-            n_nodes += len(components[i+1])
-            link_opt.append(edges)
-
-        all_paths = [list(P) for P in itertools.product(*link_opt)]
-
-        return all_paths
-
-    def _link_adder(self, path, n_nodes, components):
+    def _path_links(self, A, path, inner, prefix):
         """
-        Produces the link needed to add a branch of stringly connected
-        components to a graph with n_nodes
+        Finds the possible links for every step of a path through the
+        components of A. A branch following the path takes one link from
+        each step, so the branches are the combinations of the links.
 
         Parameters:
-            path (list, tuple): edges between component nodes
-            n_nodes (int): number of nodes in the original graph
-            components (list, list()):
-        """
-        links = []
-        path_length = len(path)
-
-        for i in range(path_length):
-            if i == 0:
-                links.append((path[i][0] + n_nodes - 1, path[i][1]))
-            elif i == path_length - 1:
-                links.append((path[i][0], path[i][1] + n_nodes - 1))
-            else:
-                links.append((path[i][0] + n_nodes-1, path[i][1] + n_nodes-1))
+            A (sparse.csr_matrix): the adjacency matrix with the base set first
+            path (ndarray): the path in the compressed graph, from a base node
+                through components to a base node
+            inner (list(tuple)): the original indices and the COO block of
+                each component on the path
+            prefix (ndarray): offset of each component within a branch
 
-        return links
+        Returns:
+            link_rows, link_cols (list(ndarray)): receiving and sending node
+                of the links of each step. Nodes in components are numbered
+                from the start of the branch, base nodes keep their index
+        """
+        ends = [np.array([path[0]])] + [members for members, _ in inner] + \
+            [np.array([path[-1]])]
+        link_rows, link_cols = [], []
+        for i in range(len(ends) - 1):
+            r, c = A[ends[i+1]][:, ends[i]].nonzero()
+            if i < len(inner):
+                r = r + prefix[i]
+            else:
+                r = np.full(r.size, path[-1])
+            if i > 0:
+                c = c + prefix[i-1]
+            else:
+                c = np.full(c.size, path[0])
+            link_rows.append(r)
+            link_cols.append(c)
+        return link_rows, link_cols
 
     def stability_matrix(self):
         """
@@ -665,33 +751,77 @@ class DirectedGraph:
         ranks = {self.labeler[i]: np.real(p[i]) for i in range(self.n)}
         return ranks
 
-    def spectral_radius(self):
+    def spectral_radius(self, method='eig', tol=None):
         """
+        Parameters:
+            method (str): 'eig' (default) finds every eigenvalue of the n x n
+                stability matrix. 'quotient' only finds those of its k x k
+                quotient over the coarsest equitable partition (see
+                quotient()), which has the same spectral radius since the
+                stability matrix is nonnegative. This needs the partition to
+                be equitable for the stability matrix too, which fails when
+                nodes of one color have different dynamics; a ValueError is
+                raised in that case
+            tol (float): inputs of the stability matrix that differ by at
+                most tol count as equal in that check, so an approximate
+                radius can be found over a partition from quasi_coloring().
+                Defaults to allowing for rounding only
+
         Returns:
             (float): the spectral radius of the network based on the stability
                 matrix
         """
 
         Df = self.stability_matrix()
+        if method == 'quotient':
+            partition = self._equitable_partition()
+            Df = sparse.csr_matrix(Df)
+            # allow for rounding in the sampled derivatives
+            tol = max(1e-9 * max(abs(Df).sum(axis=1).max(), 1.),
+                      0 if tol is None else tol)
+            violations = refinement.equitability_violations(
+                Df, partition.color, tol=tol)
+            if violations:
+                raise ValueError('the equitable partition of the graph is not '
+                                 'equitable for the stability matrix, e.g. '
+                                 f'{violations[0]}')
+            Df = partition.quotient(Df).toarray()
+        elif method != 'eig':
+            raise ValueError(f'unknown method "{method}"')
         eigs = la.eig(Df)
         # find the eigen value with largest modulus, which is the spectral
         # radius
         return np.max(np.abs(eigs[0]))
 
-    def structural_eigen_centrality(self):
+    def structural_eigen_centrality(self, method='eig'):
         """
+        Parameters:
+            method (str): 'eig' (default) finds the eigenvectors of the n x n
+                matrix A + I. 'quotient' finds them for the k x k quotient
+                matrix (see quotient()) instead and lifts the dominant one
+                back to the nodes, giving every node of a color the same value
+
         Returns:
             (dict):
                 (keys): labels of the nodes
                 (values): the associeated eigencentrality
         """
 
-        # we shift the matrix to find the true dominant eigen value
-        B = self.A + np.eye(self.n)
+        if method == 'quotient':
+            partition = self._equitable_partition()
+            B = self.quotient().toarray() + np.eye(len(partition))
+        elif method == 'eig':
+            # we shift the matrix to find the true dominant eigen value
+            B = self.A + np.eye(self.n)
+        else:
+            raise ValueError(f'unknown method "{method}"')
         eigs = la.eig(B)
         i = np.argmax(eigs[0])
         # we then extract the eigen vector associated to this value
         p = eigs[1][:,i]
+        if method == 'quotient':
+            # every node takes the value of its color
+            p = p[partition.color]
         # normalize the vector so it sums to 1
         # i.e. turn it into a probability vector
         p /= p.sum()
@@ -777,11 +907,8 @@ class DirectedGraph:
             filename (str): filename
         """
         if use_eqp:
-            colors = self.colors
-            group_dict = {}
-            for color in colors.keys():
-                for node in colors[color]:
-                    group_dict[self.labeler[node]] = color
+            group_dict = {self.labeler[node]: int(color)
+                          for node, color in enumerate(self.colors.color)}
 
         else:
             # find synchronized communities
@@ -852,18 +979,176 @@ class DirectedGraph:
 
         plt.show()
 
-    def coloring(self):
+    def coloring(self, engine=None, workers=None, cache=None,
+                 seed=None, edge_key=None, tol=None, trace=False):
         """
         This method uses an algorithm called input driven refinement that will
         find the unique coarsest equitable partition of a the graph associated
         with the network. This partition is based only on the structure of the
-        graph, and is not based on other functional elements of the system.
-        Returns:
-            dict(int: list): a partition where each of the keys represents a
-                unique color and the associated list a list of indices that
-                are in the cluster
+        graph, and is not based on other functional elements of the system
+        unless the seed or edge_key options below bring them in.
+
+        Parameters:
+            engine (str): the refinement algorithm to use
+                'worklist' (default for CSR storage): partition refinement
+                    that only splits the cells receiving input from a
+                    changed cell, running in O(m log n) on the CSR arrays
+                    (see refinement.py)
+                'vectorized': whole graph passes that compare the rows of
+                    the input count matrix A @ P with a few sparse kernels
+                'numba': the worklist refinement compiled with numba; the
+                    compiled kernel is cached on disk after the first use
+                'parallel': the 'vectorized' passes split into row blocks
+                    over a pool of processes sharing the CSR arrays
+                'pairwise': the original refinement, comparing the inputs of
+                    every pair of colors on every pass
+                'bits' (default for bit storage): whole graph passes that
+                    count inputs with popcounts on the rows of a BitMatrix
+
+            workers (int): number of processes for engine='parallel'; defaults
+                to the number of cores
+
+            cache (ColoringCache or str): if given, the coloring is looked up
+                in (and saved to) this on-disk cache, or a cache in this
+                directory, keyed by the content of A
+
+            seed (str, callable, dict or sequence): an initial partition for
+                the refinement to split, so nodes with different keys never
+                share a color; starting from a finer partition also takes
+                fewer passes. 'dynamics' groups nodes by their self dynamics
+                function a[i]; a callable is called on each node label; a dict
+                maps labels to keys; a sequence gives the key of every node.
+                By default every node starts with the same color
+
+            edge_key (str, callable or sparse matrix): splits the edges into
+                types, and the partition is made equitable for each type
+                separately (a multi-relational equitable partition).
+                'dynamics' uses the edge functions f[i, j]; a callable is
+                called on (receiving label, sending label); a matrix gives an
+                integer type for every edge of A
+
+            tol (float): for weighted graphs, weights are rounded to
+                multiples of tol before comparing input sums. By default they
+                are compared exactly (see refinement.integer_weights)
+
+            trace (bool): if True, self.trace keeps the colors after every
+                round of refinement (a refinement.Trace), e.g. as structural
+                node features. Only the 'vectorized' (default with trace)
+                and 'parallel' engines refine in rounds; the cache is only
+                written to, since it stores final colors
+
+        Sets self.colors to a Partition of the nodes, which acts as a dict
+        mapping each color to the sorted indices of its nodes.
         """
+        bits = isinstance(self.A, BitMatrix)
+        if engine is None:
+            engine = 'vectorized' if trace else 'bits' if bits else 'worklist'
+        if trace and engine not in ('vectorized', 'parallel'):
+            raise ValueError(f'the "{engine}" engine has no rounds to trace')
+        self.trace = None
+        if engine == 'bits' and (not bits or edge_key is not None):
+            raise ValueError('the bits engine needs bit storage and no '
+                             'edge_key')
+        options = dict(seed=seed, edge_key=edge_key, tol=tol, eps=None)
+
+        # the engines compare integer input sums
+        A, initial, extra = self.A, None, ()
+        if engine != 'bits':
+            A = refinement.integer_weights(sparse.csr_matrix(self.A), tol)
+        weighted = not np.issubdtype(self.A.dtype, np.integer) or tol is not None
+        if seed is not None or edge_key is not None or weighted:
+            if engine == 'pairwise':
+                raise ValueError('seeded and weighted coloring need one of '
+                                 'the engines in refinement.py')
+        if seed is not None or edge_key is not None:
+            A, initial = self._seeded_graph(A, seed, edge_key)
+            if initial is not None:
+                extra = (initial,)
+
+        if cache is not None:
+            if type(cache) is str:
+                cache = ColoringCache(cache)
+            colors = None if trace else cache.get(A, *extra)
+            if colors is not None:
+                self.colors = Partition(colors)
+                self._coloring_options = options
+                return
+
+        if engine == 'bits':
+            self.colors = Partition(bitmatrix.bit_refinement(A, initial))
+        elif engine != 'pairwise':
+            colors = refinement.equitable_coloring(A, engine, initial=initial,
+                                                   workers=workers, trace=trace)
+            if trace:
+                colors, self.trace = colors
+            self.colors = Partition(colors)
+        else:
+            self._pairwise_coloring()
 
+        self._coloring_options = options
+        if cache is not None:
+            cache.put(A, self.colors.color, *extra)
+
+    def _seeded_graph(self, A, seed, edge_key):
+        """
+        Translates the seed and edge_key options of coloring() into an
+        initial coloring and a typed adjacency matrix for the engines in
+        refinement.py.
+
+        Parameters:
+            A (sparse.csr_matrix): the integer adjacency matrix to color
+
+        Returns:
+            A (sparse.csr_matrix): the adjacency matrix, with edge types
+                folded in (see refinement.typed_adjacency)
+            initial (ndarray (n,)): initial color of each node, or None
+        """
+        labels = [self.labeler[i] for i in range(self.n)]
+        by_dynamics = (type(seed) is str and seed == 'dynamics',
+                       type(edge_key) is str and edge_key == 'dynamics')
+        if any(by_dynamics) and self.dynamics is None:
+            raise ValueError('the graph has no dynamics to seed the coloring')
+
+        initial = None
+        if seed is not None:
+            if by_dynamics[0]:
+                # nodes with different self dynamics can never synchronize
+                a = self.dynamics[0]
+                keys = [a[self.origination(i)] for i in range(self.n)]
+            elif callable(seed):
+                keys = [seed(label) for label in labels]
+            elif isinstance(seed, dict):
+                keys = [seed.get(label) for label in labels]
+            else:
+                keys = list(seed)
+                if len(keys) != self.n:
+                    raise ValueError('seed needs one key per node')
+            initial = refinement.key_colors(keys)
+
+        if edge_key is not None:
+            A = A.tocoo()
+            if by_dynamics[1]:
+                f = self.dynamics[1]
+                origin = [self.origination(i) for i in range(self.n)]
+                keys = [f[origin[i], origin[j]] for i, j in zip(A.row, A.col)]
+                types = refinement.key_colors(keys)
+            elif callable(edge_key):
+                types = refinement.key_colors(
+                    edge_key(labels[i], labels[j])
+                    for i, j in zip(A.row, A.col))
+            else:
+                # a matrix of integer edge types with the sparsity of A
+                types = np.zeros(A.nnz, dtype=int)
+                if A.nnz:
+                    types = np.asarray(
+                        sparse.csr_matrix(edge_key)[A.row, A.col]).ravel()
+            A = refinement.typed_adjacency(A, types)
+        return A, initial
+
+    def _pairwise_coloring(self):
+        """
+        The original input driven refinement used by coloring(engine='pairwise')
+        """
         #helper function for input driven refinement
         # @jit
         def _refine(color_dict):
@@ -936,15 +1221,212 @@ class DirectedGraph:
             next_colors = _refine(colors)
             if len(colors.keys()) == len(next_colors.keys()):
                 refine = False
-        self.colors = colors
+        self.colors = Partition.from_dict(colors, self.n)
+
+    def add_edges(self, edges, weights=None, exact=True):
+        """
+        Adds edges to the graph and updates the coloring locally instead of
+        recoloring the whole graph. New edges only unbalance the cells of
+        their receivers, so those are split by how much their inputs changed
+        and the refinement then only follows the nodes that moved, and the
+        cells near the change are merged again wherever their inputs became
+        identical (see incremental.IncrementalColoring). The matrix is kept
+        in a mutable form in the meantime, and self.A is only rebuilt when
+        it is used, so an update costs about the degree of the cells that
+        change rather than the size of the graph.
+
+        Colorings from coloring(seed=...) and coloring(tol=...) keep their
+        seed and tolerance. Quasi-equitable colorings and colorings with an
+        edge_key cannot be updated locally; the graph is colored again with
+        the same options instead.
+
+        Parameters:
+            edges (list(tuple(int, int))): (i, j) pairs, node i receiving
+                from node j; existing edges get the weight added
+            weights (ndarray): weight of each edge, defaults to 1
+            exact (bool): if True (default), the cells are finally merged
+                into the coarsest equitable partition on the quotient graph
+                (see IncrementalColoring.coarsen), so self.colors is the same
+                as after coloring(); this costs whole graph refinement passes
+                over the quotient, and the quotient of a graph with little
+                symmetry is about as large as the graph. If False, the update
+                stays local, but self.colors may be an equitable partition
+                finer than the coarsest one until the next exact update or
+                coloring()
+        """
+        rows, cols = self._edge_arrays(edges)
+        if weights is None:
+            weights = np.ones(rows.size, dtype=int)
+        self._update_edges(rows, cols, np.asarray(weights), exact)
+
+    def remove_edges(self, edges, exact=True):
+        """
+        Removes edges from the graph and updates the coloring locally, see
+        add_edges.
+
+        Parameters:
+            edges (list(tuple(int, int))): (i, j) pairs, node i receiving
+                from node j
+            exact (bool): see add_edges
+        """
+        rows, cols = self._edge_arrays(edges)
+        weights = self._editable().weights(rows, cols)
+        if np.any(weights == 0):
+            raise ValueError('some edges are not in the graph')
+        self._update_edges(rows, cols, -weights, exact)
+
+    def _edge_arrays(self, edges):
+        """
+        Returns:
+            rows, cols (ndarray): the receiving and sending node of each edge
+        """
+        edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        rows, cols = edges[:, 0], edges[:, 1]
+        if np.any((edges < 0) | (edges >= self.n)):
+            raise ValueError('edges must join nodes of the graph')
+        if np.any(rows == cols):
+            raise ValueError('Some nodes have self edges')
+        return rows, cols
+
+    def _local_coloring(self):
+        """
+        Returns:
+            (bool): whether the colors can be updated locally, which needs a
+                coloring of the current graph that is neither quasi-equitable
+                nor edge-typed
+        """
+        options = self._coloring_options
+        return (self._colors.n == self.n and options['eps'] is None and
+                options['edge_key'] is None)
+
+    def _editable(self):
+        """
+        Returns:
+            (IncrementalColoring): the mutable form of A, and of the coloring
+                if it can be updated locally, that edge updates change
+        """
+        if self._incremental is None:
+            A = self._A
+            if isinstance(A, BitMatrix):
+                A = A.tocsr()
+            colors, seed = None, None
+            if self._local_coloring():
+                colors = self._colors.color
+                if self._coloring_options['seed'] is not None:
+                    _, seed = self._seeded_graph(
+                        None, self._coloring_options['seed'], None)
+            self._incremental = IncrementalColoring(
+                A, colors, seed, self._coloring_options['tol'])
+        return self._incremental
+
+    def _update_edges(self, rows, cols, delta, exact):
+        """
+        Adds delta to the entries (rows, cols) of A and updates the coloring.
+        """
+        options = self._coloring_options
+        recolor = self._colors.n == self.n and not self._local_coloring()
+        self._editable().update(rows, cols, delta, exact)
+        self.trace = None
+        if recolor:
+            if options['eps'] is not None:
+                self.quasi_coloring(options['eps'])
+            else:
+                self.coloring(seed=options['seed'],
+                              edge_key=options['edge_key'],
+                              tol=options['tol'])
+
+    def _equitable_partition(self):
+        """
+        Returns:
+            (Partition): the coloring of the graph, computed first if the
+                graph has not been colored since it last changed
+        """
+        if self.colors.n != self.n:
+            self.coloring()
+        return self.colors
+
+    def quasi_coloring(self, eps):
+        """
+        Colors the graph with a coarse quasi-equitable partition instead of
+        the coarsest equitable one: nodes of a color may receive inputs from
+        another color that differ by up to eps (see
+        refinement.quasi_equitable_coloring). Noisy real networks have almost
+        no exact symmetry, but their quasi-equitable partitions can be small,
+        and quotient(), spectral_radius(method='quotient') and
+        structural_eigen_centrality(method='quotient') then give approximate
+        results from the k x k quotient. eps=0 gives the same partition as
+        coloring(), which restores the exact one.
+
+        Parameters:
+            eps (float): largest allowed spread of the inputs of the nodes of
+                a color from another color
+
+        Returns:
+            (float): the equitability error, the largest spread of inputs
+                that the partition has, at most eps
+        """
+        colors, error = refinement.quasi_equitable_coloring(
+            sparse.csr_matrix(self.A), eps)
+        self.colors = Partition(colors)
+        self._coloring_options = dict(seed=None, edge_key=None, tol=None,
+                                      eps=eps)
+        self.trace = None
+        return error
+
+    def quotient(self):
+        """
+        Builds the quotient (divisor) matrix of the graph over its coarsest
+        equitable partition with one sparse triple product D^-1 P^T A P, see
+        Partition.quotient. Entry (c, d) is the number of inputs every node
+        of color c receives from color d. Its eigenvalues are eigenvalues of
+        A, including the spectral radius.
+
+        Returns:
+            (sparse.csr_matrix (k, k)): the quotient matrix
+        """
+        return self._equitable_partition().quotient(self.A)
+
+    def orbit_partition(self):
+        """
+        Finds the orbits of the automorphism group of the graph: two nodes
+        share an orbit when some relabeling of the nodes preserving every
+        edge maps one to the other. The orbit partition always refines the
+        coarsest equitable partition from coloring(), and nodes that are
+        balanced but not symmetric end up in different orbits. See
+        orbits.orbit_coloring for the search.
+
+        Returns:
+            (Partition): the orbit of each node
+        """
+        return Partition(orbits.orbit_coloring(
+            refinement.integer_weights(self.A)))
+
+    def fingerprint(self):
+        """
+        Returns:
+            (str): a fingerprint of the graph built from its coarsest
+                equitable partition, equal for isomorphic graphs (see
+                fingerprint.fingerprint). The partition is computed from
+                scratch, since self.colors may be seeded, quasi-equitable or
+                finer after a local update, and is left as it is
+        """
+        return fingerprint(self.A.tocsr())
+
+    def equitability_violations(self):
+        """
+        Checks the current coloring in one pass over the input counts A @ P
+        (see refinement.equitability_violations).
+
+        Returns:
+            (list(Violation)): a (cell, source, low, high) tuple for every pair
+                of colors where the nodes of color cell receive between low
+                and high inputs from color source; empty if the coloring is
+                equitable
+        """
+        return refinement.equitability_violations(self.A, self.colors.color)
 
     def color_checker(self):
         """
         Function that can make sure our coloring is equitable.
         """
-        for color1 in self.colors.values():
-            for color2 in self.colors.values():
-                x = np.sum(self.A[color1][:,color2],axis=1)
-                if not (x==x[0]).all():
-                    return False
-        return True
+        return not self.equitability_violations()
@@ -0,0 +1,320 @@
+# specialized_operator.py
+from scipy import sparse
+from scipy.sparse.linalg import (LinearOperator, aslinearoperator, eigs,
+                                  ArpackError)
+import numpy as np
+import copy
+
+
+class SpecializedOperator(LinearOperator):
+
+    """
+    The adjacency matrix of a specialized graph as a scipy LinearOperator,
+    without building it. The specialized graph is the base block plus, for
+    every path through the components of the compressed graph, a branch of
+    copies of the same few component blocks for every combination of links
+    along the path. We store each component block once, and for every path
+    the offset and number of its branches and the link options of each of
+    its steps, so the memory grows with the number of paths rather than the
+    number of nodes. A product with a vector reshapes the part of the vector
+    on the branches of a path to one column per branch and multiplies each
+    component block with all the copies at once; the links of a branch are
+    found from its index, the way itertools.product orders the
+    combinations.
+
+    The nodes are numbered as DirectedGraph.specialize numbers them, so
+    S @ x equals the product with the matrix specialize(base) builds.
+
+    Attributes:
+        shape (tuple(int, int)): shape of the specialized matrix
+        dtype (np.dtype): type of the entries
+        base (ndarray): original indices of the base nodes
+        permute (ndarray): original index of every node of the graph with
+            the base set first
+        base_block (sparse.csr_matrix): the edges between the base nodes
+        blocks (dict(int: sparse.csr_matrix)): the block of every component
+            that appears on a path, keyed by its index in the compressed graph
+        groups (list(dict)): the branches of every path, see _group()
+
+    Methods:
+        original()
+        iterate()
+        spectral_radius()
+        eigen_centrality()
+    """
+
+    def __init__(self, G, base):
+        """
+        Parameters:
+            G (sparse_specializer.DirectedGraph): the graph to specialize; it
+                is not changed
+            base (list): list of base nodes, as indices or labels
+        """
+        base = [G.indexer[k] if type(k) is str else int(k) for k in base]
+        if len(base) > G.n:
+            raise ValueError('Base list cannot be larger than the number of nodes')
+        base_size = len(base)
+
+        # we put the base set first in a shallow copy, which gets its own
+        # matrix and labels
+        H = copy.copy(G)
+        H._base_first(list(base))
+        A = sparse.csr_matrix(H.A)
+        # original index of every node of the permuted graph
+        self.permute = np.array([G.indexer[H.labeler[i]] for i in range(G.n)])
+        self.base = self.permute[:base_size]
+        self.base_block = A[:base_size, :base_size].tocsr()
+
+        smallA, comp = H._compress_graph(base_size)
+        self.blocks = {}
+        members = {}
+        self.groups = []
+        n_nodes = base_size
+        for path in H._find_paths_to_base(smallA, base_size, comp):
+            for k in path[1:-1]:
+                if k not in self.blocks:
+                    members[k] = np.array([H.indexer[j] for j in comp[k]])
+                    self.blocks[k] = A[members[k]][:, members[k]].tocsr()
+            group = self._group(A, H, path, members, n_nodes)
+            self.groups.append(group)
+            n_nodes += group['size']*group['count']
+
+        super().__init__(dtype=A.dtype, shape=(n_nodes, n_nodes))
+
+    def _group(self, A, H, path, members, start):
+        """
+        Describes the branches of one path.
+
+        Returns:
+            (dict):
+                start (int): first node of the first branch
+                size (int): nodes in a branch
+                count (int): number of branches
+                components (list(tuple(int, int))): the component of every
+                    block of a branch and the offset of the block
+                members (ndarray (size,)): the permuted index of the node
+                    every node of a branch is a copy of
+                steps (list(tuple)): the link options (rows, cols) of every
+                    step, and whether their rows and cols are within the
+                    branch (otherwise they are base nodes)
+                strides (list(int)): branch j takes option
+                    (j // strides[i]) % len(rows) of step i
+        """
+        inner = [(members[k], self.blocks[k]) for k in path[1:-1]]
+        sizes = [m.size for m, _ in inner]
+        prefix = np.concatenate(([0], np.cumsum(sizes)))
+        link_rows, link_cols = H._path_links(A, path, inner, prefix)
+
+        options = [r.size for r in link_rows]
+        strides = [int(np.prod(options[i+1:], dtype=np.int64))
+                   for i in range(len(options))]
+        steps = [(r, c, i < len(inner), i > 0)
+                 for i, (r, c) in enumerate(zip(link_rows, link_cols))]
+        return {'start': start, 'size': int(prefix[-1]),
+                'count': int(np.prod(options, dtype=np.int64)),
+                'components': list(zip(path[1:-1], prefix[:-1])),
+                'members': np.concatenate([m for m, _ in inner]),
+                'steps': steps, 'strides': strides}
+
+    def _apply(self, X, transpose):
+        """
+        Computes S @ X, or S^T @ X if transpose.
+
+        Parameters:
+            X (ndarray (n, m)): the vectors
+        """
+        dtype = np.result_type(self.dtype, X.dtype)
+        Y = np.zeros(X.shape, dtype=dtype)
+        m = X.shape[1]
+        b = self.base_block.shape[0]
+        B = self.base_block.T if transpose else self.base_block
+        Y[:b] = B @ X[:b]
+
+        for group in self.groups:
+            start, size, count = group['start'], group['size'], group['count']
+            end = start + size*count
+            # one row of blocks for every branch
+            Xs = X[start:end].reshape(count, size, m)
+            Ys = Y[start:end].reshape(count, size, m)
+            for k, offset in group['components']:
+                block = self.blocks[k].T if transpose else self.blocks[k]
+                s = block.shape[0]
+                # every copy of the block at once, one column per branch
+                Xk = Xs[:, offset:offset + s].transpose(1, 0, 2).reshape(
+                    s, count*m)
+                Ys[:, offset:offset + s] += (block @ Xk).reshape(
+                    s, count, m).transpose(1, 0, 2)
+
+            branches = np.arange(count)
+            shift = start + size*branches
+            for (rows, cols, inner_rows, inner_cols), stride in zip(
+                    group['steps'], group['strides']):
+                option = (branches // stride) % rows.size
+                r = rows[option] + (shift if inner_rows else 0)
+                c = cols[option] + (shift if inner_cols else 0)
+                if transpose:
+                    r, c = c, r
+                    inner_rows = inner_cols
+                if inner_rows:
+                    # one link into every branch, so the rows are distinct
+                    Y[r] += X[c]
+                else:
+                    # the links of all the branches end at base nodes
+                    for j in range(m):
+                        w = X[c, j]
+                        Y[:b, j] += np.bincount(r, weights=w.real,
+                                                minlength=b)
+                        if np.iscomplexobj(w):
+                            Y[:b, j] += 1j*np.bincount(r, weights=w.imag,
+                                                       minlength=b)
+        return Y
+
+    def _matvec(self, x):
+        return self._apply(np.asarray(x).reshape(-1, 1), False).reshape(
+            np.shape(x))
+
+    def _rmatvec(self, x):
+        return self._apply(np.conj(np.asarray(x)).reshape(-1, 1),
+                           True).conj().reshape(np.shape(x))
+
+    def _matmat(self, X):
+        return self._apply(np.asarray(X), False)
+
+    def _rmatmat(self, X):
+        return self._apply(np.conj(np.asarray(X)), True).conj()
+
+    def original(self, nodes):
+        """
+        Parameters:
+            nodes (ndarray): nodes of the specialized graph
+
+        Returns:
+            (ndarray): the index in the original graph of the node each one
+                is a copy of
+        """
+        nodes = np.asarray(nodes)
+        result = np.empty(nodes.shape, dtype=int)
+        b = self.base.size
+        is_base = nodes < b
+        result[is_base] = self.base[nodes[is_base]]
+        starts = np.array([group['start'] for group in self.groups])
+        which = np.searchsorted(starts, nodes, side='right') - 1
+        for g in np.unique(which[~is_base]):
+            group = self.groups[g]
+            mask = ~is_base & (which == g)
+            within = (nodes[mask] - group['start']) % group['size']
+            result[mask] = self.permute[group['members'][within]]
+        return result
+
+    def iterate(self, iters, initial_condition, a=0.):
+        """
+        Models the linear dynamics x(t+1) = a x(t) + S x(t) on the
+        specialized graph.
+
+        Parameters:
+            iters (int): number of time steps to be simulated
+            initial_condition (ndarray (n,)): initial state of the nodes
+            a (float or ndarray (n,)): effect of every node on itself
+
+        Returns:
+            (ndarray (iters, n)): the state of each node at every time step
+        """
+        t = np.empty((iters, self.shape[0]),
+                     dtype=np.result_type(self.dtype, initial_condition, a))
+        t[0] = initial_condition
+        for i in range(1, iters):
+            t[i] = a*t[i-1] + self.matvec(t[i-1])
+        return t
+
+    def _acyclic(self):
+        """
+        Whether the specialized graph has no cycle, so S is nilpotent and its
+        spectral radius is 0. A cycle either stays in a component block or
+        passes through the base nodes, and every branch of a path joins the
+        same two base nodes, so it is enough to look at the base nodes with
+        an edge from the first node of every path to its last one.
+
+        Returns:
+            (bool): True if the specialized graph is acyclic
+        """
+        for block in self.blocks.values():
+            # the components are strongly connected
+            if block.shape[0] > 1 or block.diagonal().any():
+                return False
+        b = self.base_block.shape[0]
+        # the last step links every branch to its last node, the first step
+        # links it from its first node
+        rows = np.array([group['steps'][-1][0][0] for group in self.groups],
+                        dtype=int)
+        cols = np.array([group['steps'][0][1][0] for group in self.groups],
+                        dtype=int)
+        B = self.base_block != 0
+        B = B + sparse.csr_matrix((np.ones(rows.size, dtype=bool),
+                                   (rows, cols)), shape=(b, b))
+        if B.diagonal().any():
+            return False
+        num_comp, _ = sparse.csgraph.connected_components(
+            B, connection='strong')
+        return num_comp == b
+
+    def spectral_radius(self, tol=0):
+        """
+        Finds the eigenvalue of largest modulus with ARPACK, which only needs
+        products with the operator. ARPACK only finds the 0 eigenvalue of a
+        nilpotent matrix up to its tolerance, so an acyclic specialized graph
+        returns 0 without it.
+
+        Parameters:
+            tol (float): relative accuracy of the eigenvalue, 0 for machine
+                precision
+
+        Returns:
+            (float): the spectral radius of the specialized matrix
+        """
+        n = self.shape[0]
+        if self._acyclic():
+            return 0.
+        if n < 3:
+            # too small for ARPACK
+            values = np.linalg.eigvals(self @ np.eye(n))
+            return float(np.max(np.abs(values), initial=0.))
+        v0 = np.random.default_rng(0).random(n)
+        try:
+            value = eigs(self, k=1, which='LM', tol=tol, v0=v0,
+                         return_eigenvectors=False)
+        except ArpackError:
+            # the Krylov space runs out when S^k v0 = 0, which means S is
+            # nilpotent, e.g. when no cycle passes through the base set
+            x = v0
+            for _ in range(min(n, 20) + 1):
+                x = self.matvec(x)
+                if not x.any():
+                    return 0.
+            raise
+        return float(np.abs(value[0]))
+
+    def eigen_centrality(self, tol=0):
+        """
+        The eigenvector centrality of the nodes of the specialized graph, from
+        the dominant eigenvector of S + I like
+        DirectedGraph.structural_eigen_centrality, found with ARPACK.
+
+        Parameters:
+            tol (float): relative accuracy of the eigenvector, 0 for machine
+                precision
+
+        Returns:
+            (ndarray (n,)): the centrality of each node, summing to 1
+        """
+        n = self.shape[0]
+        # we shift the matrix to find the true dominant eigen value
+        shifted = self + aslinearoperator(sparse.identity(n, dtype=self.dtype))
+        if n < 3:
+            # too small for ARPACK
+            values, vectors = np.linalg.eig(shifted @ np.eye(n))
+            p = vectors[:, np.argmax(values.real)]
+        else:
+            _, vectors = eigs(shifted, k=1, which='LR', tol=tol)
+            p = vectors[:, 0]
+        # normalize the vector so it sums to 1
+        return np.real(p / p.sum())
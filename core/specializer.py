@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 import scipy.linalg as la
 import scipy.optimize as opt
 import networkx as nx
@@ -7,6 +8,10 @@ import matplotlib.pyplot as plt
 import autograd as ag
 import autograd.numpy as anp
 from numba import jit
+import refinement
+from partition import Partition
+import orbits
+import paths
 
 
 ################################ WORK TO BE DONE ##############################
@@ -37,10 +42,14 @@ class DirectedGraph:
         labels (list(str)): list of labels assigned to the nodes of the graph
         labeler (dict(int, str)): maps indices to labels
         indexer (dict(str, int)): maps labels to indices
-        colors (dict(int, list(int))): cluster dictionary
+        colors (Partition): the coarsest equitable partition, which also
+            acts as the old dict(int: ndarray) cluster dictionary
+        trace (refinement.Trace): colors after every round of refinement,
+            kept by coloring(trace=True)
 
     Methods:
         specialize()
+        specialization_size()
         iterate()
         structural_eigen_centrality()
         eigen_centrality()
@@ -48,6 +57,8 @@ class DirectedGraph:
         spectral_radius()
         network_vis()
         coloring()
+        quotient()
+        orbit_partition()
     """
 
     def __init__(self, A, dynamics, labels=None):
@@ -84,7 +95,8 @@ class DirectedGraph:
         # we use the original indexer when we look at dynamics on the network
         # this dict doesn't change under specialization
         self.original_indexer = self.indexer.copy()
-        self.colors = dict()
+        self.colors = Partition([])
+        self.trace = None
         self.trivial_clusters = set()
         self.nontrivial_nodes = set(self.indices)
 
@@ -236,7 +248,8 @@ class DirectedGraph:
         return t
 
 
-    def specialize(self, base, verbose=False,recolor=True):
+    def specialize(self, base, verbose=False,recolor=True,
+                   memory_budget=None):
         """
         Given a base set, specialize the adjacency matrix of a network
 
@@ -244,6 +257,12 @@ class DirectedGraph:
             base (list, int or str): list of base nodes, the other nodes will
                 become the specialized set
             verbose (bool): print out key information as the code executes
+            recolor (bool): if True, the coarsest equitable partition of the
+                specialized graph is computed, starting from the current
+                coloring and which node each new node is a copy of
+            memory_budget (int): if given, a MemoryError is raised before
+                anything is built when the specialized matrix would take more
+                bytes than this (see specialization_size)
         """
 
         # if the base was given as a list of nodes then we convert them to the
@@ -259,6 +278,13 @@ class DirectedGraph:
             base = list(base)
         if len(base) > self.n:
             raise ValueError('base list is too long')
+        if memory_budget is not None:
+            self.specialization_size(base, memory_budget)
+
+        # the colors of the current graph by label; these seed the coloring of
+        # the specialized graph
+        prior_colors = {self.labeler[node]: int(color)
+                        for node, color in enumerate(self.colors.color)}
 
         base_size = len(base)
         # permute the matrix so the base set comes first
@@ -282,8 +308,12 @@ class DirectedGraph:
         diag_labeler = {}
         i = 1
 
+        # the paths are generated as we go, so we keep them for printing
+        temp_paths = []
         for path in pressed_paths:
             components = [comp[k] for k in path]
+            if verbose:
+                temp_paths.append(components)
             paths = self._path_combinations(components)
             comp_to_add = [self.A[[self.indexer[k] for k in c], :][:, [self.indexer[k] for k in c]] for c in components[1:-1]].copy()
 
@@ -295,12 +325,17 @@ class DirectedGraph:
                 links += self._link_adder(p, n_nodes, components)
                 n_nodes += sum(map(len, comp_to_add))
 
+        # parents holds the label each node of the specialized graph is a
+        # copy of; base nodes are their own parents
+        parents = [self.labeler[k] for k in range(base_size)]
+
         # we update the labeler to correctly label the newly created nodes
         step = base_size
         for i in range(1,len(diag)):
             comp_len = diag[i].shape[0]
             for k in range(comp_len):
                 self.labeler[step + k] = diag_labeler[i][k] + f'.{i}'
+                parents.append(diag_labeler[i][k])
             step += comp_len
 
         self._update_indexer()
@@ -317,20 +352,75 @@ class DirectedGraph:
 
         if verbose:
             print(f'Strongly connected components:\n {comp}\n')
-            temp_paths = []
-            for path in pressed_paths:
-                temp_paths.append([comp[k] for k in path])
             print(f'Paths from base node to base node:\n {temp_paths}\n')
             print(f'Number of nodes in the specialized matrix:\n {n_nodes}\n')
 
         # the coloring must be set to none
-        self.colors = dict()
+        self.colors = Partition([])
+        self.trace = None
 
         if recolor:
-            self.coloring()
+            self._recolor(parents, prior_colors)
 
         return
 
+    def specialization_size(self, base, memory_budget=None):
+        """
+        Counts the nodes and edges specialize(base) would give, by dynamic
+        programming over the compressed graph (see paths.specialization_size),
+        without building any paths or blocks or changing the graph.
+
+        Parameters:
+            base (list, int or str): list of base nodes
+            memory_budget (int): if given, a MemoryError is raised when the
+                dense specialized matrix, 8 bytes per entry, would take more
+                bytes than this
+
+        Returns:
+            nodes (int): number of nodes of the specialized graph
+            edges (int): number of edges of the specialized graph
+        """
+        base = [self.indexer[k] if type(k) == str else k for k in base]
+        nodes, edges = paths.specialization_size(self.A, base)
+        if memory_budget is not None and 8.*nodes**2 > memory_budget:
+            raise MemoryError(f'specializing gives {nodes} nodes, whose '
+                              f'matrix takes {8.*nodes**2:.3g} bytes, over '
+                              f'the budget of {memory_budget}')
+        return nodes, edges
+
+    def _recolor(self, parents, prior_colors):
+        """
+        Colors the graph after specialization without starting from scratch.
+        Every node is seeded with the color of the node it was copied from and
+        the colors of the nodes its inputs were copied from. By the lifting
+        theorem in other_resources/def.txt, nodes with matching provenance
+        almost always end up in the same cell, so refining the seed is close
+        to linear in the size of the specialized graph. The seed only affects
+        the cost; see refinement.coarsest_from_seed for why the result is
+        the coarsest equitable partition for any seed.
+
+        Parameters:
+            parents (list(str)): label of the node each node was copied from
+            prior_colors (dict(str: int)): maps labels of the graph before
+                specialization to their colors; if empty, the labels
+                themselves are used as colors
+        """
+        if prior_colors:
+            tau = np.array([prior_colors[p] for p in parents])
+        else:
+            _, tau = np.unique(parents, return_inverse=True)
+
+        # the weights as exact integers, the way coloring() refines them
+        A = refinement.integer_weights(self.A)
+        # hash the multiset of input colors into one number per node
+        hashes = refinement._mix(tau.astype(np.uint64))
+        in_hash = (A != 0).astype(np.uint64) @ hashes
+
+        _, seed = np.unique(np.column_stack((tau.astype(np.uint64), in_hash)),
+                            axis=0, return_inverse=True)
+        colors = refinement.coarsest_from_seed(A, seed.ravel())
+        self.colors = Partition(colors)
+
     def _update_indexer(self):
         """
         This function assumes that self.labeler is correct in its labeling:
@@ -405,7 +495,6 @@ class DirectedGraph:
         # use nx to find the strongly connected components of specG
         SCComp = [np.array(list(c)) for c in nx.strongly_connected_components(spec_graph)]
         num_comp = len(SCComp)
-        N = base_size + num_comp
 
         # comp will be a dictionary mapping base nodes to components
         # comp will keep track of the labels of the components
@@ -418,78 +507,32 @@ class DirectedGraph:
             comp[i+base_size] = [self.labeler[k+base_size] for k in temp1]
 
         # smallA will for our compressed A matrix lumping together all the
-        # strongly connected components
-        smallA = np.zeros((N,N))
+        # strongly connected components, found as the condensation over the
+        # partition of the nodes into base nodes and components
+        cells = np.arange(self.A.shape[0])
+        for i in range(num_comp):
+            cells[base_size + SCComp[i]] = base_size + i
+        smallA = Partition(cells).condensation(self.A).toarray()*1.
+        # a component has no edge to itself, and the base nodes keep theirs
+        np.fill_diagonal(smallA, 0)
         smallA[:base_size, :base_size] = self.A[:base_size, :base_size]
-
-        for i in range(base_size, N):
-            i_indices = [self.indexer[k] for k in comp[i]]
-
-            smallA[:base_size, i] = (self.A[:base_size, i_indices].sum(axis=1) != 0)*1.
-            smallA[i, :base_size] = (self.A[i_indices, :base_size].sum(axis=0) != 0)*1.
-
-            for j in range(base_size, i):
-                j_indices = [self.indexer[k] for k in comp[j]]
-
-                smallA[i,j] = (not (self.A[i_indices, :][:, j_indices] == 0).all())*1.
-                smallA[j,i] = (not (self.A[j_indices, :][:, i_indices] == 0).all())*1.
         return smallA, comp
 
     def _find_paths_to_base(self, smallA, base_size, comp):
         """
         Finds all the paths between the base nodes that pass through the
-        specialization set in the compressed graph
+        specialization set in the compressed graph, see paths.base_paths
 
         Parameters:
             smallA (ndarray): a compressed adjecency matrix
-            base_size (int): number of nodes in the base set
+            base_size (int): number of base nodes in the base set
 
         Returns:
-            pressed_paths (list, list(str)): list of paths that pass through
-                the specialization set
-        """
-
-        _, N = smallA.shape
-        pressed_paths = []
-
-        # find the path between every pair of nodes
-        for b1 in range(base_size):
-            for b2 in range(base_size):
-                # remove all other base ndes from the graph so we only find
-                # paths through the specialization set
-                if b1 == b2:
-                    # in this case we look for cycles
-                    mask = [b1] + list(range(base_size, N))
-                    new_size = len(mask) + 1
-                    reducedA = np.zeros((new_size, new_size))
-                    reducedA[:-1, :-1] = smallA[mask,:][:, mask]
-                    # remove in going edges from the base node and add to new
-                    # node
-                    reducedA[-1,:] = reducedA[0,:]
-                    reducedA[0,:] = np.zeros(new_size)
-                    G = nx.DiGraph(reducedA.T)
-                    # find paths from the base node to the new node
-                    # which is the same as finding cycles in this case
-                    paths = list(nx.all_simple_paths(G,0,new_size-1))
-
-                else:
-                    mask = [b1,b2] + list(range(base_size, N))
-                    reducedA = smallA[mask,:][:,mask]
-                    # remove base node interations
-                    reducedA[:2,:2] = np.zeros((2,2))
-                    G = nx.DiGraph(reducedA.T)
-                    paths = list(nx.all_simple_paths(G,0,1))
-
-                # process the paths
-                for p in paths:
-                    if p != []:
-                        if b1 == b2:
-                            p = np.array(p) + base_size - 1
-                        else:
-                            p = np.array(p) + base_size - 2
-                        p[[0,-1]] = [b1,b2]
-                        pressed_paths.append(p)
-        return pressed_paths
+            pressed_paths (generator(ndarray)): the paths that pass through
+                the specialization set, as indices of smallA, generated one
+                at a time
+        """
+        return paths.base_paths(smallA, base_size)
 
     def _path_combinations(self, components):
         """
@@ -632,33 +675,72 @@ class DirectedGraph:
         ranks = {self.labeler[i]: np.real(p[i]) for i in range(self.n)}
         return ranks
 
-    def spectral_radius(self):
+    def spectral_radius(self, method='eig'):
         """
+        Parameters:
+            method (str): 'eig' (default) finds every eigenvalue of the n x n
+                stability matrix. 'quotient' only finds those of its k x k
+                quotient over the coarsest equitable partition (see
+                quotient()), which has the same spectral radius since the
+                stability matrix is nonnegative. This needs the partition to
+                be equitable for the stability matrix too, which fails when
+                nodes of one color have different dynamics; a ValueError is
+                raised in that case
+
         Returns:
             (float): the spectral radius of the network based on the stability
                 matrix
         """
 
         Df = self.stability_matrix()
+        if method == 'quotient':
+            partition = self._equitable_partition()
+            Df = sparse.csr_matrix(Df)
+            # allow for rounding in the sampled derivatives
+            tol = 1e-9 * max(abs(Df).sum(axis=1).max(), 1.)
+            violations = refinement.equitability_violations(
+                Df, partition.color, tol=tol)
+            if violations:
+                raise ValueError('the equitable partition of the graph is not '
+                                 'equitable for the stability matrix, e.g. '
+                                 f'{violations[0]}')
+            Df = partition.quotient(Df).toarray()
+        elif method != 'eig':
+            raise ValueError(f'unknown method "{method}"')
         eigs = la.eig(Df)
         # find the eigen value with largest modulus, which is the spectral
         # radius
         return np.max(np.abs(eigs[0]))
 
-    def structural_eigen_centrality(self):
+    def structural_eigen_centrality(self, method='eig'):
         """
+        Parameters:
+            method (str): 'eig' (default) finds the eigenvectors of the n x n
+                matrix A + I. 'quotient' finds them for the k x k quotient
+                matrix (see quotient()) instead and lifts the dominant one
+                back to the nodes, giving every node of a color the same value
+
         Returns:
             (dict):
                 (keys): labels of the nodes
                 (values): the associated eigencentrality
         """
 
-        # we shift the matrix to find the true dominant eigen value
-        B = self.A + np.eye(self.n)
+        if method == 'quotient':
+            partition = self._equitable_partition()
+            B = self.quotient().toarray() + np.eye(len(partition))
+        elif method == 'eig':
+            # we shift the matrix to find the true dominant eigen value
+            B = self.A + np.eye(self.n)
+        else:
+            raise ValueError(f'unknown method "{method}"')
         eigs = la.eig(B)
         i = np.argmax(eigs[0])
         # we then extract the eigen vector associated to this value
         p = eigs[1][:,i]
+        if method == 'quotient':
+            # every node takes the value of its color
+            p = p[partition.color]
         # normalize the vector so it sums to 1
         # i.e. turn it into a probability vector
         p /= p.sum()
@@ -743,13 +825,10 @@ class DirectedGraph:
         """
 
         if use_eqp:
-            if self.colors == dict():
+            if not self.colors:
                 self.coloring()
-            self.colors
-            group_dict = {}
-            for color in self.colors.keys():
-                for node in self.colors[color]:
-                    group_dict[self.labeler[node]] = color
+            group_dict = {self.labeler[node]: int(color)
+                          for node, color in enumerate(self.colors.color)}
 
         else:
             # find synchronized communities
@@ -810,17 +889,137 @@ class DirectedGraph:
         if show:
             plt.show()
 
-    def coloring(self):
+    def _seeded_graph(self, A, seed, edge_key):
+        """
+        Translates the seed and edge_key options of coloring() into an
+        initial coloring and a typed adjacency matrix for the engines in
+        refinement.py.
+
+        Parameters:
+            A (sparse.csr_matrix): the integer adjacency matrix to color
+
+        Returns:
+            A (sparse.csr_matrix): the adjacency matrix, with edge types
+                folded in (see refinement.typed_adjacency)
+            initial (ndarray (n,)): initial color of each node, or None
+        """
+        labels = [self.labeler[i] for i in range(self.n)]
+        by_dynamics = (type(seed) is str and seed == 'dynamics',
+                       type(edge_key) is str and edge_key == 'dynamics')
+        if any(by_dynamics) and self.dynamics is None:
+            raise ValueError('the graph has no dynamics to seed the coloring')
+
+        initial = None
+        if seed is not None:
+            if by_dynamics[0]:
+                # nodes with different self dynamics can never synchronize
+                a = self.dynamics[0]
+                keys = [a[self.origination(i)] for i in range(self.n)]
+            elif callable(seed):
+                keys = [seed(label) for label in labels]
+            elif isinstance(seed, dict):
+                keys = [seed.get(label) for label in labels]
+            else:
+                keys = list(seed)
+                if len(keys) != self.n:
+                    raise ValueError('seed needs one key per node')
+            initial = refinement.key_colors(keys)
+
+        if edge_key is not None:
+            A = A.tocoo()
+            if by_dynamics[1]:
+                f = self.dynamics[1]
+                origin = [self.origination(i) for i in range(self.n)]
+                keys = [f[origin[i], origin[j]] for i, j in zip(A.row, A.col)]
+                types = refinement.key_colors(keys)
+            elif callable(edge_key):
+                types = refinement.key_colors(
+                    edge_key(labels[i], labels[j])
+                    for i, j in zip(A.row, A.col))
+            else:
+                # a matrix of integer edge types with the sparsity of A
+                types = np.zeros(A.nnz, dtype=int)
+                if A.nnz:
+                    types = np.asarray(
+                        sparse.csr_matrix(edge_key)[A.row, A.col]).ravel()
+            A = refinement.typed_adjacency(A, types)
+        return A, initial
+
+    def coloring(self, engine='pairwise', seed=None, edge_key=None, tol=None,
+                 trace=False):
         """
         This method uses an algorithm called input driven refinement that will
         find the unique coarsest equitable partition of a the graph associated
         with the network. This partition is based only on the structure of the
-        graph, and is not based on other functional elements of the system.
-        Returns:
-            dict(int: list): a partition where each of the keys represents a
-                unique color and the associated list a list of indices that
-                are in the cluster
+        graph, and is not based on other functional elements of the system
+        unless the seed or edge_key options below bring them in.
+
+        Parameters:
+            engine (str): 'pairwise' (default) runs the refinement below;
+                'worklist', 'vectorized' and 'numba' use the engines in
+                refinement.py on a sparse copy of A. 'numba' compiles the
+                refinement kernel once and caches it on disk. Graphs with
+                non integer weights, and the seed and edge_key options,
+                always use 'worklist' in place of 'pairwise'.
+
+            seed (str, callable, dict or sequence): an initial partition for
+                the refinement to split, so nodes with different keys never
+                share a color; starting from a finer partition also takes
+                fewer passes. 'dynamics' groups nodes by their self dynamics
+                function a[i]; a callable is called on each node label; a dict
+                maps labels to keys; a sequence gives the key of every node.
+                By default every node starts with the same color
+
+            edge_key (str, callable or sparse matrix): splits the edges into
+                types, and the partition is made equitable for each type
+                separately (a multi-relational equitable partition).
+                'dynamics' uses the edge functions f[i, j]; a callable is
+                called on (receiving label, sending label); a matrix gives an
+                integer type for every edge of A
+
+            tol (float): weights of a weighted A are rounded to multiples of
+                tol before comparing input sums. By default they are compared
+                exactly (see refinement.integer_weights)
+
+            trace (bool): if True, self.trace keeps the colors after every
+                round of refinement (a refinement.Trace). Only the
+                'vectorized' engine refines in rounds, so it replaces the
+                default 'pairwise'
+
+        Sets self.colors to a Partition of the nodes, which acts as a dict
+        mapping each color to the sorted indices of its nodes.
         """
+        # the pairwise refinement would compare float sums with ==, so
+        # weighted graphs go to the engines, which compare integer sums; it
+        # has no initial colors or edge types either
+        weighted = tol is not None or np.any(self.A != np.round(self.A))
+        self.trace = None
+        if trace:
+            if engine == 'pairwise':
+                engine = 'vectorized'
+            elif engine != 'vectorized':
+                raise ValueError(f'the "{engine}" engine has no rounds to '
+                                 'trace')
+        if engine == 'pairwise' and (weighted or seed is not None
+                                     or edge_key is not None):
+            engine = 'worklist'
+        if seed is not None or edge_key is not None:
+            A = refinement.integer_weights(sparse.csr_matrix(self.A), tol)
+            A, initial = self._seeded_graph(A, seed, edge_key)
+            colors = refinement.equitable_coloring(A, engine, initial=initial,
+                                                   trace=trace)
+            if trace:
+                colors, self.trace = colors
+            self.colors = Partition(colors)
+            return
+
+        if engine != 'pairwise':
+            A = refinement.integer_weights(sparse.csr_matrix(self.A), tol)
+            colors = refinement.equitable_coloring(A, engine, trace=trace)
+            if trace:
+                colors, self.trace = colors
+            self.colors = Partition(colors)
+            return
 
         #helper function for input driven refinement
         # @jit
@@ -900,13 +1099,60 @@ class DirectedGraph:
             next_colors = _refine(colors)
             if len(colors.keys()) == len(next_colors.keys()):
                 refine = False
-        self.colors = colors
+        self.colors = Partition.from_dict(colors, self.n)
+
+
+    def _equitable_partition(self):
+        """
+        Returns:
+            (Partition): the coloring of the graph, computed first if the
+                graph has not been colored since it last changed
+        """
+        if self.colors.n != self.n:
+            self.coloring()
+        return self.colors
+
+    def quotient(self):
+        """
+        Builds the quotient (divisor) matrix of the graph over its coarsest
+        equitable partition with one sparse triple product D^-1 P^T A P, see
+        Partition.quotient. Entry (c, d) is the number of inputs every node
+        of color c receives from color d. Its eigenvalues are eigenvalues of
+        A, including the spectral radius.
+
+        Returns:
+            (sparse.csr_matrix (k, k)): the quotient matrix
+        """
+        return self._equitable_partition().quotient(sparse.csr_matrix(self.A))
+
+    def orbit_partition(self):
+        """
+        Finds the orbits of the automorphism group of the graph: two nodes
+        share an orbit when some relabeling of the nodes preserving every
+        edge maps one to the other. The orbit partition always refines the
+        coarsest equitable partition from coloring(), and nodes that are
+        balanced but not symmetric end up in different orbits. See
+        orbits.orbit_coloring for the search.
+
+        Returns:
+            (Partition): the orbit of each node
+        """
+        return Partition(orbits.orbit_coloring(
+            refinement.integer_weights(sparse.csr_matrix(self.A))))
 
+    def equitability_violations(self):
+        """
+        Checks the current coloring in one pass over the input counts A @ P
+        (see refinement.equitability_violations).
+
+        Returns:
+            (list(Violation)): a (cell, source, low, high) tuple for every pair
+                of colors where the nodes of color cell receive between low
+                and high inputs from color source; empty if the coloring is
+                equitable
+        """
+        return refinement.equitability_violations(sparse.csr_matrix(self.A),
+                                                  self.colors.color)
 
     def color_checker(self):
-        for color1 in self.colors.values():
-            for color2 in self.colors.values():
-                x = np.sum(self.A[color1][:,color2],axis=1)
-                if not (x==x[0]).all():
-                    return False
-        return True
+        return not self.equitability_violations()
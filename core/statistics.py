@@ -2,14 +2,46 @@
 import pickle
 import numpy as np
 import matplotlib.pyplot as plt
-from networkx.generators import random_graphs
-import networkx as nx
-import sparse_specializer as spec
+import refinement
+from bitmatrix import BitMatrix, bit_refinement, pack_rows
+from scipy import sparse
+from partition import Partition
 import progressbar
 import sys
 import os
 from mpi4py import MPI
 
+def _community_sizes(colors):
+    """
+    Extracts the size of every community from coloring data.
+
+    Parameters:
+        colors: Partition, or dict in one of the formats accepted by
+            community_dist_bar
+
+    Returns:
+        comm_sizes (ndarray): size of each community, with repeats
+    """
+    if isinstance(colors, Partition):
+        return colors.sizes()
+    values = list(colors.values())
+    if values and type(values[0]) is int:
+        # colors maps comm_size --> num_comms
+        return np.repeat(list(colors.keys()), values)
+    return np.array([len(comm) for comm in values], dtype=int)
+
+def _aggregate_colorings(colorings):
+    """
+    Counts the communities of each size over a list of colorings.
+
+    Returns:
+        dict(int: int): maps comm_size --> num_comms
+    """
+    comm_sizes = np.concatenate([_community_sizes(graph) for graph in colorings]
+                                + [np.empty(0, dtype=int)])
+    sizes, counts = np.unique(comm_sizes, return_counts=True)
+    return dict(zip(sizes.tolist(), counts.tolist()))
+
 def community_dist_bar(colors, title=None, logscale=True, barh=False, show=True,
                         save=False, **kwargs):
     """
@@ -17,8 +49,9 @@ def community_dist_bar(colors, title=None, logscale=True, barh=False, show=True,
 
     Parameters:
 
-        colors: dict/list of coloring data, or path (str) to pickled data.
+        colors: Partition/dict of coloring data, or path (str) to pickled data.
             Accepted formats:
+                Partition (e.g. DirectedGraph.colors)
                 dict:   {comm_num: array(nodes_in_comm)}
                         {comm_size: num_comms}
 
@@ -48,23 +81,10 @@ def community_dist_bar(colors, title=None, logscale=True, barh=False, show=True,
         with open(colors, 'rb') as f:
             colors = pickle.load(f)
 
-    # type of dict values should be int or array (or tuple)
-    dict_type = type(list(colors.values())[0])
-    if dict_type is int:
-        # if dict_type is int, it maps comm_size --> num_comms
-        # comm_size is bar positions, num_comms is bar heights
-        comm_size, num_comms = colors.keys(), colors.values()
-    else:
-        # if dict_type is array or tuple, we have to extract comm_sizes
-        # get largest community size (+1 for range indexing)
-        max_comm_size = max([len(comm) for comm in list(colors.values())])+1
-        # convert dict to {comm_size: num_comms}
-        colors = {i: sum([1 for k in list(colors.keys()) if len(colors[k])==i])
-                    for i in range(1, max_comm_size)}
-        # remove comm_sizes with num_comms=0 to reduce plotting spatial complexity
-        colors = {size: num for (size, num) in colors.items() if num!=0}
-        # comm_size is bar positions, num_comms is bar heights
-        comm_size, num_comms = colors.keys(), colors.values()
+    # comm_size is bar positions, num_comms is bar heights; sizes without any
+    # communities are left out
+    comm_size, num_comms = np.unique(_community_sizes(colors),
+                                     return_counts=True)
 
     # create plot
     if barh:
@@ -90,8 +110,9 @@ def community_dist_hist(colors, title=None, logscale=True, show=True, save=False
 
     Parameters:
 
-        colors: dict of coloring data, or path (str) to pickled data.
+        colors: Partition/dict of coloring data, or path (str) to pickled data.
             Accepted formats:
+                Partition (e.g. DirectedGraph.colors)
                 dict:   {comm_num: array(nodes_in_comm)}
                         {comm_size: num_comms}
 
@@ -122,17 +143,8 @@ def community_dist_hist(colors, title=None, logscale=True, show=True, save=False
         with open(colors, 'rb') as f:
             colors = pickle.load(f)
 
-    # type of dict values should be int or array (or tuple)
-    dict_type = type(list(colors.values())[0])
-    if dict_type is int:
-        # if dict_type is int, it maps comm_size --> num_comms
-        comm_sizes = []
-        for size in colors.keys():
-            # community sizes list; entry for each community of size comm
-            comm_sizes += [size]*colors[size]
-    else:
-        # if dict_type is array or tuple, extract comm_sizes entry by entry
-        comm_sizes = [len(comm) for comm in colors.values()]
+    # one entry for each community
+    comm_sizes = _community_sizes(colors)
 
     # create plot
     plt.hist(np.log(comm_sizes), log=logscale, **kwargs)
@@ -149,7 +161,7 @@ def community_dist_hist(colors, title=None, logscale=True, show=True, save=False
         plt.show()
 
 def erdos_renyi_colorings(n=100, p=0.1, graphs=10, edges=None, agg=True,
-                          verbose=True, MPI=False):
+                          verbose=True, MPI=False, engine='vectorized'):
     """
     Generates erdos-renyi random graphs, computes the coarsest equitable
     coloring of each, and returns the coloring statitstics.
@@ -179,6 +191,12 @@ def erdos_renyi_colorings(n=100, p=0.1, graphs=10, edges=None, agg=True,
         MPI (int): If int is specified, uses MPI to run in parallel with MPI
             processes
 
+        engine (str): refinement engine that refinement.color_many uses on
+            each batch of graphs (see refinement.equitable_coloring). The
+            default 'vectorized' engine suits the small random graphs here.
+            Dense graphs (p >= 0.2) of 100 nodes or more are colored one at a
+            time with bitmatrix.bit_refinement instead, and ignore it.
+
     Returns:
         color_stats: If agg=True, the statistics for each coloring are aggregated
             and a single average statistic is returned. Otherwise, a list of the
@@ -187,7 +205,7 @@ def erdos_renyi_colorings(n=100, p=0.1, graphs=10, edges=None, agg=True,
     if MPI:
         # run the secret version via command-line
         os.system(f'mpiexec -n {MPI} python statistics.py erc {n} {p} {graphs} '
-                  f'{edges} {agg} {verbose}')
+                  f'{edges} {agg} {verbose} {engine}')
 
         # load pickled files
         colorings = []
@@ -199,75 +217,141 @@ def erdos_renyi_colorings(n=100, p=0.1, graphs=10, edges=None, agg=True,
 
         if agg:
             # aggregate coloring information
-            agg_colors = dict()
-            for graph in colorings:
-                comm_sizes = [len(comm) for comm in graph.values()]
-                for size in comm_sizes:
-                    try:
-                        agg_colors[size] += 1
-                    except KeyError:
-                        agg_colors[size] = 1
-
-            colorings = agg_colors
+            colorings = _aggregate_colorings(colorings)
 
         return colorings
 
     else:
         return _erdos_renyi_colorings(n=n, p=p, graphs=graphs, edges=edges,
-                                        agg=agg, verbose=verbose)
+                                        agg=agg, verbose=verbose, engine=engine)
 
 
 
+def _random_graphs(n, p, edges, count, rng):
+    """
+    Samples a batch of directed erdos-renyi graphs without self loops,
+    without building any graph objects.
+
+    Parameters:
+        n (int): number of nodes of each graph
+        p (float): edge probability of G(n, p), ignored if edges is given
+        edges (int): number of edges of G(n, m), or None for G(n, p)
+        count (int): number of graphs
+        rng (np.random.Generator): random number generator
+
+    Returns:
+        (ndarray (count, n, n) or list(sparse.csr_matrix)): the adjacency
+            matrices, as one boolean array when the batch is small enough to
+            draw all at once (see refinement.color_many)
+    """
+    pairs = n*(n-1)
+    if count*n*n <= 2**24:
+        # small graphs are drawn all at once as dense arrays
+        if edges is None:
+            mask = rng.random((count, n, n)) < p
+            mask[:, np.arange(n), np.arange(n)] = False
+            return mask
+        # the edges are the off-diagonal positions with the smallest keys
+        keys = rng.random((count, pairs))
+        positions = np.argpartition(keys, edges - 1, axis=1)[:, :edges] \
+            if edges > 0 else np.zeros((count, 0), dtype=int)
+        graph = np.repeat(np.arange(count), edges)
+        rows, cols = np.divmod(positions.ravel(), n - 1)
+        mask = np.zeros((count, n, n), dtype=bool)
+        mask[graph, rows, cols + (cols >= rows)] = True
+        return mask
+
+    # large graphs are drawn one at a time as lists of positions
+    graphs = []
+    for g in range(count):
+        m = rng.binomial(pairs, p) if edges is None else edges
+        positions = rng.choice(pairs, m, replace=False)
+        rows, cols = np.divmod(positions, n - 1)
+        graphs.append(sparse.csr_matrix(
+            (np.ones(m, dtype=int), (rows, cols + (cols >= rows))),
+            shape=(n, n)))
+    return graphs
+
+
+def _random_bits(n, p, edges, rng):
+    """
+    Samples one directed erdos-renyi graph without self loops straight into
+    bit storage, a block of rows at a time, so a dense graph never exists as
+    a dense or CSR matrix.
+
+    Parameters:
+        n (int): number of nodes
+        p (float): edge probability of G(n, p), ignored if edges is given
+        edges (int): number of edges of G(n, m), or None for G(n, p)
+        rng (np.random.Generator): random number generator
+
+    Returns:
+        (BitMatrix): the adjacency matrix
+    """
+    if edges is not None:
+        positions = rng.choice(n*(n-1), edges, replace=False)
+        rows, cols = np.divmod(positions, n - 1)
+        cols = cols + (cols >= rows)
+        return BitMatrix(sparse.coo_matrix(
+            (np.ones(edges, dtype=int), (rows, cols)), shape=(n, n)))
+
+    words = np.empty((n, -(-n // 64)), dtype=np.uint64)
+    block = max(1, 2**24 // n)
+    for first in range(0, n, block):
+        last = min(first + block, n)
+        mask = rng.random((last - first, n)) < p
+        mask[np.arange(last - first), np.arange(first, last)] = False
+        words[first:last] = pack_rows(mask)
+    return BitMatrix.from_words(words, n)
+
+
 def _erdos_renyi_colorings(n=100, p=0.1, graphs=10, edges=None, agg=True,
-                          verbose=True, MPI=False):
+                          verbose=True, MPI=False, engine='vectorized'):
     """
     Secret backend that actually does the work for erdos_renyi_colorings. This
     is necessary to allow parallelism with MPI.
 
+    The graphs are sampled and colored in batches: refinement.color_many
+    colors each batch in a single call on one block diagonal matrix, so the
+    cost per graph is the refinement itself rather than python overhead.
+
     For documentation, see the docstring for erdos_renyi_colorings.
     """
+    rng = np.random.default_rng()
+    # dense graphs of a hundred nodes or more are colored one at a time in bit
+    # storage, which beats a block diagonal CSR matrix from there on
+    density = p if edges is None else edges / max(n*(n-1), 1)
+    bits = n >= 100 and density >= 0.2
+    # batches of about 2^24 adjacency entries
+    batch = 1 if bits else max(1, 2**24 // max(n*n, 1))
+    batches = range(0, graphs, batch)
     # set verbosity
     if verbose:
-        graphs = progressbar.progressbar(range(graphs))
-    else:
-        graphs = range(graphs)
+        batches = progressbar.progressbar(batches)
 
     colorings = []  # holds each graph's coloring stats
-
-    for g in graphs:
-        # generate graph
-        if edges is None:
-            if p < 0.2:
-                # if probability is low, this is faster than the other one
-                G = nx.random_graphs.fast_gnp_random_graph(n, p, directed=True)
-            else:
-                G = nx.random_graphs.gnp_random_graph(n, p, directed=True)
+    comm_sizes = []
+
+    for first in batches:
+        count = min(batch, graphs - first)
+        if n == 0:
+            colorings += [Partition([]) for _ in range(count)]
+            continue
+        if bits:
+            colors = [bit_refinement(_random_bits(n, p, edges, rng))]
+        else:
+            colors = refinement.color_many(
+                _random_graphs(n, p, edges, count, rng), engine=engine)
+        if agg:
+            comm_sizes += [np.bincount(block) for block in colors]
         else:
-            if edges/(n*(n-1)) < 0.25:
-                # this is faster with sparse graphs
-                G = nx.random_graphs.gnm_random_graph(n, edges, directed=True)
-            else:
-                G = nx.random_graphs.dense_gnm_random_graph(n, edges, directed=True)
-
-        # create specializer graph object
-        G = spec.DirectedGraph(nx.adjacency_matrix(G))
-        # run coloring (note that nx transposes from our convention, but the
-        # community structure will be the same)
-        G.coloring()
-        colorings.append(G.colors)
+            colorings += [Partition(block) for block in colors]
 
     if agg:
         # aggregate coloring data
-        agg_colors = dict()
-        for graph in colorings:
-            comm_sizes = [len(comm) for comm in graph.values()]
-            for size in comm_sizes:
-                try:
-                    agg_colors[size] += 1
-                except KeyError:
-                    agg_colors[size] = 1
-
-        colorings = agg_colors
+        sizes, counts = np.unique(np.concatenate(comm_sizes + [[]]).astype(int),
+                                  return_counts=True)
+        colorings = dict(zip(sizes.tolist(), counts.tolist()))
 
     if MPI:
         with open(f'temp_{MPI}', 'wb') as outfile:
@@ -285,7 +369,7 @@ if __name__ == '__main__':
         rank = comm.Get_rank()+1
         size = comm.Get_size()
 
-        n, p, graphs, edges, agg, verbose = args[2:]
+        n, p, graphs, edges, agg, verbose, engine = args[2:]
         n, p, graphs = int(n), float(p), int(graphs)
         if edges == 'None':
             edges = None
@@ -305,4 +389,5 @@ if __name__ == '__main__':
         # distribute graphs among nodes
         graphs = graphs//size
         colorings = _erdos_renyi_colorings(n=n, p=p, graphs=graphs, edges=edges,
-                                            agg=False, verbose=verbose, MPI=rank)
+                                            agg=False, verbose=verbose, MPI=rank,
+                                            engine=engine)
@@ -0,0 +1,252 @@
+# temporal.py
+from collections import namedtuple, deque
+from scipy import sparse
+import numpy as np
+import itertools
+import sys
+from sparse_specializer import DirectedGraph
+
+
+# the nodes whose cell changed since the previous snapshot, with the label
+# (smallest node index) of their new cell
+WindowDiff = namedtuple('WindowDiff', ['nodes', 'labels'])
+
+
+def read_temporal_edges(filename, chunk_size=100000, time_col=3,
+                        weight_col=2):
+    """
+    Streams a timestamped edge list, such as the out.* files of the KONECT
+    temporal graphs (dnc-temporalGraph, radoslaw_email), without loading the
+    whole file. Every line holds the sending node, the receiving node, and
+    further columns with the weight and the time; lines starting with % are
+    comments.
+
+    Parameters:
+        filename (str): path to the edge list
+        chunk_size (int): number of lines parsed at a time
+        time_col (int): column of the timestamps
+        weight_col (int): column of the weights, or None for weight 1
+
+    Yields:
+        receivers, senders (ndarray): the nodes of each edge, with our
+            convention that the receiver receives from the sender
+        times (ndarray): timestamp of each edge
+        weights (ndarray): weight of each edge
+    """
+    with open(filename, 'r') as f:
+        lines = (line for line in f if line.strip() and line[0] != '%')
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            data = np.loadtxt(chunk, ndmin=2)
+            weights = np.ones(len(data)) if weight_col is None \
+                else data[:, weight_col]
+            yield (data[:, 1].astype(int), data[:, 0].astype(int),
+                   data[:, time_col], weights)
+
+
+def count_nodes(filename):
+    """
+    Returns:
+        (int): one more than the largest node index of an edge list, which is
+            the number of nodes loadtxt would give the graph
+    """
+    n = 0
+    for receivers, senders, _, _ in read_temporal_edges(filename):
+        n = max(n, receivers.max() + 1, senders.max() + 1)
+    return int(n)
+
+
+def _labels(partition):
+    """
+    Labels every cell by its smallest node, so cells that do not change keep
+    their label from one snapshot to the next.
+
+    Returns:
+        (ndarray (n,)): the label of the cell of each node
+    """
+    return partition.order[partition.offsets[:-1]][partition.color]
+
+
+def window_colorings(stream, n, window, stride, start=None, directed=True,
+                     weighted=False, diffs=False, exact=False):
+    """
+    Maintains an equitable partition of the graph of the edges in a sliding
+    time window. After every stride, the edges entering and leaving the
+    window are applied to the partition of the previous window with
+    DirectedGraph.add_edges, so updating the partition costs about as much
+    as the change of the window rather than a full coloring (unless exact is
+    True); handing out each snapshot adds a pass over the n node colors.
+
+    The window ending at time T holds the edges with T - window <= t < T. The
+    first snapshot is at start + window and the last one is the first to
+    pass the final edge.
+
+    Parameters:
+        stream (iterable): chunks (receivers, senders, times, weights) of
+            edges in nondecreasing order of time, e.g. read_temporal_edges
+        n (int): number of nodes, e.g. count_nodes
+        window (float): length of the window
+        stride (float): time between snapshots
+        start (float): start of the first window; defaults to the time of
+            the first edge
+        directed (bool): if False, every edge joins its nodes both ways
+        weighted (bool): if True, the graph holds the total weight of the
+            edges in the window between two nodes. Otherwise it has an edge
+            wherever the window has at least one
+        diffs (bool): if True, every snapshot after the first is a WindowDiff
+            of the nodes whose cell changed
+        exact (bool): passed on to add_edges. If False (default), the
+            snapshots are equitable partitions that may be finer than the
+            coarsest one. If True, they are the coarsest, but every snapshot
+            then costs refinement passes over the quotient of the whole graph
+            rather than the change of the window
+
+    Yields:
+        time (float): end of the window
+        colors (Partition or WindowDiff): the partition of the window's graph,
+            or its changes since the previous snapshot if diffs is True
+    """
+    G = DirectedGraph(sparse.csr_matrix((n, n), dtype=float if weighted
+                                        else int), weighted=weighted)
+    G.coloring()
+    # number of copies and weight of each pair of nodes in the window
+    counts = {}
+
+    chunks = iter(stream)
+    # edges read from the stream but not yet in the window
+    pending = deque()
+    # edges in the window, in order of time
+    active = deque()
+    end, labels, exhausted, last = None, None, False, -np.inf
+
+    while True:
+        # read until the stream passes the end of the window
+        while not exhausted and (end is None or not pending or
+                                 pending[-1][2][-1] < end):
+            try:
+                receivers, senders, times, weights = next(chunks)
+            except StopIteration:
+                exhausted = True
+                break
+            if times.size == 0:
+                continue
+            if np.any(np.diff(times) < 0) or times[0] < last:
+                raise ValueError('the edges must be in order of time')
+            last = times[-1]
+            if end is None:
+                end = (times[0] if start is None else start) + window
+            # self edges are dropped, as in loadtxt
+            keep = receivers != senders
+            if not keep.any():
+                continue
+            edges = (receivers[keep], senders[keep], times[keep],
+                     weights[keep])
+            if not directed:
+                edges = tuple(np.concatenate((a, b)) for a, b in
+                              zip(edges, (edges[1], edges[0]) + edges[2:]))
+                order = np.argsort(edges[2], kind='stable')
+                edges = tuple(a[order] for a in edges)
+            pending.append(edges)
+
+        if end is None:
+            # the stream held no edges
+            return
+        entering = _take_before(pending, end)
+        active.extend(entering)
+        leaving = _take_before(active, end - window)
+        counts = _update_window(G, counts, entering, leaving, weighted,
+                                exact)
+
+        if diffs and labels is not None:
+            new_labels = _labels(G.colors)
+            changed = np.flatnonzero(new_labels != labels)
+            yield end, WindowDiff(changed, new_labels[changed])
+            labels = new_labels
+        else:
+            labels = _labels(G.colors)
+            yield end, G.colors
+
+        if exhausted and not pending:
+            return
+        end += stride
+
+
+def _take_before(chunks, time):
+    """
+    Removes the edges before a time from the front of a deque of chunks.
+
+    Returns:
+        list(tuple(ndarray)): the removed edges, as chunks
+    """
+    taken = []
+    while chunks:
+        receivers, senders, times, weights = chunks[0]
+        split = np.searchsorted(times, time, side='left')
+        if split == times.size:
+            taken.append(chunks.popleft())
+            continue
+        if split > 0:
+            taken.append((receivers[:split], senders[:split], times[:split],
+                          weights[:split]))
+            chunks[0] = (receivers[split:], senders[split:], times[split:],
+                         weights[split:])
+        break
+    return taken
+
+
+def _update_window(G, counts, entering, leaving, weighted, exact):
+    """
+    Applies the edges entering and leaving the window to the graph, in one
+    add_edges call with the change of every pair of nodes. An edge is in
+    the graph while the window holds at least one copy of it; counting the
+    copies also removes edges exactly, however their float weights add up.
+
+    Parameters:
+        counts (dict): maps every (receiver, sender) pair in the window to
+            its number of copies and the weight it has in G, and is updated
+            in place
+
+    Returns:
+        counts (dict): the updated counts
+    """
+    changes = {}
+    for sign, chunks in ((1, entering), (-1, leaving)):
+        for receivers, senders, _, weights in chunks:
+            for pair in zip(receivers.tolist(), senders.tolist(),
+                            weights.tolist()):
+                change = changes.setdefault(pair[:2], [0, 0.])
+                change[0] += sign
+                change[1] += sign*pair[2]
+
+    pairs, delta = [], []
+    for pair, (copies, weight) in changes.items():
+        before, total = counts.get(pair, (0, 0))
+        after = before + copies
+        if after == 0:
+            # the last copy left, whatever weight the pair had goes with it
+            counts.pop(pair, None)
+            change = -total
+        elif weighted:
+            change = weight
+        else:
+            change = int(before == 0)
+        if change != 0:
+            pairs.append(pair)
+            delta.append(change)
+        if after:
+            counts[pair] = (after, total + change)
+    if pairs:
+        G.add_edges(pairs, weights=delta, exact=exact)
+    return counts
+
+
+if __name__ == '__main__':
+    # e.g. python temporal.py ../data/scraping/radoslaw_email/out.radoslaw_email_email 604800 86400
+    filename = sys.argv[1]
+    window, stride = float(sys.argv[2]), float(sys.argv[3])
+    n = count_nodes(filename)
+    for end, colors in window_colorings(read_temporal_edges(filename), n,
+                                        window, stride):
+        print(f'{end:.0f}: {len(colors)} colors')
@@ -0,0 +1,7 @@
+# conftest.py
+import os
+import sys
+
+# the modules in core/ import each other by their flat names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'core'))
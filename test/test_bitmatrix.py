@@ -0,0 +1,57 @@
+# test_bitmatrix.py
+import numpy as np
+import pytest
+from scipy import sparse
+import refinement
+import sparse_specializer
+from bitmatrix import BitMatrix, bit_refinement, pack_rows
+from test_specialize import random_graph, same_partition
+
+
+@pytest.mark.parametrize('n', [1, 5, 63, 64, 65, 130])
+def test_bits_match_csr(n):
+    rng = np.random.default_rng(n)
+    A = random_graph(rng, n, p=0.4).astype(int)
+    csr = sparse.csr_matrix(A)
+    for B in (BitMatrix(A), BitMatrix(csr), BitMatrix.from_words(
+            pack_rows(A != 0), n)):
+        assert B.shape == (n, n)
+        assert (B.tocsr() != csr).nnz == 0
+        assert np.array_equal(np.asarray(B), A)
+        assert np.array_equal(B.in_degrees(), A.sum(axis=1))
+        assert B.nnz == csr.nnz
+
+
+def test_bits_need_a_binary_matrix():
+    with pytest.raises(ValueError):
+        BitMatrix(np.array([[0, 2], [1, 0]]))
+    with pytest.raises(ValueError):
+        BitMatrix(sparse.csr_matrix(np.array([[0, 1], [-1, 0]])))
+    with pytest.raises(ValueError):
+        BitMatrix(np.zeros((2, 3)))
+
+
+def test_bit_refinement_matches_csr():
+    rng = np.random.default_rng(0)
+    for _ in range(40):
+        n = int(rng.integers(1, 150))
+        A = sparse.csr_matrix(random_graph(rng, n, p=rng.uniform(0.05, 0.6)),
+                              dtype=int)
+        initial = rng.integers(0, 2, n)
+        for seed in (None, initial):
+            expected = refinement.equitable_coloring(A, initial=seed)
+            assert np.array_equal(bit_refinement(BitMatrix(A), seed),
+                                  expected)
+
+
+def test_bit_storage_coloring():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        n = int(rng.integers(1, 100))
+        A = random_graph(rng, n, p=0.5)
+        G = sparse_specializer.DirectedGraph(A, storage='bits')
+        H = sparse_specializer.DirectedGraph(A)
+        assert isinstance(G.A, BitMatrix)
+        G.coloring()
+        H.coloring()
+        assert same_partition(G.colors.color, H.colors.color)
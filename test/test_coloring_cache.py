@@ -0,0 +1,86 @@
+# test_coloring_cache.py
+import os
+import numpy as np
+import pytest
+from scipy import sparse
+import refinement
+import sparse_specializer
+from coloring_cache import ColoringCache
+from test_specialize import random_graph
+
+
+def random_matrix(seed, n=10):
+    rng = np.random.default_rng(seed)
+    return sparse.csr_matrix(random_graph(rng, n), dtype=int)
+
+
+def test_hits_and_misses(tmp_path):
+    cache = ColoringCache(str(tmp_path))
+    A = random_matrix(0)
+    colors = np.arange(A.shape[0]) % 3
+    assert cache.get(A) is None
+    cache.put(A, colors)
+    assert np.array_equal(cache.get(A), colors)
+
+    # the same graph in another format, with duplicate entries
+    coo = A.tocoo()
+    split = sparse.coo_matrix((np.concatenate((coo.data - 1,
+                                               np.ones(A.nnz, dtype=int))),
+                               (np.tile(coo.row, 2), np.tile(coo.col, 2))),
+                              shape=A.shape)
+    assert np.array_equal(cache.get(split), colors)
+
+    # other weights, other initial colors and other sizes miss
+    assert cache.get(2*A) is None
+    assert cache.get(A, colors) is None
+    assert cache.get(sparse.block_diag((A, A))) is None
+    cache.put(A, colors[::-1], colors)
+    assert np.array_equal(cache.get(A, colors), colors[::-1])
+    assert np.array_equal(cache.get(A), colors)
+
+    cache.clear()
+    assert cache.get(A) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    graphs = [random_matrix(seed) for seed in range(4)]
+    cache = ColoringCache(str(tmp_path))
+    cache.put(graphs[0], np.zeros(10, dtype=int))
+    # room for three entries
+    cache.max_bytes = 3*os.path.getsize(os.path.join(
+        str(tmp_path), os.listdir(str(tmp_path))[0]))
+    for A in graphs[1:3]:
+        cache.put(A, np.zeros(10, dtype=int))
+    # graph 1 was used the longest time ago, then 0, then 2
+    for time, A in zip((300, 100, 400), graphs[:3]):
+        path = cache._path(cache.key(A))
+        os.utime(path, (time, time))
+    cache.put(graphs[3], np.zeros(10, dtype=int))
+    assert [cache.get(A) is None for A in graphs] == [False, True, False,
+                                                      False]
+
+    # a hit counts as a use
+    for time, A in zip((100, 200, 300), (graphs[0], graphs[2], graphs[3])):
+        os.utime(cache._path(cache.key(A)), (time, time))
+    cache.get(graphs[0])
+    cache.put(graphs[1], np.zeros(10, dtype=int))
+    assert [cache.get(A) is None for A in graphs] == [False, False, True,
+                                                      False]
+
+
+def test_coloring_reads_the_cache(tmp_path, monkeypatch):
+    A = random_matrix(5, n=30)
+    G = sparse_specializer.DirectedGraph(A)
+    G.coloring(cache=str(tmp_path))
+    expected = G.colors.color
+
+    def refine(*args, **kwargs):
+        raise AssertionError('the coloring should come from the cache')
+    monkeypatch.setattr(refinement, 'equitable_coloring', refine)
+    H = sparse_specializer.DirectedGraph(A.copy())
+    H.coloring(cache=ColoringCache(str(tmp_path)))
+    assert np.array_equal(H.colors.color, expected)
+    # a seeded coloring is another entry
+    H = sparse_specializer.DirectedGraph(A.copy())
+    with pytest.raises(AssertionError):
+        H.coloring(seed=np.arange(30) % 2, cache=str(tmp_path))
@@ -0,0 +1,72 @@
+# test_fingerprint.py
+import numpy as np
+from scipy import sparse
+import sparse_specializer
+from fingerprint import fingerprint, FingerprintIndex
+from test_specialize import random_graph
+
+
+def permuted(A, rng):
+    p = rng.permutation(A.shape[0])
+    return sparse.csr_matrix(A)[p][:, p]
+
+
+def graphs(count, seed=0, weights=(1,)):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        A = sparse.csr_matrix(random_graph(rng, int(rng.integers(2, 15)),
+                                           weights=weights))
+        yield rng, A
+
+
+def test_fingerprint_permutation_invariant():
+    for weights in ((1,), (-1, 0.5, 2)):
+        for rng, A in graphs(40, weights=weights):
+            assert fingerprint(A) == fingerprint(permuted(A, rng))
+
+
+def test_fingerprint_separates_quotients():
+    # a directed 6-cycle and two directed triangles share their quotient,
+    # a directed path does not
+    six = sparse.csr_matrix(np.roll(np.eye(6), 1, axis=1))
+    two = sparse.block_diag([np.roll(np.eye(3), 1, axis=1)]*2).tocsr()
+    path = sparse.csr_matrix(np.eye(6, k=1))
+    assert fingerprint(six) == fingerprint(two)
+    assert fingerprint(six) != fingerprint(path)
+
+
+def test_method_ignores_current_colors():
+    for rng, A in graphs(30, seed=1):
+        G = sparse_specializer.DirectedGraph(A)
+        H = sparse_specializer.DirectedGraph(permuted(A, rng))
+        expected = fingerprint(A)
+        assert H.fingerprint() == expected
+
+        # a seeded coloring is finer than the coarsest one
+        G.coloring(seed=np.arange(G.n) % 2)
+        seeded = G.colors.color.copy()
+        assert G.fingerprint() == expected
+        assert np.array_equal(G.colors.color, seeded)
+
+        # so is a quasi-equitable one coarser
+        G.quasi_coloring(1.)
+        assert G.fingerprint() == expected
+
+        i, j = rng.choice(G.n, 2, replace=False)
+        if not G.A[i, j]:
+            G.coloring()
+            G.add_edges([(i, j)])
+            K = sparse_specializer.DirectedGraph(permuted(G.A, rng))
+            assert G.fingerprint() == K.fingerprint() == fingerprint(G.A)
+
+
+def test_fingerprint_index(tmp_path):
+    index = FingerprintIndex(str(tmp_path / 'index'))
+    assert 'abc' not in index and index.get('abc', 0) == 0
+    index.put('abc', ('graph', 1))
+    index.put('abc', ('other', 2))
+    assert 'abc' in index
+    assert index.get('abc') == ('other', 2)
+    # another process sees the same entries
+    assert FingerprintIndex(str(tmp_path / 'index')).keys() == ['abc']
+    assert len(index) == 1
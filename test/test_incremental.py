@@ -0,0 +1,167 @@
+# test_incremental.py
+import numpy as np
+import pytest
+from scipy import sparse
+import refinement
+import sparse_specializer
+from test_specialize import random_graph, same_partition
+
+
+def refines(fine, coarse):
+    # every cell of fine lies inside a cell of coarse
+    return len(set(zip(fine, coarse))) == len(set(fine))
+
+
+def recolored(G):
+    H = sparse_specializer.DirectedGraph(G.A.copy(), weighted=True)
+    H.coloring()
+    return H.colors.color
+
+
+def random_updates(seed, n=12, weights=(1,)):
+    """
+    Returns:
+        rng (np.random.Generator): generator for the changes to make
+        G (DirectedGraph): a colored random graph, weighted unless all the
+            weights are 1
+    """
+    rng = np.random.default_rng(seed)
+    A = random_graph(rng, n, p=0.2, weights=weights)
+    G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A),
+                                         weighted=weights != (1,))
+    G.coloring()
+    return rng, G
+
+
+@pytest.mark.parametrize('weights', [(1,), (1, 2), (-1, 0.5, 2)])
+def test_exact_updates_match_recoloring(weights):
+    for seed in range(8):
+        rng, G = random_updates(seed, weights=weights)
+        for _ in range(25):
+            present = np.column_stack(sparse.find(G.A)[:2])
+            if present.size and rng.random() < 0.4:
+                edges = present[rng.choice(len(present),
+                                           min(len(present), 2),
+                                           replace=False)]
+                G.remove_edges(edges, exact=True)
+            else:
+                i, j = rng.choice(G.n, 2, replace=False)
+                G.add_edges([(i, j)], weights=[rng.choice(weights)],
+                            exact=True)
+            assert same_partition(G.colors.color, recolored(G))
+
+
+def test_local_updates_stay_equitable():
+    for seed in range(8):
+        rng, G = random_updates(seed)
+        for _ in range(25):
+            i, j = rng.choice(G.n, 2, replace=False)
+            if G.A[i, j]:
+                G.remove_edges([(i, j)], exact=False)
+            else:
+                G.add_edges([(i, j)], exact=False)
+            colors = G.colors.color
+            assert not refinement.equitability_violations(G.A, colors)
+            # equitable, so at least as fine as the coarsest partition
+            assert refines(colors, recolored(G))
+
+
+def test_default_updates_match_coloring():
+    for seed in range(8):
+        rng, G = random_updates(seed)
+        for _ in range(25):
+            edges = [tuple(e) for e in rng.choice(G.n, (3, 2))
+                     if e[0] != e[1]]
+            present = [(i, j) for i, j in edges if G.A[i, j]]
+            if present and rng.random() < 0.5:
+                G.remove_edges(present[:1])
+            else:
+                G.add_edges(edges)
+            assert same_partition(G.colors.color, recolored(G))
+
+
+def test_local_update_restored_by_exact_update():
+    # adding the missing edge of a directed triangle leaves the three
+    # cells apart until the quotient is refined
+    A = sparse.csr_matrix(np.array([[0, 0, 1], [1, 0, 0], [0, 0, 0]]))
+    G = sparse_specializer.DirectedGraph(A)
+    G.coloring()
+    G.add_edges([(2, 1)], exact=False)
+    assert len(G.colors) == 3
+    G.remove_edges([(2, 1)], exact=False)
+    G.add_edges([(2, 1)])
+    assert len(G.colors) == 1
+
+
+def random_steps(rng, G, steps=20, weights=(1,)):
+    # random insertions and removals, some of them exact
+    for _ in range(steps):
+        i, j = rng.choice(G.n, 2, replace=False)
+        exact = bool(rng.random() < 0.3)
+        if G.A[i, j] and rng.random() < 0.5:
+            G.remove_edges([(i, j)], exact=exact)
+        else:
+            G.add_edges([(i, j)], weights=[rng.choice(weights)], exact=exact)
+        yield exact
+
+
+def test_seeded_updates_keep_seed():
+    weights = (1, 2, -1, 0.5)
+    for seed in range(40):
+        rng, G = random_updates(seed, weights=weights)
+        key = rng.integers(0, 2, G.n)
+        G.coloring(seed=list(key))
+        for exact in random_steps(rng, G, weights=weights):
+            H = sparse_specializer.DirectedGraph(G.A.copy(), weighted=True)
+            H.coloring(seed=list(key))
+            colors = G.colors.color
+            assert refines(colors, key)
+            assert not refinement.equitability_violations(G.A, colors)
+            assert refines(colors, H.colors.color)
+            if exact:
+                assert same_partition(colors, H.colors.color)
+
+
+def test_updates_keep_tol():
+    weights = (1, 1.1, -0.9, 0.25)
+    for seed in range(40):
+        rng, G = random_updates(seed, weights=weights)
+        G.coloring(tol=0.5)
+        for exact in random_steps(rng, G, weights=weights):
+            H = sparse_specializer.DirectedGraph(G.A.copy(), weighted=True)
+            H.coloring(tol=0.5)
+            colors = G.colors.color
+            assert not refinement.equitability_violations(
+                refinement.integer_weights(G.A, 0.5), colors)
+            assert refines(colors, H.colors.color)
+            if exact:
+                assert same_partition(colors, H.colors.color)
+
+
+def test_quasi_and_typed_colorings_are_recomputed():
+    for seed in range(20):
+        rng, G = random_updates(seed, weights=(1, 2))
+        G.quasi_coloring(0.6)
+        for _ in random_steps(rng, G, steps=5):
+            H = sparse_specializer.DirectedGraph(G.A.copy(), weighted=True)
+            H.quasi_coloring(0.6)
+            assert same_partition(G.colors.color, H.colors.color)
+
+        types = lambda i, j: int(i) % 2
+        G.coloring(edge_key=types)
+        for _ in random_steps(rng, G, steps=5):
+            H = sparse_specializer.DirectedGraph(G.A.copy(), weighted=True)
+            H.coloring(edge_key=types)
+            assert same_partition(G.colors.color, H.colors.color)
+
+
+def test_updates_with_finer_weights():
+    # 0.125 needs a finer scale than the weights so far
+    A = sparse.csr_matrix(np.array([[0, 1, 0], [0, 0, 1], [1, 0, 0]]))
+    G = sparse_specializer.DirectedGraph(A)
+    G.coloring()
+    G.add_edges([(0, 1), (1, 2), (2, 0)], weights=[0.125]*3, exact=True)
+    assert len(G.colors) == 1
+    assert np.allclose(G.A.toarray(), 1.125*A.toarray())
+    G.add_edges([(0, 1)], weights=[0.125], exact=False)
+    assert len(G.colors) == 3
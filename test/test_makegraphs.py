@@ -0,0 +1,56 @@
+# test_makegraphs.py
+import os
+import pickle
+import numpy as np
+import refinement
+from coloring_cache import ColoringCache
+from fingerprint import FingerprintIndex
+from mpi_makegraphs import color_graph
+
+
+def write_edges(path, edges):
+    # a KONECT edge list, which starts with its format
+    with open(path, 'w') as f:
+        f.write('% asym unweighted\n')
+        for i, j in edges:
+            f.write(f'{i} {j}\n')
+    return str(path)
+
+
+def test_rerun_does_no_refinement(tmp_path, monkeypatch):
+    calls = []
+    equitable_coloring = refinement.equitable_coloring
+    monkeypatch.setattr(refinement, 'equitable_coloring',
+                        lambda *args, **kwargs: calls.append(1) or
+                        equitable_coloring(*args, **kwargs))
+    rng = np.random.default_rng(0)
+    edges = [(i, j) for i, j in rng.integers(1, 30, (60, 2)) if i != j]
+    graph = write_edges(tmp_path / 'out.graph', edges)
+    # the same graph with its nodes renumbered
+    perm = np.concatenate(([0], rng.permutation(29) + 1))
+    mirror = write_edges(tmp_path / 'out.mirror',
+                         [(perm[i], perm[j]) for i, j in edges])
+    colorings = tmp_path / 'colorings'
+    os.makedirs(colorings)
+
+    def run(path):
+        # every run opens the cache and the index anew
+        return color_graph(path, ColoringCache(str(tmp_path / 'cache')),
+                           FingerprintIndex(str(tmp_path / 'index')),
+                           colorings=str(colorings))
+
+    assert run(graph) == 'colored'
+    assert len(calls) == 1
+    with open(colorings / 'out.graph-coloring', 'rb') as f:
+        first = pickle.load(f)
+
+    assert run(graph) == 'saved'
+    assert len(calls) == 1
+    assert run(mirror) == 'duplicate'
+    with open(colorings / 'out.mirror-same-as') as f:
+        assert f.read().strip() == 'out.graph-coloring'
+    # the mirror is colored once, and only once
+    assert run(mirror) == 'duplicate'
+    assert len(calls) == 2
+    with open(colorings / 'out.graph-coloring', 'rb') as f:
+        assert pickle.load(f) == first
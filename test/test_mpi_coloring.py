@@ -0,0 +1,49 @@
+# test_mpi_coloring.py
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pytest
+from scipy import sparse
+import refinement
+from mpi_coloring import scatter_rows, mpi_coloring
+from test_specialize import random_graph
+
+
+def test_single_rank_matches_serial():
+    # without mpi4py, or on one rank, the whole graph is local
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        n = int(rng.integers(1, 30))
+        A = sparse.csr_matrix(random_graph(rng, n, weights=(1, 2)), dtype=int)
+        initial = rng.integers(0, 3, n)
+        A_local, first, size = scatter_rows(A)
+        assert (first, size) == (0, n)
+        for seed in (None, initial):
+            expected = refinement.signature_refinement(
+                A.indptr, A.indices, A.data, n, seed)
+            colors = mpi_coloring(A_local, first, n, initial=seed,
+                                  gather=True)
+            assert np.array_equal(colors, expected)
+
+
+@pytest.mark.parametrize('ranks', [2, 4])
+def test_ranks_match_serial(ranks):
+    pytest.importorskip('mpi4py')
+    mpiexec = shutil.which('mpiexec')
+    if mpiexec is None:
+        pytest.skip('mpiexec is not installed')
+    # Open MPI refuses to run as root or on more ranks than cores unless
+    # told to; other implementations ignore these
+    env = dict(os.environ, OMPI_ALLOW_RUN_AS_ROOT='1',
+               OMPI_ALLOW_RUN_AS_ROOT_CONFIRM='1',
+               OMPI_MCA_rmaps_base_oversubscribe='1')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          'core', 'mpi_coloring.py')
+    run = subprocess.run([mpiexec, '-n', str(ranks), sys.executable, script,
+                          '3000', '2'], capture_output=True, text=True,
+                         env=env, timeout=300)
+    assert run.returncode == 0, run.stderr
+    assert f'{ranks} ranks:' in run.stdout
+    assert 'matches serial: True' in run.stdout
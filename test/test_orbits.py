@@ -0,0 +1,130 @@
+# test_orbits.py
+import itertools
+import numpy as np
+import pytest
+import networkx as nx
+from scipy import sparse
+import orbits
+import refinement
+
+
+def brute_force_orbits(A, initial):
+    # every permutation preserving the colors and the edges
+    A = sparse.csr_matrix(A).toarray()
+    n = A.shape[0]
+    labels = np.arange(n)
+    for perm in itertools.permutations(range(n)):
+        perm = np.array(perm)
+        if (np.array_equal(initial[perm], initial)
+                and np.array_equal(A[np.ix_(perm, perm)], A)):
+            for i in range(n):
+                labels[labels == labels[perm[i]]] = labels[i]
+    return refinement.canonical_colors(labels)
+
+
+def relabeled(G, seed):
+    A = sparse.csr_matrix(nx.to_scipy_sparse_array(
+        nx.convert_node_labels_to_integers(G), dtype=int))
+    perm = np.random.default_rng(seed).permutation(A.shape[0])
+    return A[perm][:, perm]
+
+
+def cycles_on_tree(branching, depth):
+    # a balanced tree with a 5-cycle hanging from every leaf, which leaves
+    # nothing to peel or merge
+    T = nx.balanced_tree(branching, depth)
+    n = T.number_of_nodes()
+    for leaf in [v for v in T if T.degree(v) == 1]:
+        nx.add_cycle(T, range(n, n + 5))
+        T.add_edge(leaf, n)
+        n += 5
+    return T
+
+
+@pytest.mark.parametrize('kind', ['undirected', 'directed', 'weighted',
+                                  'colored'])
+def test_matches_brute_force(kind):
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        n = int(rng.integers(1, 7))
+        A = (rng.random((n, n)) < rng.uniform(0.1, 0.6)).astype(int)
+        np.fill_diagonal(A, 0)
+        if kind == 'undirected':
+            A = np.triu(A, 1)
+            A = A + A.T
+        elif kind == 'weighted':
+            A *= rng.integers(1, 3, (n, n))
+            np.fill_diagonal(A, rng.integers(0, 2, n))
+        initial = (rng.integers(0, 2, n) if kind == 'colored'
+                   else np.zeros(n, dtype=int))
+        assert np.array_equal(orbits.orbit_coloring(sparse.csr_matrix(A),
+                                                    initial),
+                              brute_force_orbits(A, initial))
+
+
+def test_hanging_trees_match_brute_force():
+    rng = np.random.default_rng(1)
+    for seed in range(30):
+        # a small tree, hanging from a triangle by one or two nodes
+        T = nx.random_labeled_tree(int(rng.integers(1, 5)), seed=seed)
+        G = nx.disjoint_union(nx.cycle_graph(3), T)
+        G.add_edge(0, 3)
+        if seed % 2:
+            G.add_edge(1, G.number_of_nodes() - 1)
+        A = nx.to_scipy_sparse_array(G, dtype=int).toarray()
+        # random directions and weights on the edges
+        A = np.triu(A * rng.integers(1, 3, A.shape), 1)
+        A = A + np.where(rng.random(A.shape) < 0.5, A, 0).T
+        initial = np.zeros(A.shape[0], dtype=int)
+        assert np.array_equal(orbits.orbit_coloring(sparse.csr_matrix(A)),
+                              brute_force_orbits(A, initial))
+
+
+@pytest.mark.parametrize('G, num_orbits', [
+    (nx.petersen_graph(), 1), (nx.hypercube_graph(4), 1),
+    (nx.cycle_graph(30), 1), (nx.frucht_graph(), 12),
+    (nx.grid_2d_graph(5, 6), 9), (nx.lollipop_graph(5, 4), 6),
+    (cycles_on_tree(2, 4), 8)])
+def test_known_orbits(G, num_orbits):
+    colors = orbits.orbit_coloring(relabeled(G, 2))
+    assert colors.max() + 1 == num_orbits
+
+
+def test_orbits_are_equitable():
+    A = relabeled(cycles_on_tree(3, 2), 3)
+    colors = orbits.orbit_coloring(A)
+    assert not refinement.equitability_violations(A, colors)
+
+
+def test_trees_need_no_search(monkeypatch):
+    # the ternary tree of depth 8 took minutes when every individualization
+    # refined the whole graph; peeling leaves nothing to search
+    calls = []
+    individualize = orbits._Coloring.individualize
+    monkeypatch.setattr(orbits._Coloring, 'individualize',
+                        lambda *args: calls.append(1) or individualize(*args))
+    T = nx.balanced_tree(3, 8)
+    depth = nx.single_source_shortest_path_length(T, 0)
+    A = relabeled(T, 4)
+    perm = np.random.default_rng(4).permutation(A.shape[0])
+    colors = orbits.orbit_coloring(A)
+    expected = refinement.canonical_colors(
+        np.array([depth[v] for v in perm]))
+    assert np.array_equal(colors, expected)
+    assert not calls
+
+
+def test_search_scales_with_the_graph(monkeypatch):
+    # the search only descends where two branches differ, so the number of
+    # individualizations grows about like n log n rather than n^2
+    calls = []
+    individualize = orbits._Coloring.individualize
+    monkeypatch.setattr(orbits._Coloring, 'individualize',
+                        lambda *args: calls.append(1) or individualize(*args))
+    counts = []
+    for depth in (4, 6):
+        calls.clear()
+        orbits.orbit_coloring(relabeled(cycles_on_tree(2, depth), 5))
+        counts.append(len(calls))
+    # four times the nodes
+    assert counts[1] < 8*counts[0]
@@ -0,0 +1,87 @@
+# test_partition.py
+import pickle
+import numpy as np
+import pytest
+from partition import Partition
+
+
+def test_labels_are_renumbered():
+    P = Partition(np.array([7, -3, 7, 40, -3, 7]))
+    # in increasing order of the labels
+    assert P.color.tolist() == [1, 0, 1, 2, 0, 1]
+    assert P.color.dtype == np.int32
+    assert P.n == 6 and len(P) == 3
+    assert P.order.tolist() == [1, 4, 0, 2, 5, 3]
+    assert P.offsets.tolist() == [0, 2, 5, 6]
+    assert [P[color].tolist() for color in P] == [[1, 4], [0, 2, 5], [3]]
+    assert Partition(np.array([5, 5, 2])) == Partition(np.array([1, 1, 0]))
+    with pytest.raises(ValueError):
+        Partition(np.zeros((2, 2)))
+
+
+def test_sizes_and_lookups():
+    P = Partition([2, 0, 2, 1, 2])
+    assert [P.size(color) for color in P] == [1, 1, 3]
+    assert P.sizes().tolist() == [1, 1, 3]
+    assert P.sizes().sum() == P.n
+    assert P.color_of(4) == 2
+    assert P.color_of(np.array([0, 1, 3])).tolist() == [2, 0, 1]
+    assert P[2].tolist() == [0, 2, 4]
+    assert P[np.int64(1)].tolist() == [3]
+    for color in (-1, 3, 'a', None):
+        with pytest.raises(KeyError):
+            P[color]
+    assert 2 in P and 3 not in P and -1 not in P
+
+
+def test_dict_round_trip():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        n = int(rng.integers(1, 30))
+        P = Partition(rng.integers(0, 5, n))
+        cells = P.to_dict()
+        assert set(cells) == set(range(len(P)))
+        assert Partition.from_dict(cells, n) == P
+        # to_dict hands out copies
+        cells[0][:] = -1
+        assert (P[0] >= 0).all()
+
+    # any color labels, any order of the nodes in a cell
+    P = Partition.from_dict({10: [3, 1], 4: [0], 7: [2, 4]}, 5)
+    assert P.color.tolist() == [0, 2, 1, 2, 1]
+
+
+@pytest.mark.parametrize('cells', [
+    {0: [0, 1], 1: [1, 2]},     # overlapping
+    {0: [0, 1]},                # incomplete
+    {0: [0, 1], 1: [2, 2]},     # repeated node
+])
+def test_from_dict_needs_a_partition(cells):
+    with pytest.raises(ValueError):
+        Partition.from_dict(cells, 3)
+
+
+def test_equality():
+    P = Partition([0, 1, 0, 2])
+    assert P == Partition([5, 6, 5, 9])
+    assert P != Partition([0, 1, 1, 2])
+    assert P != Partition([0, 1, 0])
+    # the old dict format, whose cells need not be sorted
+    assert P == {0: np.array([2, 0]), 1: [1], 2: [3]}
+    assert P != {0: [0, 2], 1: [1, 3]}
+    assert P != {0: [0, 2], 1: [3], 2: [1]}
+    assert P != {0: [0, 2], 1: [1], 5: [3]}
+    assert P != [0, 1, 0, 2]
+    with pytest.raises(TypeError):
+        hash(P)
+
+
+def test_pickle():
+    P = Partition(np.random.default_rng(1).integers(0, 50, 1000))
+    Q = pickle.loads(pickle.dumps(P))
+    assert Q == P
+    for name in ('color', 'order', 'offsets'):
+        assert np.array_equal(getattr(Q, name), getattr(P, name))
+        assert getattr(Q, name).dtype == getattr(P, name).dtype
+    # only the colors are pickled
+    assert len(pickle.dumps(P)) < P.color.nbytes + P.order.nbytes
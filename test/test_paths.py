@@ -0,0 +1,104 @@
+# test_paths.py
+import numpy as np
+import pytest
+import networkx as nx
+from scipy import sparse
+import paths
+import sparse_specializer
+from test_specialize import random_cases, cycle
+
+
+def fixed_point(inner, start):
+    # X = start + inner @ X, iterated to its fixed point
+    X = np.array(start, dtype=float)
+    for _ in range(inner.shape[0] + 1):
+        X = start + inner @ X
+    return X
+
+
+def random_dag(rng, c, m=2):
+    order = rng.permutation(c)
+    inner = sparse.random(c, c, density=0.2, random_state=rng,
+                          data_rvs=lambda k: rng.integers(1, 4, k)).tocsr()
+    inner = sparse.triu(inner, 1).tocsr()[order][:, order]
+    return inner.tocsr(), rng.integers(0, 3, (c, m))
+
+
+def test_accumulate_matches_fixed_point():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        inner, start = random_dag(rng, int(rng.integers(1, 30)))
+        assert np.allclose(paths._accumulate(inner, start),
+                           fixed_point(inner, start))
+
+
+def test_topological_order_fallback(monkeypatch):
+    # labels that are not a topological order are replaced by a sort
+    rng = np.random.default_rng(1)
+    c = 20
+    monkeypatch.setattr(sparse.csgraph, 'connected_components',
+                        lambda A, connection: (c, np.arange(c)))
+    for _ in range(20):
+        inner, start = random_dag(rng, c)
+        order = paths._topological_order(inner)
+        position = np.empty(c, dtype=int)
+        position[order] = np.arange(c)
+        rows, cols = inner.nonzero()
+        assert np.all(position[cols] < position[rows])
+        assert np.allclose(paths._accumulate(inner, start),
+                           fixed_point(inner, start))
+
+
+def test_accumulate_rejects_cycles():
+    inner = sparse.csr_matrix(np.array([[0, 1], [1, 0]]))
+    with pytest.raises(ValueError):
+        paths._accumulate(inner, np.ones((2, 1)))
+
+
+def test_accumulate_overflows_to_inf():
+    # 2^k paths along a ladder of k doubled links
+    c = 1200
+    inner = sparse.csr_matrix((np.full(c - 1, 2.), (np.arange(c - 1),
+                                                    np.arange(1, c))),
+                              shape=(c, c))
+    start = np.zeros((c, 1))
+    start[-1] = 1
+    X = paths._accumulate(inner, start).ravel()
+    assert np.array_equal(X[-1000:], 2.**np.arange(999, -1, -1))
+    assert np.all(np.isinf(X[:c - 1024]))
+
+
+def test_specialization_size_matches_specialize():
+    for A, base in random_cases(150, seed=5):
+        G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A))
+        size = paths.specialization_size(G.A, base)
+        G.specialize(list(base))
+        assert size == (G.n, G.A.nnz)
+
+
+def test_specialization_size_long_cycle():
+    n = 50000
+    assert paths.specialization_size(cycle(n), [0]) == (n, n)
+
+
+def test_base_paths_match_simple_paths():
+    for A, base in random_cases(60, seed=6):
+        G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A))
+        G._base_first(list(base))
+        smallA, comp = G._compress_graph(len(base))
+        found = sorted(tuple(p) for p in paths.base_paths(smallA,
+                                                          len(base)))
+        # paths through at least one component of the compressed graph,
+        # with b2 copied to a sink so cycles are paths too
+        D = nx.DiGraph(sparse.csr_matrix(smallA).T)
+        b, N = len(base), smallA.shape[0]
+        expected = []
+        for b1 in range(b):
+            for b2 in range(b):
+                H = nx.DiGraph(D.subgraph([b1] + list(range(b, N))))
+                H.remove_edges_from(list(nx.selfloop_edges(H)))
+                H.add_edges_from((u, 'end') for u in D.predecessors(b2)
+                                 if u >= b)
+                expected += [tuple(p[:-1]) + (b2,) for p in
+                             nx.all_simple_paths(H, b1, 'end') if len(p) > 2]
+        assert found == sorted(expected)
@@ -0,0 +1,67 @@
+# test_quotient.py
+import numpy as np
+import pytest
+from scipy import sparse
+import specializer
+import sparse_specializer
+from partition import Partition
+from test_specialize import random_graph
+
+
+def dense_quotient(A, colors):
+    # D^-1 P^T A P with the dense indicator matrix
+    P = np.eye(colors.max() + 1)[colors]
+    return np.diag(1 / P.sum(axis=0)) @ P.T @ A @ P
+
+
+@pytest.mark.parametrize('weights', [(1,), (-1, 0.5, 2)])
+def test_quotient_matches_triple_product(weights):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        n = int(rng.integers(1, 15))
+        A = random_graph(rng, n, weights=weights)
+        # any partition, equitable or not
+        colors = np.unique(rng.integers(0, 4, n), return_inverse=True)[1]
+        B = Partition(colors).quotient(sparse.csr_matrix(A))
+        assert isinstance(B, sparse.csr_matrix)
+        assert np.allclose(B.toarray(), dense_quotient(A, colors))
+
+
+@pytest.mark.parametrize('module', [specializer, sparse_specializer])
+def test_equitable_quotient_lifts(module):
+    rng = np.random.default_rng(1)
+    for _ in range(40):
+        n = int(rng.integers(2, 15))
+        A = random_graph(rng, n, p=rng.uniform(0.1, 0.4))
+        G = (module.DirectedGraph(A, None) if module is specializer
+             else module.DirectedGraph(sparse.csr_matrix(A)))
+        G.coloring()
+        B = G.quotient().toarray()
+        colors = G.colors.color
+        P = np.eye(B.shape[0])[colors]
+        # every node receives exactly B[c, d] from color d
+        assert np.allclose(A @ P, P @ B)
+        radius = np.max(np.abs(np.linalg.eigvals(A)))
+        assert np.isclose(np.max(np.abs(np.linalg.eigvals(B)), initial=0),
+                          radius)
+
+
+def test_quotient_centrality_matches_eig():
+    rng = np.random.default_rng(2)
+    checked = 0
+    for _ in range(40):
+        n = int(rng.integers(2, 15))
+        A = random_graph(rng, n, p=0.3)
+        values = np.sort(np.linalg.eigvals(A + np.eye(n)).real)
+        # the dominant eigenvector is unique up to a multiple when the
+        # dominant eigenvalue is simple
+        if values[-1] - values[-2] < 1e-3:
+            continue
+        G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A))
+        exact = G.structural_eigen_centrality()
+        lifted = G.structural_eigen_centrality(method='quotient')
+        assert exact.keys() == lifted.keys()
+        assert np.allclose([exact[k] for k in exact],
+                           [lifted[k] for k in exact])
+        checked += 1
+    assert checked >= 10
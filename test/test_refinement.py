@@ -0,0 +1,300 @@
+# test_refinement.py
+import numpy as np
+import pytest
+from scipy import sparse
+import refinement
+import specializer
+import sparse_specializer
+from partition import Partition
+from test_specialize import random_graph, same_partition
+from test_incremental import refines
+
+
+def pairwise_cases(count, seed=0, max_n=16):
+    """
+    Yields:
+        rng (np.random.Generator): generator for anything else the test needs
+        A (sparse.csr_matrix): a random graph of random density
+        colors (ndarray): its coloring by the original pairwise refinement
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        n = int(rng.integers(1, max_n))
+        A = sparse.csr_matrix(random_graph(rng, n, p=rng.uniform(0.05, 0.5)),
+                              dtype=int)
+        G = sparse_specializer.DirectedGraph(A)
+        G.coloring(engine='pairwise')
+        yield rng, A, G.colors.color
+
+
+def engine_colors(A, engine, **options):
+    G = sparse_specializer.DirectedGraph(A)
+    G.coloring(engine=engine, **options)
+    return G.colors.color
+
+
+def test_worklist_matches_pairwise():
+    for _, A, expected in pairwise_cases(80):
+        colors = engine_colors(A, 'worklist')
+        assert same_partition(colors, expected)
+        assert np.array_equal(colors, refinement.canonical_colors(colors))
+
+
+def test_worklist_refines_initial():
+    for rng, A, expected in pairwise_cases(40, seed=1):
+        A = sparse.csc_matrix(A)
+        n = A.shape[0]
+        initial = rng.integers(0, 3, n)
+        colors = refinement.worklist_refinement(A.indptr, A.indices, A.data,
+                                                n, initial)
+        assert refines(colors, initial)
+        assert not refinement.equitability_violations(A, colors)
+        # the coarsest equitable partition is already equitable
+        colors = refinement.worklist_refinement(A.indptr, A.indices, A.data,
+                                                n, expected)
+        assert same_partition(colors, expected)
+
+
+def test_vectorized_matches_pairwise():
+    for _, A, expected in pairwise_cases(80, seed=2):
+        assert same_partition(engine_colors(A, 'vectorized'), expected)
+
+
+def test_signature_colors_follow_the_nodes():
+    # the colors are ranks of structural hashes, so renumbering the nodes
+    # renumbers the colors with them
+    for rng, A, _ in pairwise_cases(40, seed=3):
+        n = A.shape[0]
+        initial = rng.integers(0, 2, n)
+        colors = refinement.signature_refinement(A.indptr, A.indices, A.data,
+                                                 n, initial)
+        p = rng.permutation(n)
+        B = A[p][:, p]
+        permuted = refinement.signature_refinement(B.indptr, B.indices,
+                                                   B.data, n, initial[p])
+        assert np.array_equal(permuted, colors[p])
+        assert same_partition(colors, engine_colors(A, 'worklist',
+                                                    seed=list(initial)))
+
+
+def test_numba_matches_pairwise():
+    pytest.importorskip('numba')
+    for rng, A, expected in pairwise_cases(40, seed=15):
+        assert same_partition(engine_colors(A, 'numba'), expected)
+        initial = rng.integers(0, 2, A.shape[0])
+        assert np.array_equal(
+            engine_colors(A, 'numba', seed=list(initial)),
+            engine_colors(A, 'worklist', seed=list(initial)))
+
+
+def test_parallel_matches_pairwise():
+    # every call starts a pool, so a few graphs
+    for _, A, expected in pairwise_cases(5, seed=4):
+        assert same_partition(engine_colors(A, 'parallel', workers=2),
+                              expected)
+
+
+def test_parallel_matches_signature_refinement():
+    rng = np.random.default_rng(5)
+    n = 3000
+    A = sparse.random(n, n, density=2/n, format='csr', random_state=6,
+                      data_rvs=lambda k: rng.integers(1, 3, k))
+    initial = rng.integers(0, 2, n)
+    expected = refinement.signature_refinement(A.indptr, A.indices, A.data, n,
+                                               initial, trace=True)
+    colors = refinement.parallel_refinement(A.indptr, A.indices, A.data, n,
+                                            initial, workers=3, trace=True)
+    assert np.array_equal(colors[0], expected[0])
+    assert np.array_equal(colors[1].colors, expected[1].colors)
+
+
+def dense_violations(A, colors, tol=0):
+    # the inputs from every cell to every node, compared cell by cell
+    A = sparse.csr_matrix(A).toarray()
+    k = colors.max() + 1
+    M = A @ np.eye(k)[colors]
+    return [(c, d, M[colors == c, d].min(), M[colors == c, d].max())
+            for c in range(k) for d in range(k)
+            if np.ptp(M[colors == c, d]) > tol]
+
+
+@pytest.mark.parametrize('weights', [(1,), (-1, 0.5, 2)])
+def test_violations_match_dense_check(weights):
+    rng = np.random.default_rng(7)
+    for _ in range(60):
+        n = int(rng.integers(1, 15))
+        A = random_graph(rng, n, weights=weights)
+        colors = refinement.canonical_colors(rng.integers(0, 3, n))
+        violations = refinement.equitability_violations(A, colors)
+        assert [tuple(v) for v in violations] == dense_violations(A, colors)
+        assert (refinement.equitability_violations(A, colors, tol=1)
+                == [v for v in violations if v.high - v.low > 1])
+
+
+def test_color_checker():
+    for _, A, _ in pairwise_cases(20, seed=8):
+        G = sparse_specializer.DirectedGraph(A)
+        G.coloring()
+        assert G.color_checker() and not G.equitability_violations()
+        # merging two cells of the coarsest partition breaks it
+        if G.colors.color.max() > 0:
+            merged = np.where(G.colors.color == 1, 0, G.colors.color)
+            G.colors = Partition(refinement.canonical_colors(merged))
+            assert not G.color_checker()
+
+
+def test_weighted_coloring_matches_scaled_pairwise():
+    # the signed binary fractions are integers after doubling, which the
+    # pairwise refinement compares exactly
+    rng = np.random.default_rng(9)
+    for _ in range(40):
+        n = int(rng.integers(1, 16))
+        A = random_graph(rng, n, weights=(-1, 0.5, 2))
+        G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A),
+                                             weighted=True)
+        G.coloring()
+        expected = engine_colors(sparse.csr_matrix(2*A, dtype=int),
+                                 'pairwise')
+        assert same_partition(G.colors.color, expected)
+
+
+def test_integer_weights_keep_the_matrix():
+    A = sparse.csr_matrix(np.array([[0, 0.25, 1e-3],
+                                    [1.5, 0, -0.75],
+                                    [0, 3, 0]]))
+    before = A.copy()
+    B = refinement.integer_weights(A)
+    shift = refinement.weight_shift(A.data)
+    assert np.array_equal(B.toarray(), np.ldexp(A.toarray(), shift))
+    # rounding to multiples of tol drops the smallest weight from B only
+    B = refinement.integer_weights(A, tol=0.25)
+    assert np.array_equal(B.toarray(), [[0, 1, 0], [6, 0, -3], [0, 12, 0]])
+    assert B.nnz == 4
+    assert (A != before).nnz == 0 and A.nnz == 5
+    with pytest.raises(OverflowError):
+        refinement.integer_weights(A * 2.**62)
+
+
+def test_tol_merges_noisy_weights():
+    # one node sends 1 and 1 + 1e-9 to two others
+    A = sparse.csr_matrix(np.array([[0, 0, 0], [1, 0, 0], [1 + 1e-9, 0, 0]]))
+    G = sparse_specializer.DirectedGraph(A, weighted=True)
+    G.coloring()
+    assert len(G.colors) == 3
+    G.coloring(tol=1e-6)
+    assert len(G.colors) == 2
+    H = specializer.DirectedGraph(A.toarray(), None)
+    H.coloring(tol=1e-6)
+    assert same_partition(H.colors.color, G.colors.color)
+
+
+def test_trace_rounds_are_signature_passes():
+    for rng, A, expected in pairwise_cases(40, seed=10):
+        n = A.shape[0]
+        initial = rng.integers(0, 2, n)
+        colors, trace = refinement.equitable_coloring(
+            A, 'vectorized', initial=initial, trace=True)
+        rounds = trace.colors.astype(int)
+        assert rounds.shape[1] == n and len(trace.parents) == len(rounds)
+        assert same_partition(rounds[0], initial)
+        assert np.array_equal(rounds[-1], colors)
+        assert np.all(trace.parents[0] == -1)
+        for previous, current, parents in zip(rounds[:-1], rounds[1:],
+                                              trace.parents[1:]):
+            # every round is one more pass, and splits some cell
+            assert np.array_equal(
+                refinement._signature_pass(A, previous)[0], current)
+            assert current.max() > previous.max()
+            assert np.array_equal(parents[current], previous)
+
+
+@pytest.mark.parametrize('module', [specializer, sparse_specializer])
+def test_coloring_keeps_the_trace(module):
+    for _, A, expected in pairwise_cases(20, seed=11):
+        G = (module.DirectedGraph(A.toarray(), None) if module is specializer
+             else module.DirectedGraph(A))
+        G.coloring(trace=True)
+        assert same_partition(G.colors.color, expected)
+        assert np.array_equal(G.trace.colors[-1], G.colors.color)
+        G.coloring()
+        assert G.trace is None
+        with pytest.raises(ValueError):
+            G.coloring(engine='worklist', trace=True)
+
+
+@pytest.mark.parametrize('eps', [0.25, 1, 2.5])
+def test_quasi_equitable_error_bound(eps):
+    rng = np.random.default_rng(12)
+    for _ in range(40):
+        n = int(rng.integers(1, 20))
+        A = random_graph(rng, n, p=0.4, weights=(-1, 0.5, 1, 2))
+        colors, error = refinement.quasi_equitable_coloring(A, eps)
+        assert error <= eps
+        assert not dense_violations(A, colors, tol=eps)
+        # the error is the largest spread of the inputs of a cell
+        spreads = [high - low for _, _, low, high in
+                   dense_violations(A, colors)]
+        assert np.isclose(error, max(spreads, default=0))
+
+
+def test_quasi_equitable_without_eps_is_equitable():
+    for _, A, expected in pairwise_cases(30, seed=13):
+        colors, error = refinement.quasi_equitable_coloring(A, 0)
+        assert error == 0
+        assert same_partition(colors, expected)
+
+
+def test_quasi_coloring_ignores_noise():
+    # a directed cycle whose weights are 1 up to noise below 0.01 has no
+    # exact symmetry left, but one quasi-equitable cell
+    rng = np.random.default_rng(14)
+    n = 50
+    A = sparse.csr_matrix((1 + 0.01*rng.random(n),
+                           (np.arange(n), (np.arange(n) + 1) % n)),
+                          shape=(n, n))
+    G = sparse_specializer.DirectedGraph(A, weighted=True)
+    G.coloring()
+    assert len(G.colors) == n
+    error = G.quasi_coloring(0.05)
+    assert len(G.colors) == 1 and error < 0.01
+    with pytest.raises(ValueError):
+        G.quasi_coloring(-1)
+
+
+def test_color_many_matches_each_graph():
+    rng = np.random.default_rng(16)
+    graphs = [sparse.csr_matrix(random_graph(rng, int(rng.integers(1, 12))),
+                                dtype=int) for _ in range(20)]
+    # identical graphs next to each other, and a graph without nodes
+    graphs = graphs[:5] + [graphs[5]]*3 + [sparse.csr_matrix((0, 0))] \
+        + graphs[6:]
+    initial = [rng.integers(0, 2, G.shape[0]) for G in graphs]
+    for seeds in (None, initial):
+        batched = refinement.color_many(graphs, engine='vectorized',
+                                        initial=seeds)
+        assert len(batched) == len(graphs)
+        for g, (G, colors) in enumerate(zip(graphs, batched)):
+            alone = refinement.equitable_coloring(
+                G, initial=None if seeds is None else seeds[g])
+            assert np.array_equal(colors, alone)
+
+    # the cells of identical graphs stay apart in the stacked coloring
+    offsets = np.concatenate(([0], np.cumsum([G.shape[0] for G in graphs])))
+    colors = refinement.color_blocks(sparse.block_diag(graphs, format='csr'),
+                                     offsets)
+    blocks = np.split(colors, offsets[1:-1])
+    assert not set(blocks[5]) & set(blocks[6])
+    assert same_partition(blocks[5], blocks[6])
+
+
+def test_color_many_stacked_array():
+    rng = np.random.default_rng(17)
+    graphs = rng.random((30, 7, 7)) < 0.3
+    graphs[:, np.arange(7), np.arange(7)] = False
+    graphs[1] = graphs[0]
+    batched = refinement.color_many(graphs)
+    for G, colors in zip(graphs, batched):
+        alone = refinement.equitable_coloring(sparse.csr_matrix(G, dtype=int))
+        assert np.array_equal(colors, alone)
+    empty = refinement.color_many(np.zeros((3, 0, 0), dtype=bool))
+    assert len(empty) == 3 and all(colors.size == 0 for colors in empty)
@@ -0,0 +1,138 @@
+# test_specialize.py
+import warnings
+import numpy as np
+import pytest
+import networkx as nx
+from scipy import sparse
+import refinement
+import specializer
+import sparse_specializer
+
+warnings.filterwarnings('ignore', category=sparse.SparseEfficiencyWarning)
+
+
+def random_graph(rng, n, p=0.3, weights=(1,)):
+    A = (rng.random((n, n)) < p) * rng.choice(weights, (n, n))
+    np.fill_diagonal(A, 0)
+    return A.astype(float)
+
+
+def random_cases(count, seed=0, max_n=10, weights=(1,)):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        n = int(rng.integers(2, max_n))
+        A = random_graph(rng, n, weights=weights)
+        base = sorted(rng.choice(n, int(rng.integers(1, n + 1)),
+                                 replace=False).tolist())
+        yield A, base
+
+
+def same_specialization(G, H):
+    """
+    Checks that two specialized graphs are equal up to the numbering of the
+    copies, which depends on the order components are found in: there must
+    be an isomorphism that maps every node to a copy of the same node.
+    """
+    graphs = []
+    for K in (G, H):
+        D = nx.DiGraph(sparse.csr_matrix(K.A).T)
+        for i in range(K.n):
+            D.nodes[i]['node'] = K.labeler[i].split('.')[0]
+        graphs.append(D)
+    return nx.is_isomorphic(
+        *graphs, node_match=lambda a, b: a['node'] == b['node'],
+        edge_match=lambda a, b: a['weight'] == b['weight'])
+
+
+def cycle(n):
+    return sparse.csr_matrix((np.ones(n), (np.arange(n), (np.arange(n) - 1) % n)),
+                             shape=(n, n))
+
+
+def test_sparse_matches_dense_specialize():
+    # the dense specializer still assembles with block_diag and link tuples
+    for A, base in random_cases(150):
+        G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A))
+        G.specialize(list(base))
+        H = specializer.DirectedGraph(A.copy(), None)
+        H.specialize(list(base), recolor=False)
+        assert isinstance(G.A, sparse.csr_matrix)
+        assert same_specialization(G, H)
+
+
+def test_specialize_keeps_weights():
+    # copies keep the weights of the component edges, links get weight 1
+    for A, base in random_cases(100, seed=1, weights=(1, 2.5)):
+        G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A),
+                                             weighted=True)
+        G.specialize(list(base))
+        H = sparse_specializer.DirectedGraph(sparse.csr_matrix(A != 0))
+        H.specialize(list(base))
+        assert G.labeler == H.labeler
+        assert np.array_equal(G.A.toarray() != 0, H.A.toarray() != 0)
+        S = G.A.tocoo()
+        for i, j, w in zip(S.row, S.col, S.data):
+            (p, _, a), (q, _, b) = (G.labeler[i].partition('.'),
+                                    G.labeler[j].partition('.'))
+            expected = A[int(p), int(q)] if a == b else 1
+            assert w == expected
+
+
+@pytest.mark.parametrize('n', [60, 63, 64, 65, 200])
+def test_specialize_long_cycle(n):
+    # a path through the cycle has n link steps, more than an ndarray can
+    # have dimensions
+    G = sparse_specializer.DirectedGraph(cycle(n))
+    G.specialize([0])
+    assert G.n == n
+    assert abs(G.A - cycle(n)).sum() == 0
+
+
+def same_partition(a, b):
+    # equal partitions, up to the names of the colors
+    a, b = np.asarray(a), np.asarray(b)
+    return len(set(zip(a, b))) == len(set(a)) == len(set(b))
+
+
+def test_recolor_matches_coloring_weighted():
+    # fractional weights that truncating to int would merge or drop
+    for A, base in random_cases(60, seed=3, weights=(0.5, 1.5, 2.5)):
+        H = specializer.DirectedGraph(A.copy(), None)
+        H.specialize(list(base))
+        K = specializer.DirectedGraph(H.A.copy(), None)
+        K.coloring()
+        assert same_partition(H.colors.color, K.colors.color)
+
+
+def test_dense_seeded_coloring_default_engine():
+    # the default pairwise engine has no initial colors or edge types, so
+    # these options go to the worklist engine
+    rng = np.random.default_rng(4)
+    for A, _ in random_cases(40, seed=4):
+        seed = list(rng.integers(0, 2, A.shape[0]))
+        edge_key = sparse.csr_matrix(A * rng.integers(1, 3, A.shape))
+        for options in (dict(seed=seed), dict(edge_key=edge_key)):
+            H = specializer.DirectedGraph(A.copy(), None)
+            H.coloring(**options)
+            G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A))
+            G.coloring(**options)
+            assert same_partition(H.colors.color, G.colors.color)
+
+
+@pytest.mark.parametrize('module', [specializer, sparse_specializer])
+def test_seeded_typed_coloring_is_equitable(module):
+    rng = np.random.default_rng(5)
+    for A, _ in random_cases(40, seed=5, max_n=14, weights=(1, 2)):
+        n = A.shape[0]
+        seed = rng.integers(0, 3, n)
+        types = (A != 0) * rng.integers(1, 4, A.shape)
+        G = (module.DirectedGraph(A.copy(), None) if module is specializer
+             else module.DirectedGraph(sparse.csr_matrix(A)))
+        G.coloring(seed=list(seed), edge_key=sparse.csr_matrix(types))
+        colors = G.colors.color
+        # equitable for the edges of each type on their own
+        for t in range(1, 4):
+            assert not refinement.equitability_violations(A * (types == t),
+                                                          colors)
+        # every cell lies inside one seed class
+        assert len(set(zip(colors, seed))) == len(G.colors)
@@ -0,0 +1,81 @@
+# test_specialized_operator.py
+import copy
+import numpy as np
+from scipy import sparse
+import sparse_specializer
+from test_specialize import random_cases
+
+
+def operator_and_matrix(A, base):
+    """
+    Returns:
+        S (SpecializedOperator): the operator of the specialized graph
+        M (ndarray): the matrix specialize(base) builds
+    """
+    G = sparse_specializer.DirectedGraph(sparse.csr_matrix(A), weighted=True)
+    S = G.specialized_operator(list(base))
+    H = copy.deepcopy(G)
+    H.specialize(list(base))
+    return S, H.A.toarray()
+
+
+def test_products_match_specialize():
+    rng = np.random.default_rng(0)
+    for A, base in random_cases(80, weights=(1, 2.5)):
+        S, M = operator_and_matrix(A, base)
+        assert S.shape == M.shape
+        X = rng.random((M.shape[0], 3))
+        assert np.allclose(S @ X, M @ X)
+        assert np.allclose(S.rmatmat(X), M.T @ X)
+        assert np.allclose(S @ X[:, 0], M @ X[:, 0])
+        assert np.allclose(S.rmatvec(X[:, 0]), M.T @ X[:, 0])
+
+
+def test_iterate_matches_specialize():
+    rng = np.random.default_rng(1)
+    for A, base in random_cases(40, seed=1):
+        S, M = operator_and_matrix(A, base)
+        x = rng.random(M.shape[0])
+        t = S.iterate(6, x, a=0.5)
+        for i in range(6):
+            assert np.allclose(t[i], x)
+            x = 0.5*x + M @ x
+
+
+def test_spectral_radius_matches_specialize():
+    for A, base in random_cases(60, seed=2):
+        S, M = operator_and_matrix(A, base)
+        expected = np.max(np.abs(np.linalg.eigvals(M)))
+        assert np.isclose(S.spectral_radius(), expected, atol=1e-8)
+
+
+def test_acyclic_spectral_radius_is_zero():
+    # ARPACK only finds the eigenvalue of a nilpotent matrix up to its
+    # tolerance, which left noise of about 1e-5
+    for A, base in random_cases(60, seed=3, max_n=14):
+        A = np.triu(A, 1)
+        S, M = operator_and_matrix(A, base)
+        assert S.spectral_radius() == 0
+    # the cycle 0 -> 1 -> 2 -> 0 only closes through the branches
+    A = np.zeros((4, 4))
+    A[1, 0] = A[2, 1] = A[0, 2] = A[3, 2] = 1
+    S, M = operator_and_matrix(A, [0])
+    assert np.isclose(S.spectral_radius(), 1)
+
+
+def test_eigen_centrality_matches_specialize():
+    checked = 0
+    for A, base in random_cases(60, seed=4):
+        S, M = operator_and_matrix(A, base)
+        values, vectors = np.linalg.eig(M + np.eye(M.shape[0]))
+        order = np.argsort(values.real)
+        p = vectors[:, order[-1]]
+        # the dominant eigenvector is only unique up to a multiple when the
+        # dominant eigenvalue is simple
+        if (M.shape[0] > 1 and values[order[-1]].real
+                - values[order[-2]].real < 1e-3) or abs(p.sum()) < 1e-8:
+            continue
+        assert np.allclose(S.eigen_centrality(), np.real(p / p.sum()),
+                           atol=1e-8)
+        checked += 1
+    assert checked >= 20
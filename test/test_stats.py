@@ -1,7 +1,11 @@
 # test_coloring.py
 import sys
 sys.path.insert(0,'/home/adam/Documents/Research/NetworkSpecialization/core/')
+import pytest
 import specializer as spec
+# statistics needs both to import
+pytest.importorskip('progressbar')
+pytest.importorskip('mpi4py')
 import statistics as stats
 import numpy as np
 import random
@@ -21,6 +25,8 @@ def random_matrix(n):
 
     return (A, f, a)
 
+@pytest.mark.skip(reason='shows histograms to look at by hand; run it '
+                         'with the number of nodes and specializations')
 def test(n,iters):
     A,f,a = random_matrix(n)
     labels = [str(i) for i in range(1,n+1)]
@@ -0,0 +1,97 @@
+# test_temporal.py
+import numpy as np
+import pytest
+from scipy import sparse
+import refinement
+import sparse_specializer
+from temporal import window_colorings, WindowDiff
+from test_specialize import same_partition
+from test_incremental import refines
+
+
+def random_stream(seed, n=8, m=120, weights=(1,)):
+    """
+    Returns:
+        chunks (list(tuple(ndarray))): random timestamped edges in order of
+            time, in chunks of random sizes
+        edges (tuple(ndarray)): all the edges, (receivers, senders, times,
+            weights)
+    """
+    rng = np.random.default_rng(seed)
+    edges = (rng.integers(0, n, m), rng.integers(0, n, m),
+             np.sort(rng.integers(0, 40, m)).astype(float),
+             rng.choice(weights, m).astype(float))
+    cuts = np.sort(rng.choice(np.arange(1, m), 6, replace=False))
+    chunks = list(zip(*(np.split(a, cuts) for a in edges)))
+    return chunks, edges
+
+
+def window_matrix(edges, n, end, window, directed, weighted):
+    receivers, senders, times, weights = edges
+    keep = (times >= end - window) & (times < end) & (receivers != senders)
+    rows, cols, w = receivers[keep], senders[keep], weights[keep]
+    if not directed:
+        rows, cols, w = (np.concatenate((rows, cols)),
+                         np.concatenate((cols, rows)), np.concatenate((w, w)))
+    if not weighted:
+        w = np.ones(rows.size)
+    A = sparse.csr_matrix((w, (rows, cols)), shape=(n, n))
+    if not weighted:
+        A.data[:] = 1
+    A.eliminate_zeros()
+    return A
+
+
+@pytest.mark.parametrize('directed', [True, False])
+@pytest.mark.parametrize('weighted', [False, True])
+@pytest.mark.parametrize('exact', [False, True])
+def test_snapshots_match_coloring(directed, weighted, exact):
+    # signed binary fractions add up exactly in any order
+    weights = (-2, -1, 0.5, 1, 3) if weighted else (1,)
+    for seed in range(6):
+        chunks, edges = random_stream(seed, weights=weights)
+        snapshots = 0
+        for end, colors in window_colorings(chunks, 8, 7, 3,
+                                            directed=directed,
+                                            weighted=weighted, exact=exact):
+            A = window_matrix(edges, 8, end, 7, directed, weighted)
+            H = sparse_specializer.DirectedGraph(A, weighted=weighted)
+            H.coloring()
+            assert not refinement.equitability_violations(A, colors.color)
+            assert refines(colors.color, H.colors.color)
+            if exact:
+                assert same_partition(colors.color, H.colors.color)
+            snapshots += 1
+        assert snapshots >= 12
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_diffs_rebuild_snapshots(weighted):
+    weights = (-1, 0.5, 2) if weighted else (1,)
+    for seed in range(6):
+        chunks, _ = random_stream(seed, weights=weights)
+        full = window_colorings(chunks, 8, 5, 2, weighted=weighted)
+        changes = window_colorings(chunks, 8, 5, 2, weighted=weighted,
+                                   diffs=True)
+        labels = None
+        for (end, colors), (time, diff) in zip(full, changes):
+            assert end == time
+            expected = colors.order[colors.offsets[:-1]][colors.color]
+            if labels is None:
+                labels = diff.order[diff.offsets[:-1]][diff.color]
+            else:
+                assert isinstance(diff, WindowDiff)
+                labels[diff.nodes] = diff.labels
+            assert np.array_equal(labels, expected)
+
+
+def test_cancelling_weights_leave_the_window():
+    # two copies of an edge whose weights cancel, so the graph has no edge
+    # while both are in the window
+    chunks = [(np.array([0, 0, 1]), np.array([1, 1, 2]),
+               np.array([0., 1., 6.]), np.array([1., -1., 1.]))]
+    snapshots = list(window_colorings(chunks, 3, 4, 2, start=0.,
+                                      weighted=True, exact=True))
+    assert [end for end, _ in snapshots] == [4., 6., 8.]
+    # 0 and 1 never receive anything before 1 <- 2 enters
+    assert [len(colors) for _, colors in snapshots] == [1, 1, 2]